@@ -1,9 +1,10 @@
+import os
 from flask import Flask
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from config import Config
 from models import mongo
-from routes import auth_bp
+from routes import auth_bp, get_song_pool
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -16,6 +17,11 @@ CORS(app, origins=["http://localhost:5173"])  # Adjust frontend URL
 # Register routes
 app.register_blueprint(auth_bp, url_prefix='/')
 
+# Start filling the song pool in the serving process only (the reloader's
+# watching process runs this module too, but never serves requests)
+if __name__ != "__main__" or os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+    get_song_pool()
+
 if __name__ == "__main__":
     app.run(debug=True)
 
@@ -0,0 +1,176 @@
+import json
+import sqlite3
+import threading
+import time
+import traceback
+import uuid
+
+# Job states, in order
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    params TEXT NOT NULL,
+    result BLOB,
+    error TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL,
+    owner TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+# Columns added after the first schema, for databases created before them
+ADDED_COLUMNS = {'owner': 'TEXT', 'heartbeat': 'REAL'}
+
+class JobQueue:
+    """
+    Persistent job queue backed by SQLite, run by a bounded pool of worker threads.
+
+    Jobs survive restarts: a running job is leased by the queue that claimed
+    it, which renews the lease while the job runs. Jobs whose lease expired
+    were cut off by a stop or crash and are queued again. Claiming a job is
+    atomic, so every job runs once while its queue is alive.
+    """
+
+    def __init__(self, db_path, handler, num_workers=2, max_age=24 * 3600, poll_interval=1.0, lease=60.0):
+        """
+        Open the queue and start the workers.
+
+        Args:
+            db_path (str): SQLite database file
+            handler (callable): Runs a job: handler(params) -> result bytes
+            num_workers (int): Jobs run at once
+            max_age (float): Seconds finished jobs are kept
+            poll_interval (float): Seconds between checks for jobs queued by other processes
+            lease (float): Seconds a running job stays claimed without a renewal
+        """
+        self.db_path = db_path
+        self.handler = handler
+        self.max_age = max_age
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.owner = uuid.uuid4().hex
+        self.wakeup = threading.Condition()
+        self.closed = False
+        self.stopped = threading.Event()
+        self.local = threading.local()
+
+        db = self.connect()
+        db.executescript(SCHEMA)
+        columns = {row['name'] for row in db.execute("PRAGMA table_info(jobs)")}
+        for name, column_type in ADDED_COLUMNS.items():
+            if name not in columns:
+                db.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+
+        self.threads = [threading.Thread(target=self.work, daemon=True) for _ in range(num_workers)]
+        self.threads.append(threading.Thread(target=self.renew, daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def connect(self):
+        """Get the database connection of the calling thread."""
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.row_factory = sqlite3.Row
+            self.local.db = db
+        return db
+
+    def submit(self, params):
+        """Queue a job and return its id."""
+        job_id = uuid.uuid4().hex
+        db = self.connect()
+        db.execute("INSERT INTO jobs (id, status, params, created) VALUES (?, ?, ?, ?)",
+                   (job_id, QUEUED, json.dumps(params), time.time()))
+        db.execute("DELETE FROM jobs WHERE status IN (?, ?) AND finished < ?",
+                   (DONE, FAILED, time.time() - self.max_age))
+
+        with self.wakeup:
+            self.wakeup.notify()
+        return job_id
+
+    def status(self, job_id):
+        """Get the state of a job (None if unknown), with its position in the queue while queued."""
+        db = self.connect()
+        row = db.execute("SELECT id, status, params, error, created, started, finished FROM jobs WHERE id = ?",
+                         (job_id,)).fetchone()
+        if row is None:
+            return None
+
+        job = dict(row)
+        job['params'] = json.loads(job['params'])
+        if job['status'] == QUEUED:
+            job['position'] = db.execute("SELECT COUNT(*) FROM jobs WHERE status = ? AND created < ?",
+                                         (QUEUED, job['created'])).fetchone()[0]
+        return job
+
+    def result(self, job_id):
+        """Get the result bytes of a finished job (None until it is done)."""
+        row = self.connect().execute("SELECT result FROM jobs WHERE id = ? AND status = ?",
+                                     (job_id, DONE)).fetchone()
+        return None if row is None else row['result']
+
+    def claim(self):
+        """Mark the oldest queued job as running and return it (None if the queue is empty)."""
+        db = self.connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            # Queue the jobs of queues that stopped renewing their leases again
+            # (jobs left running before leases existed have no heartbeat)
+            now = time.time()
+            db.execute("UPDATE jobs SET status = ?, started = NULL, owner = NULL "
+                       "WHERE status = ? AND COALESCE(heartbeat, started, 0) < ?",
+                       (QUEUED, RUNNING, now - self.lease))
+
+            row = db.execute("SELECT id, params FROM jobs WHERE status = ? ORDER BY created LIMIT 1",
+                             (QUEUED,)).fetchone()
+            if row is not None:
+                db.execute("UPDATE jobs SET status = ?, started = ?, owner = ?, heartbeat = ? WHERE id = ?",
+                           (RUNNING, now, self.owner, now, row['id']))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return row
+
+    def work(self):
+        """Run queued jobs until the queue is closed."""
+        while not self.closed:
+            job = self.claim()
+            if job is None:
+                with self.wakeup:
+                    self.wakeup.wait(self.poll_interval)
+                continue
+
+            # A job whose lease was lost has been queued again, so its
+            # outcome is only recorded while this queue still owns it
+            try:
+                result = self.handler(json.loads(job['params']))
+                self.connect().execute("UPDATE jobs SET status = ?, result = ?, finished = ? WHERE id = ? AND owner = ?",
+                                       (DONE, result, time.time(), job['id'], self.owner))
+            except Exception as e:
+                traceback.print_exc()
+                self.connect().execute("UPDATE jobs SET status = ?, error = ?, finished = ? WHERE id = ? AND owner = ?",
+                                       (FAILED, f"{type(e).__name__}: {e}", time.time(), job['id'], self.owner))
+
+    def renew(self):
+        """Renew the leases of the jobs this queue is running until it is closed."""
+        while not self.closed:
+            self.connect().execute("UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status = ?",
+                                   (time.time(), self.owner, RUNNING))
+            self.stopped.wait(self.lease / 3)
+
+    def close(self):
+        """Stop the workers once their current jobs finish."""
+        self.closed = True
+        self.stopped.set()
+        with self.wakeup:
+            self.wakeup.notify_all()
+        for thread in self.threads:
+            thread.join()
@@ -1,13 +1,18 @@
 import sys
 import os
+import io
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, send_file, stream_with_context
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from models import User, CloudStorage
 from config import cloudinary
-from model.generate import generate_midi
+from model.generate import compose_song, generate_song_audio, get_audio_params, get_song_cache, new_seed, stream_song
+from model.renderer import AUDIO_FORMATS, DEFAULT_TIER, FFMPEG, RENDER_TIERS, available_formats
+from jobs import JobQueue
+from song_pool import SongPool
+from single_flight import SharedStream, SingleFlight
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -79,30 +84,211 @@ def google_login():
 def logout():
     return jsonify({"msg": "Successfully logged out"}), 200
 
+# Pick the audio format from the Accept header; WAV unless the client asks
+# for another format that can be encoded here
+def negotiate_format(stream):
+    formats = available_formats(stream)
+    mimetypes = {AUDIO_FORMATS[name][0]: name for name in formats}
+    best = request.accept_mimetypes.best_match(list(mimetypes), default=AUDIO_FORMATS['wav'][0])
+    return mimetypes.get(best, 'wav')
+
+# Tempo and scale type of each mood (other moods get 120 BPM major)
+MOODS = {
+    'Cheerful': (130, 0),
+    'Sorrow': (104, 1),
+    'Up Lifting': (120, 0),
+    'Dark': (100, 1)
+}
+
+# Tempo, scale, tier and seed of a song request, or an error response
+# The same settings and seed always give the same song
+def get_song_settings(data):
+    mood = data.get('mood')
+    song_number = data.get('song_number')
+    tier = data.get('tier', 'master')
+    seed = data.get('seed')
+
+    if song_number > 5:
+        return None, (jsonify({"msg": "Song Limit reached!!"}), 200)
+
+    if tier not in RENDER_TIERS:
+        return None, (jsonify({"msg": f"Unknown tier: {tier}"}), 400)
+
+    if seed is not None and (type(seed) is not int or not 0 <= seed < 2 ** 32):
+        return None, (jsonify({"msg": "Seed must be an integer from 0 to 2**32 - 1"}), 400)
+
+    tempo, scale_type = MOODS.get(mood, (120, 0))
+    return {"mood": mood, "tempo": tempo, "scale_type": scale_type, "tier": tier, "seed": seed}, None
+
+# Songs are pre-generated per mood while the server is idle, so most
+# requests are served from the pool instead of waiting for generation
+song_pool = None
+
+def generate_pool_song(mood, tier, audio_format):
+    tempo, scale_type = MOODS[mood]
+    return generate_song_audio(tempo, scale_type, tier, audio_format)
+
+def get_song_pool():
+    global song_pool
+    if song_pool is None:
+        # Kept ready from the start in the format the frontend prefers
+        audio_format = os.environ.get("SONG_POOL_FORMAT", "mp3" if FFMPEG else "flac")
+        song_pool = SongPool(
+            os.environ.get("SONG_POOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "song_pool")),
+            generate_pool_song,
+            size=int(os.environ.get("SONG_POOL_SIZE", 2)),
+            keys=[(mood, DEFAULT_TIER, audio_format) for mood in MOODS],
+            idle_requests=int(os.environ.get("SONG_POOL_IDLE_REQUESTS", 0))
+        )
+    return song_pool
+
+# Count a streamed song as a running request until it has been sent
+def stream_busy(chunks):
+    with get_song_pool().busy():
+        yield from chunks
+
+# Identical requests in flight at once (client retries and double submits)
+# share one generation
+song_flights = SingleFlight()
+
+# Get the audio of a song request: a dict with the audio format, the seed,
+# and the audio bytes or, if streamed, a SharedStream of them
+def make_song(settings, stream, flight_key):
+    tempo, scale_type, tier = settings['tempo'], settings['scale_type'], settings['tier']
+    seed = new_seed() if settings['seed'] is None else settings['seed']
+
+    # Any fresh song of the mood will do unless the client asks for a seed;
+    # pooled songs are whole files, so they need not be in a streamable format
+    if settings['seed'] is None and settings['mood'] in MOODS:
+        audio_format = negotiate_format(False)
+        song = get_song_pool().take(settings['mood'], tier, audio_format)
+        if song is not None:
+            return {"audio_format": audio_format, "audio": song[0], "seed": song[1]}
+
+    # Otherwise the song is composed and rendered in memory, or loaded from the song cache
+    audio_format = negotiate_format(stream)
+    if not stream:
+        with get_song_pool().busy():
+            audio, seed = generate_song_audio(tempo, scale_type, tier, audio_format, seed)
+        return {"audio_format": audio_format, "audio": audio, "seed": seed}
+
+    # Stream the audio while it renders, unless it is already cached
+    with get_song_pool().busy():
+        midi_file, midi_hash = compose_song(tempo, scale_type, seed)
+    audio = get_song_cache().get(get_audio_params(midi_hash, tier, audio_format))
+    if audio is not None:
+        return {"audio_format": audio_format, "audio": audio, "seed": seed}
+
+    chunks = stream_busy(stream_song(midi_file, tier, audio_format))
+    return {"audio_format": audio_format, "stream": SharedStream(chunks, lambda: song_flights.forget(flight_key)), "seed": seed}
+
 @auth_bp.route('/<id>/generate-song', methods=['POST'])
 def generate_song(id):
-    mood = request.json.get('mood')
+    settings, error = get_song_settings(request.json)
+    if error:
+        return error
     song_number = request.json.get('song_number')
-    tempo = 120
-    scale_type = 0
-
-    if song_number > 5:
-        return jsonify({"msg": "Song Limit reached!!"}), 200
-
-
-    if mood == 'Cheerful':
-        tempo = 130
-    elif mood == 'Sorrow':
-        tempo = 104
-        scale_type = 1
-    elif mood == 'Up Lifting':
-        tempo = 120
-        scale_type = 0
-    elif mood == 'Dark':
-        tempo = 100
-        scale_type = 1
+    stream = request.json.get('stream', True)
     
-    generate_midi(tempo=tempo, output_file=f"{id}-{song_number}", scale_type=scale_type)
+    # Streams stay in flight until they are fully rendered
+    flight_key = (id, song_number, stream, request.headers.get('Accept'), tuple(sorted(settings.items())))
+    song, shared = song_flights.do(flight_key, lambda: make_song(settings, stream, flight_key), keep=stream)
+    if "stream" in song:
+        reader = song['stream'].open()
+    if shared:
+        print(f"Joined an identical in-flight generation of song {song_number} for {id}")
+    if "audio" in song:
+        song_flights.forget(flight_key)
+
+    mimetype, extension = AUDIO_FORMATS[song['audio_format']]
+    file_name = f"{id}-{song_number}.{extension}"
+    headers = {"Vary": "Accept", "X-Song-Seed": str(song['seed'])}
+
+    if "stream" in song:
+        headers["Content-Disposition"] = f"attachment; filename={file_name}"
+        return Response(stream_with_context(reader), mimetype=mimetype, headers=headers)
+
+    response = send_file(io.BytesIO(song['audio']), mimetype=mimetype, as_attachment=True, download_name=file_name)
+    response.headers.update(headers)
+    return response, 200
+
+# Song jobs run on a bounded worker pool, outside the request threads, and
+# are kept in a local SQLite queue
+song_jobs = None
+
+def run_song_job(params):
+    with get_song_pool().busy():
+        audio, _ = generate_song_audio(params['tempo'], params['scale_type'], params['tier'],
+                                       params['audio_format'], params['seed'])
+    return audio
+
+def get_song_jobs():
+    global song_jobs
+    if song_jobs is None:
+        song_jobs = JobQueue(
+            os.environ.get("SONG_JOBS_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "song_jobs.db")),
+            run_song_job,
+            num_workers=int(os.environ.get("SONG_JOB_WORKERS", 2))
+        )
+    return song_jobs
+
+# Queue a song and return its job id right away
+@auth_bp.route('/<id>/song-jobs', methods=['POST'])
+def create_song_job(id):
+    settings, error = get_song_settings(request.json)
+    if error:
+        return error
+
+    audio_format = negotiate_format(False)
+    settings.update({
+        "user": id,
+        "song_number": request.json.get('song_number'),
+        "audio_format": audio_format,
+        "seed": new_seed() if settings['seed'] is None else settings['seed']
+    })
+    job_id = get_song_jobs().submit(settings)
+    return jsonify({"job_id": job_id, "status": "queued", "status_url": f"/song-jobs/{job_id}"}), 202
+
+# Status of a song job
+@auth_bp.route('/song-jobs/<job_id>', methods=['GET'])
+def song_job_status(job_id):
+    job = get_song_jobs().status(job_id)
+    if job is None:
+        return jsonify({"msg": "Unknown job"}), 404
+
+    response = {key: job[key] for key in ("status", "created", "started", "finished")}
+    response["job_id"] = job_id
+    response["seed"] = job["params"]["seed"]
+    if "position" in job:
+        response["position"] = job["position"]
+    if job["status"] == "done":
+        response["result_url"] = f"/song-jobs/{job_id}/result"
+    if job["status"] == "failed":
+        response["error"] = job["error"]
+    return jsonify(response), 200
+
+# Audio of a finished song job
+@auth_bp.route('/song-jobs/<job_id>/result', methods=['GET'])
+def song_job_result(job_id):
+    job = get_song_jobs().status(job_id)
+    if job is None:
+        return jsonify({"msg": "Unknown job"}), 404
+    if job["status"] != "done":
+        return jsonify({"msg": f"Job is {job['status']}", "status": job["status"]}), 409
+
+    params = job["params"]
+    mimetype, extension = AUDIO_FORMATS[params["audio_format"]]
+    file_name = f"{params['user']}-{params['song_number']}.{extension}"
+    audio = get_song_jobs().result(job_id)
+    return send_file(io.BytesIO(audio), mimetype=mimetype, as_attachment=True, download_name=file_name), 200
+
+# Size and hit rate of the song cache
+@auth_bp.route('/song-cache/stats', methods=['GET'])
+def song_cache_stats():
+    return jsonify(get_song_cache().stats()), 200
 
-    file_path = f"{id}-{song_number}.wav"
-    return send_file(file_path, as_attachment=True), 200
\ No newline at end of file
+# Ready songs of each mood in the song pool
+@auth_bp.route('/song-pool/stats', methods=['GET'])
+def song_pool_stats():
+    pool = get_song_pool()
+    return jsonify({"size": pool.size, "pools": pool.depth()}), 200
@@ -0,0 +1,158 @@
+import threading
+
+class Call:
+    """In-flight computation shared by the requests waiting on it."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Runs identical concurrent computations once.
+
+    The first caller of a key runs the computation; callers of the same key
+    arriving before it finishes wait and get the same result (or exception).
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, function, keep=False):
+        """
+        Run function() once for all concurrent callers of key.
+
+        Args:
+            key (hashable): Identity of the computation
+            function (callable): Computes the result
+            keep (bool): Keep the key in flight after the result is ready, until forget(key)
+
+        Returns:
+            tuple: (result, whether it came from another caller's computation)
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            shared = call is not None
+            if not shared:
+                call = self.calls[key] = Call()
+
+        if shared:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = function()
+        except Exception as e:
+            call.error = e
+            keep = False
+            raise
+        finally:
+            if not keep:
+                self.forget(key)
+            call.done.set()
+        return call.result, False
+
+    def forget(self, key):
+        """Let the next caller of key start a new computation."""
+        with self.lock:
+            self.calls.pop(key, None)
+
+class SharedStream:
+    """
+    Stream of chunks that several readers iterate from the start.
+
+    Whichever reader is furthest along pulls the next chunk from the source,
+    so the stream keeps going when any one reader stops; the source is
+    closed when every reader has stopped. Readers count from the moment
+    they are opened, so a waiting request keeps the stream alive before it
+    starts reading. A reader opened after the source was abandoned gets an
+    error instead of a truncated stream.
+    """
+
+    def __init__(self, chunks, on_close=None):
+        """
+        Wrap a source of chunks.
+
+        Args:
+            chunks (iterable): Source chunks, read once
+            on_close (callable): Called once the source is exhausted, fails
+                or is abandoned
+        """
+        self.source = iter(chunks)
+        self.on_close = on_close
+        self.chunks = []
+        self.lock = threading.Lock()
+        self.finished = False
+        self.error = None
+        self.readers = 0
+
+    def pull(self, index):
+        """Read source chunks until chunk index exists or the source ends."""
+        with self.lock:
+            while len(self.chunks) <= index and not self.finished:
+                try:
+                    self.chunks.append(next(self.source))
+                except StopIteration:
+                    self.close()
+                except Exception as e:
+                    self.error = e
+                    self.close()
+
+    def close(self):
+        """Mark the source as finished."""
+        self.finished = True
+        if self.on_close is not None:
+            self.on_close()
+
+    def open(self):
+        """Open a reader of the stream from the start."""
+        with self.lock:
+            self.readers += 1
+        return StreamReader(self)
+
+    def leave(self):
+        """Stop reading, closing the source if no reader is left."""
+        with self.lock:
+            self.readers -= 1
+            if self.readers == 0 and not self.finished:
+                if hasattr(self.source, 'close'):
+                    self.source.close()
+                self.error = RuntimeError("Stream was abandoned before it finished")
+                self.close()
+
+    def __iter__(self):
+        return self.open()
+
+class StreamReader:
+    """Reader of a SharedStream, which leaves the stream when it ends or is closed."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.index = 0
+        self.closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        stream = self.stream
+        if not self.closed:
+            if self.index >= len(stream.chunks):
+                stream.pull(self.index)
+            if self.index < len(stream.chunks):
+                self.index += 1
+                return stream.chunks[self.index - 1]
+            self.close()
+            if stream.error is not None:
+                raise stream.error
+        raise StopIteration
+
+    def close(self):
+        """Stop reading."""
+        if not self.closed:
+            self.closed = True
+            self.stream.leave()
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+
+from model.song_cache import write_atomic
+
+# Seconds after which a song claimed by a worker that died before deleting it is removed
+CLAIM_TIMEOUT = 60.0
+
+class SongPool:
+    """
+    Pool of ready-rendered songs per mood, refilled by a background thread.
+
+    Songs are kept as files named by their seed under <directory>/<mood>/<tier>-<format>.
+    Taking a song renames it before reading it, so each song goes to exactly
+    one request, even with several processes sharing the directory. The pool
+    only generates songs while few requests are running.
+    """
+
+    def __init__(self, directory, generate, size=2, keys=(), idle_requests=0, poll_interval=5.0):
+        """
+        Open the pool and start refilling it.
+
+        Args:
+            directory (str): Pool directory (created if missing)
+            generate (callable): Makes a song: generate(mood, tier, audio_format) -> (audio bytes, seed)
+            size (int): Songs kept ready per (mood, tier, format)
+            keys (iterable): (mood, tier, format) kept ready from the start; others are added when requested
+            idle_requests (int): Most running requests at which the pool still generates
+            poll_interval (float): Seconds between checks while the pool is full or busy
+        """
+        self.directory = directory
+        self.generate = generate
+        self.size = size
+        self.idle_requests = idle_requests
+        self.poll_interval = poll_interval
+        self.keys = list(dict.fromkeys(keys))
+        self.active = 0
+        self.condition = threading.Condition()
+        self.closed = False
+
+        self.thread = threading.Thread(target=self.fill, daemon=True)
+        self.thread.start()
+
+    def get_key_dir(self, key):
+        """Directory of the songs of a (mood, tier, format)."""
+        mood, tier, audio_format = key
+        return os.path.join(self.directory, mood, f"{tier}-{audio_format}")
+
+    def songs(self, key):
+        """Paths of the ready songs of a (mood, tier, format), oldest first."""
+        key_dir = self.get_key_dir(key)
+        os.makedirs(key_dir, exist_ok=True)
+
+        # Claims and partial writes are timed by their status change time,
+        # which renaming a song to claim it updates (unlike its modification time)
+        songs, now = [], time.time()
+        for name in os.listdir(key_dir):
+            path = os.path.join(key_dir, name)
+            try:
+                status = os.stat(path)
+            except OSError:
+                continue
+            if not name.startswith('.'):
+                songs.append((status.st_mtime, path))
+            elif now - status.st_ctime > CLAIM_TIMEOUT:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+        return [path for _, path in sorted(songs)]
+
+    def take(self, mood, tier, audio_format):
+        """Remove a ready song and return (audio bytes, seed), or None if there is none."""
+        key = (mood, tier, audio_format)
+        with self.condition:
+            if key not in self.keys:
+                self.keys.append(key)
+
+        for path in self.songs(key):
+            claimed_path = os.path.join(os.path.dirname(path), f".taken-{os.path.basename(path)}")
+            try:
+                os.rename(path, claimed_path)
+            except OSError:
+                continue
+
+            try:
+                with open(claimed_path, 'rb') as f:
+                    audio = f.read()
+            except FileNotFoundError:
+                continue
+            try:
+                os.unlink(claimed_path)
+            except FileNotFoundError:
+                pass
+
+            with self.condition:
+                self.condition.notify()
+            return audio, int(os.path.basename(path))
+        return None
+
+    @contextmanager
+    def busy(self):
+        """Count a running request, pausing refills while it runs."""
+        with self.condition:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.active -= 1
+                self.condition.notify()
+
+    def depth(self):
+        """Get the number of ready songs of each (mood, tier, format)."""
+        with self.condition:
+            keys = list(self.keys)
+        return [
+            {"mood": mood, "tier": tier, "audio_format": audio_format, "depth": len(self.songs((mood, tier, audio_format)))}
+            for mood, tier, audio_format in keys
+        ]
+
+    def next_key(self):
+        """Get the (mood, tier, format) with the fewest ready songs below the size (None if all are full)."""
+        with self.condition:
+            keys = list(self.keys)
+        depths = [(len(self.songs(key)), index) for index, key in enumerate(keys)]
+        depth, index = min(depths, default=(self.size, None))
+        return keys[index] if depth < self.size else None
+
+    def fill(self):
+        """Generate songs for the emptiest (mood, tier, format) until the pool is closed."""
+        while not self.closed:
+            with self.condition:
+                if self.active > self.idle_requests:
+                    self.condition.wait(self.poll_interval)
+                    continue
+
+            key = self.next_key()
+            if key is None:
+                with self.condition:
+                    self.condition.wait(self.poll_interval)
+                continue
+
+            try:
+                audio, seed = self.generate(*key)
+                # Other processes may have filled the key while this song was generated
+                if len(self.songs(key)) < self.size:
+                    write_atomic(os.path.join(self.get_key_dir(key), str(seed)), audio)
+            except Exception:
+                traceback.print_exc()
+                with self.condition:
+                    self.condition.wait(self.poll_interval)
+
+    def close(self):
+        """Stop refilling once the current song is done."""
+        self.closed = True
+        with self.condition:
+            self.condition.notify_all()
+        self.thread.join()
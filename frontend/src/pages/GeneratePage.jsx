@@ -25,7 +25,12 @@ const GeneratePage = () => {
       const response = await api.post(
         `/${userId}/generate-song`,
         { mood: selectedOption, song_number: 5 },
-        { responseType: "blob", timeout: 500000 }
+        {
+          responseType: "blob",
+          timeout: 500000,
+          // Compressed audio first; WAV is the fallback
+          headers: { Accept: "audio/mpeg, audio/ogg, audio/flac;q=0.9, audio/wav;q=0.5" },
+        }
       );
 
       setIsLoading(false);
@@ -1,10 +1,13 @@
 from .audio_effects import *
+from .automation import *
 from .harmony_generator import *
 from .listen import *
 from .melody_generator import *
+from .midi_optimizer import *
 from .midi_utils import *
 from .music_generator import *
 from .music_theory import *
+from .note_index import *
 from .rhythm_generator import *
 from .song_structure import *
 from .transitions import *
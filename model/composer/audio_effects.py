@@ -3,10 +3,12 @@ Audio effects module for the procedural music generation system.
 Provides functions for applying audio effects to MIDI tracks.
 """
 
-from .midi_utils import add_control_change, add_pitch_bend, add_modulation, add_expression
+from .midi_utils import add_control_change
+from .automation import apply_automation
 import random
 
-# MIDI CC numbers for common effects
+# MIDI CC numbers for common effects. Reverb, delay, distortion and the
+# filter are rendered by the SoundFont engine or by renderer/effects.py
 REVERB_CC = 91
 CHORUS_CC = 93
 DELAY_CC = 94
@@ -114,18 +116,9 @@ def apply_vibrato(track, depth, rate, duration, start_time, channel):
     # Number of steps for the vibrato
     num_steps = 16
     
-    # Calculate time between steps
-    time_step = duration // num_steps
-    
-    # Apply the vibrato
-    for i in range(num_steps + 1):
-        # Calculate modulation value using sine wave
-        value = depth * (0.5 + 0.5 * (i % 2))  # Simple alternating pattern
-        value = max(0, min(127, int(value)))
-        time = start_time + (i * time_step)
-        
-        # Add modulation
-        add_modulation(track, value, time, channel)
+    # Alternate the modulation between half and full depth on every step
+    apply_automation(track, MODULATION_CC, depth * 0.5, depth, duration, start_time, channel,
+                     num_steps=num_steps, shape='lfo', cycles=num_steps / 2)
 
 def apply_tremolo(track, depth, rate, duration, start_time, channel):
     """
@@ -142,21 +135,13 @@ def apply_tremolo(track, depth, rate, duration, start_time, channel):
     # Number of steps for the tremolo
     num_steps = 16
     
-    # Calculate time between steps
-    time_step = duration // num_steps
-    
     # Base expression value
     base_expression = 100
     
-    # Apply the tremolo
-    for i in range(num_steps + 1):
-        # Calculate expression value using sine wave
-        value = base_expression - depth * (0.5 + 0.5 * (i % 2))  # Simple alternating pattern
-        value = max(0, min(127, int(value)))
-        time = start_time + (i * time_step)
-        
-        # Add expression
-        add_expression(track, value, time, channel)
+    # Alternate the expression below the base value on every step
+    apply_automation(track, EXPRESSION_CC, base_expression - depth * 0.5, base_expression - depth,
+                     duration, start_time, channel,
+                     num_steps=num_steps, shape='lfo', cycles=num_steps / 2)
 
 def apply_filter_sweep(track, start_cutoff, end_cutoff, resonance, duration, start_time, channel):
     """
@@ -174,23 +159,12 @@ def apply_filter_sweep(track, start_cutoff, end_cutoff, resonance, duration, sta
     # Number of steps for the sweep
     num_steps = 16
     
-    # Calculate step size
-    step_size = (end_cutoff - start_cutoff) / num_steps
-    
-    # Calculate time between steps
-    time_step = duration // num_steps
-    
-    # Apply the sweep
-    for i in range(num_steps + 1):
-        value = int(start_cutoff + step_size * i)
-        value = max(0, min(127, value))
-        time = start_time + (i * time_step)
-        
-        # Add filter cutoff
-        add_control_change(track, FILTER_CUTOFF_CC, value, time, channel)
-        
-        # Add filter resonance
-        add_control_change(track, FILTER_RESONANCE_CC, resonance, time, channel)
+    # Add filter resonance (constant over the sweep, so it is sent once)
+    add_control_change(track, FILTER_RESONANCE_CC, resonance, start_time, channel)
+    
+    # Add filter cutoff
+    apply_automation(track, FILTER_CUTOFF_CC, start_cutoff, end_cutoff, duration, start_time, channel,
+                     num_steps=num_steps)
 
 def apply_pitch_bend_sweep(track, start_bend, end_bend, duration, start_time, channel):
     """
@@ -207,20 +181,9 @@ def apply_pitch_bend_sweep(track, start_bend, end_bend, duration, start_time, ch
     # Number of steps for the sweep
     num_steps = 16
     
-    # Calculate step size
-    step_size = (end_bend - start_bend) / num_steps
-    
-    # Calculate time between steps
-    time_step = duration // num_steps
-    
-    # Apply the sweep
-    for i in range(num_steps + 1):
-        value = int(start_bend + step_size * i)
-        value = max(-8192, min(8191, value))
-        time = start_time + (i * time_step)
-        
-        # Add pitch bend
-        add_pitch_bend(track, value, time, channel)
+    # Add pitch bend
+    apply_automation(track, None, start_bend, end_bend, duration, start_time, channel,
+                     num_steps=num_steps, resolution=14)
 
 def apply_volume_fade(track, start_volume, end_volume, duration, start_time, channel):
     """
@@ -237,20 +200,9 @@ def apply_volume_fade(track, start_volume, end_volume, duration, start_time, cha
     # Number of steps for the fade
     num_steps = 16
     
-    # Calculate step size
-    step_size = (end_volume - start_volume) / num_steps
-    
-    # Calculate time between steps
-    time_step = duration // num_steps
-    
-    # Apply the fade
-    for i in range(num_steps + 1):
-        value = int(start_volume + step_size * i)
-        value = max(0, min(127, value))
-        time = start_time + (i * time_step)
-        
-        # Add volume
-        add_control_change(track, VOLUME_CC, value, time, channel)
+    # Add volume
+    apply_automation(track, VOLUME_CC, start_volume, end_volume, duration, start_time, channel,
+                     num_steps=num_steps)
 
 def apply_pan_sweep(track, start_pan, end_pan, duration, start_time, channel):
     """
@@ -267,20 +219,9 @@ def apply_pan_sweep(track, start_pan, end_pan, duration, start_time, channel):
     # Number of steps for the sweep
     num_steps = 16
     
-    # Calculate step size
-    step_size = (end_pan - start_pan) / num_steps
-    
-    # Calculate time between steps
-    time_step = duration // num_steps
-    
-    # Apply the sweep
-    for i in range(num_steps + 1):
-        value = int(start_pan + step_size * i)
-        value = max(0, min(127, value))
-        time = start_time + (i * time_step)
-        
-        # Add pan
-        add_control_change(track, PAN_CC, value, time, channel)
+    # Add pan
+    apply_automation(track, PAN_CC, start_pan, end_pan, duration, start_time, channel,
+                     num_steps=num_steps)
 
 def apply_random_effects(track, intensity, duration, start_time, channel):
     """
@@ -0,0 +1,153 @@
+"""
+Automation module for the procedural music generation system.
+Provides functions for building controller automation curves and writing
+them to MIDI tracks.
+"""
+
+import numpy as np
+from .midi_utils import insert_events
+
+# Value ranges by controller resolution
+RESOLUTION_RANGES = {
+    7: (0, 127),         # Control change values
+    14: (-8192, 8191)    # Pitch bend values
+}
+
+def build_curve(start_value, end_value, num_steps=16, shape='linear', cycles=1.0):
+    """
+    Build an automation curve.
+    
+    Args:
+        start_value (float): Starting value (low value for LFO curves)
+        end_value (float): Ending value (high value for LFO curves)
+        num_steps (int): Number of steps (the curve has num_steps + 1 points)
+        shape (str): Curve shape ('linear', 'exponential' or 'lfo').
+            Exponential curves over negative values are linear.
+        cycles (float): Number of LFO cycles over the curve
+    
+    Returns:
+        ndarray: Curve values
+    """
+    positions = np.linspace(0.0, 1.0, num_steps + 1)
+    
+    if shape == 'linear':
+        return start_value + (end_value - start_value) * positions
+    
+    if shape == 'exponential':
+        if min(start_value, end_value) < 0:
+            # The log domain only covers non-negative ranges (not pitch bend)
+            return start_value + (end_value - start_value) * positions
+        # Interpolate in the log domain, offset by 1 so zero is a valid endpoint
+        ratio = (end_value + 1.0) / (start_value + 1.0)
+        return (start_value + 1.0) * ratio ** positions - 1.0
+    
+    if shape == 'lfo':
+        # Raised cosine oscillating between the start and end values
+        phase = 0.5 - 0.5 * np.cos(2.0 * np.pi * cycles * positions)
+        return start_value + (end_value - start_value) * phase
+    
+    raise ValueError(f"Unknown curve shape: {shape}")
+
+def build_times(duration, start_time, num_steps=16):
+    """
+    Build the tick positions of an automation curve.
+    
+    Args:
+        duration (int): Duration in ticks
+        start_time (int): Start time in ticks
+        num_steps (int): Number of steps
+    
+    Returns:
+        ndarray: Absolute times in ticks
+    """
+    time_step = duration // num_steps
+    return start_time + time_step * np.arange(num_steps + 1)
+
+def quantize_curve(values, resolution=7):
+    """
+    Quantize curve values to integer controller values.
+    
+    Args:
+        values (ndarray): Curve values
+        resolution (int): Controller resolution in bits (7 for control
+            changes, 14 for pitch bend)
+    
+    Returns:
+        ndarray: Quantized values
+    """
+    low, high = RESOLUTION_RANGES[resolution]
+    return np.clip(np.rint(values), low, high).astype(int)
+
+def thin_curve(times, values):
+    """
+    Drop automation points that do not change the controller value.
+    
+    When several points share a tick only the last one is kept, then points
+    that repeat the previous value are dropped.
+    
+    Args:
+        times (ndarray): Absolute times in ticks
+        values (ndarray): Quantized values
+    
+    Returns:
+        tuple: (times, values) of the remaining points
+    """
+    # Keep the last point of every tick
+    last_in_tick = np.append(times[1:] != times[:-1], True)
+    times = times[last_in_tick]
+    values = values[last_in_tick]
+    
+    # Keep points whose value differs from the previous point
+    changed = np.insert(values[1:] != values[:-1], 0, True)
+    return times[changed], values[changed]
+
+def write_automation(track, control, times, values, channel):
+    """
+    Write automation points to a track in a single insert.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        control (int): Control number (0-127), or None for pitch bend
+        times (ndarray): Absolute times in ticks
+        values (ndarray): Quantized values
+        channel (int): MIDI channel (0-15)
+    
+    Returns:
+        int: Number of events written
+    """
+    if control is None:
+        events = [(time, 'pitchwheel', channel, value, 0)
+                  for time, value in zip(times.tolist(), values.tolist())]
+    else:
+        events = [(time, 'control_change', channel, control, value)
+                  for time, value in zip(times.tolist(), values.tolist())]
+    
+    insert_events(track, events)
+    return len(events)
+
+def apply_automation(track, control, start_value, end_value, duration, start_time, channel,
+                     num_steps=16, shape='linear', cycles=1.0, resolution=7):
+    """
+    Build, quantize, thin and write an automation curve.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        control (int): Control number (0-127), or None for pitch bend
+        start_value (float): Starting value (low value for LFO curves)
+        end_value (float): Ending value (high value for LFO curves)
+        duration (int): Duration in ticks
+        start_time (int): Start time in ticks
+        channel (int): MIDI channel (0-15)
+        num_steps (int): Number of steps
+        shape (str): Curve shape ('linear', 'exponential' or 'lfo').
+            Exponential curves over negative values are linear.
+        cycles (float): Number of LFO cycles over the curve
+        resolution (int): Controller resolution in bits (7 or 14)
+    
+    Returns:
+        int: Number of events written
+    """
+    values = quantize_curve(build_curve(start_value, end_value, num_steps, shape, cycles), resolution)
+    times = build_times(duration, start_time, num_steps)
+    times, values = thin_curve(times, values)
+    return write_automation(track, control, times, values, channel)
@@ -1,13 +1,23 @@
 import subprocess
+from ..renderer import create_renderer
 
-def midi_to_wav(midi_file, sf2_file, output_wav):
+def midi_to_wav(midi_file, sf2_file, output_wav, tier=None):
     """
     Convert a MIDI file to WAV using a SoundFont (.sf2) file and FluidSynth.
     
     :param midi_file: Path to the input MIDI file.
     :param sf2_file: Path to the SoundFont (.sf2) file.
     :param output_wav: Path to the output WAV file.
+    :param tier: Render tier, e.g. 'preview' for quick listening passes
+        (see RENDER_TIERS). Full quality if None.
     """
+    if tier is not None:
+        renderer = create_renderer('fluidsynth', sf2_file, tier=tier)
+        timing = renderer.render(midi_file, output_wav)
+        renderer.close()
+        print(f"Conversion successful! WAV file saved at: {output_wav} (render {timing['render']:.2f}s)")
+        return
+    
     command = [
         "fluidsynth",
         "-ni", sf2_file,
@@ -32,7 +42,7 @@ selected2 = files[3]
 midi_file = f'{selected}.mid' 
 sf2_file = "../Sound Fonts/OmegaGMGS2.sf2" 
 output_wav = f"out/{selected}2.wav"  
-# midi_to_wav(midi_file, sf2_file, output_wav)
+# midi_to_wav(midi_file, sf2_file, output_wav, tier='preview')
 
 midi_file = f'{selected2}.mid' 
 sf2_file = "../Sound Fonts/OmegaGMGS2.sf2" 
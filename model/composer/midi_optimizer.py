@@ -0,0 +1,184 @@
+"""
+MIDI optimizer module for the procedural music generation system.
+Provides a pass that removes redundant events from a finished MIDI file.
+"""
+
+from collections import defaultdict, deque
+from .midi_utils import get_event_order
+
+def get_timeline(midi_file):
+    """
+    Get every message of a MIDI file in playback order.
+    
+    Args:
+        midi_file (MidiFile): MIDI file object with delta times
+    
+    Returns:
+        list: List of (time, track index, position, message) tuples
+    """
+    timeline = []
+    for track_index, track in enumerate(midi_file.tracks):
+        absolute_time = 0
+        for position, msg in enumerate(track):
+            absolute_time += msg.time
+            timeline.append((absolute_time, get_event_order(msg), track_index, position, msg))
+    
+    timeline.sort(key=lambda x: x[:4])
+    return [(time, track_index, position, msg) for time, _, track_index, position, msg in timeline]
+
+def find_duplicate_notes(timeline):
+    """
+    Find events of overlapping notes with the same channel and pitch.
+    
+    Notes that start on the same tick as another sounding note lose their
+    note-on. When notes overlap, only the note-off of the note that ends
+    last is kept, so an earlier note-off never cuts a retriggered note short.
+    
+    Args:
+        timeline (list): List of (time, track index, position, message) tuples
+    
+    Returns:
+        set: (track index, position) of the events to remove
+    """
+    # Pair note-ons with note-offs per channel and pitch
+    notes = defaultdict(list)
+    open_notes = defaultdict(deque)
+    for time, track_index, position, msg in timeline:
+        if msg.type == 'note_on' and msg.velocity > 0:
+            open_notes[(msg.channel, msg.note)].append((time, (track_index, position)))
+        elif msg.type == 'note_off' or msg.type == 'note_on':
+            key = (msg.channel, msg.note)
+            if open_notes[key]:
+                start, note_on = open_notes[key].popleft()
+                notes[key].append((start, time, note_on, (track_index, position)))
+    
+    removed = set()
+    for key_notes in notes.values():
+        key_notes.sort(key=lambda x: x[0])
+        
+        group_end = None
+        group_off = None
+        last_attack = None
+        for start, end, note_on, note_off in key_notes:
+            if group_end is None or start >= group_end:
+                # No overlap: start a new group of notes
+                group_end, group_off, last_attack = end, note_off, start
+                continue
+            
+            # Drop repeated attacks on the same tick
+            if start == last_attack:
+                removed.add(note_on)
+            last_attack = start
+            
+            # Keep only the note-off that ends the group
+            if end > group_end:
+                removed.add(group_off)
+                group_end, group_off = end, note_off
+            else:
+                removed.add(note_off)
+    
+    return removed
+
+def find_redundant_controls(timeline):
+    """
+    Find control, program and pitch bend changes that have no effect.
+    
+    When several changes of the same controller share a tick only the last
+    one is kept, then changes that repeat the current value are dropped.
+    
+    Args:
+        timeline (list): List of (time, track index, position, message) tuples
+    
+    Returns:
+        tuple: (set of (track index, position) of controller and pitch bend
+            events to remove, set of program change events to remove)
+    """
+    def get_state_key(msg):
+        if msg.type == 'control_change':
+            return (msg.channel, 'control_change', msg.control), msg.value
+        if msg.type == 'program_change':
+            return (msg.channel, 'program_change'), msg.program
+        if msg.type == 'pitchwheel':
+            return (msg.channel, 'pitchwheel'), msg.pitch
+        return None, None
+    
+    # Keep the last change of each controller on every tick
+    superseded = set()
+    last_in_tick = {}
+    for time, track_index, position, msg in timeline:
+        state_key, _ = get_state_key(msg)
+        if state_key is None:
+            continue
+        previous = last_in_tick.get((time, state_key))
+        if previous is not None:
+            superseded.add(previous)
+        last_in_tick[(time, state_key)] = (track_index, position)
+    
+    # Drop changes that repeat the current value
+    controls = set()
+    programs = set()
+    state = {}
+    for time, track_index, position, msg in timeline:
+        state_key, value = get_state_key(msg)
+        if state_key is None:
+            continue
+        
+        event = (track_index, position)
+        if event in superseded or state.get(state_key) == value:
+            if msg.type == 'program_change':
+                programs.add(event)
+            else:
+                controls.add(event)
+            continue
+        
+        state[state_key] = value
+    
+    return controls, programs
+
+def remove_events(midi_file, removed):
+    """
+    Remove events from a MIDI file, keeping the timing of the others.
+    
+    Args:
+        midi_file (MidiFile): MIDI file object with delta times
+        removed (set): (track index, position) of the events to remove
+    """
+    for track_index, track in enumerate(midi_file.tracks):
+        messages = []
+        absolute_time = 0
+        prev_time = 0
+        for position, msg in enumerate(track):
+            absolute_time += msg.time
+            if (track_index, position) in removed:
+                continue
+            msg.time = absolute_time - prev_time
+            messages.append(msg)
+            prev_time = absolute_time
+        track[:] = messages
+
+def optimize_midi_file(midi_file):
+    """
+    Remove duplicate notes and redundant controller and program changes.
+    
+    The MIDI file must be finalized (sorted, with delta times).
+    
+    Args:
+        midi_file (MidiFile): MIDI file object
+    
+    Returns:
+        dict: Number of removed events by kind ('notes', 'controls',
+            'programs' and 'total')
+    """
+    timeline = get_timeline(midi_file)
+    
+    notes = find_duplicate_notes(timeline)
+    controls, programs = find_redundant_controls(timeline)
+    
+    remove_events(midi_file, notes | controls | programs)
+    
+    return {
+        'notes': len(notes),
+        'controls': len(controls),
+        'programs': len(programs),
+        'total': len(notes) + len(controls) + len(programs)
+    }
@@ -1,14 +1,34 @@
 """
 MIDI utilities module for the procedural music generation system.
 Provides functions for working with MIDI files and messages.
+
+Channel events are written through a pluggable track strategy:
+    - 'sorted': every insert merges the event into the track immediately
+    - 'deferred': events are buffered and sorted once when finalized
+    - 'columnar': events are stored as columns and materialized when finalized
+All strategies produce identical files.
 """
 
+import heapq
 import mido
+import numpy as np
 import random
+from operator import itemgetter
+from .note_index import NoteIndex
 
 # Define constants
 TICKS_PER_BEAT = 480  # Standard MIDI resolution
 
+# Order of channel events that share the same tick (see get_event_order)
+EVENT_ORDER = {
+    'note_off': 1,
+    'program_change': 2,
+    'note_on': 4
+}
+
+# Track strategy used when none is requested
+DEFAULT_STRATEGY = 'deferred'
+
 def create_midi_file(tempo=120, time_signature=(4, 4)):
     """
     Create a new MIDI file.
@@ -37,28 +57,288 @@ def create_midi_file(tempo=120, time_signature=(4, 4)):
     
     return mid
 
-def create_tracks_by_channel(midi_file, num_channels=16):
+def make_message(event_type, channel, data1, data2=0, time=0):
+    """
+    Create a channel message from an event record.
+    
+    Args:
+        event_type (str): Message type ('note_on', 'control_change', etc.)
+        channel (int): MIDI channel (0-15)
+        data1 (int): First data value (note, control, program or pitch)
+        data2 (int): Second data value (velocity or value)
+        time (int): Message time in ticks
+        
+    Returns:
+        Message: MIDI message
+    """
+    if event_type == 'note_on' or event_type == 'note_off':
+        return mido.Message(event_type, note=data1, velocity=data2, channel=channel, time=time)
+    if event_type == 'control_change':
+        return mido.Message(event_type, control=data1, value=data2, channel=channel, time=time)
+    if event_type == 'program_change':
+        return mido.Message(event_type, program=data1, channel=channel, time=time)
+    if event_type == 'pitchwheel':
+        return mido.Message(event_type, pitch=data1, channel=channel, time=time)
+    if event_type == 'polytouch':
+        return mido.Message(event_type, note=data1, value=data2, channel=channel, time=time)
+    if event_type == 'aftertouch':
+        return mido.Message(event_type, value=data1, channel=channel, time=time)
+    raise ValueError(f"Unsupported event type: {event_type}")
+
+def get_record_order(event_type, data2=0):
+    """
+    Get the order of an event record among events that share the same tick.
+    
+    Args:
+        event_type (str): Message type
+        data2 (int): Second data value (velocity for notes)
+        
+    Returns:
+        int: Order of the event within its tick
+    """
+    if event_type == 'note_on' and data2 == 0:
+        return EVENT_ORDER['note_off']
+    return EVENT_ORDER.get(event_type, 3)
+
+def insert_sorted(track, events):
+    """
+    Merge event records into a track that holds delta times in playback order.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        events (list): List of (time, type, channel, data1, data2) tuples with
+            absolute times in ticks
+    """
+    new_events = sorted(
+        (((time, get_record_order(event_type, data2)), make_message(event_type, channel, data1, data2))
+         for time, event_type, channel, data1, data2 in events),
+        key=itemgetter(0)
+    )
+    runs = split_runs(get_track_events(track))
+    runs.append(new_events)
+    write_track_events(track, merge_runs(runs))
+
+def insert_events(track, events):
+    """
+    Insert event records into a track using the track's strategy.
+    
+    Plain mido tracks are kept sorted like 'sorted' strategy tracks.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        events (list): List of (time, type, channel, data1, data2) tuples with
+            absolute times in ticks
+    """
+    if hasattr(track, 'insert_events'):
+        track.insert_events(events)
+    else:
+        insert_sorted(track, events)
+
+class SortedTrack(mido.MidiTrack):
+    """
+    Track that is kept in playback order as events are inserted.
+    
+    The track always holds valid delta times, but every insert costs time
+    proportional to the length of the track.
+    """
+    
+    def insert_events(self, events):
+        insert_sorted(self, events)
+    
+    def finalize(self):
+        finalize_track(self)
+
+class DeferredTrack(mido.MidiTrack):
+    """
+    Track that buffers inserted events and sorts them once when finalized.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = []
+    
+    def insert_events(self, events):
+        for time, event_type, channel, data1, data2 in events:
+            self.pending.append(((time, get_record_order(event_type, data2)),
+                                 make_message(event_type, channel, data1, data2, time)))
+    
+    def finalize(self):
+        if not self.pending:
+            return
+        
+        runs = split_runs(get_track_events(self)) + split_runs(self.pending)
+        self.pending = []
+        write_track_events(self, merge_runs(runs))
+
+class ColumnarTrack(mido.MidiTrack):
+    """
+    Track that stores inserted events as columns of integers.
+    
+    Messages are only created when the track is finalized, after the
+    columns have been sorted.
+    """
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.clear_columns()
+    
+    def clear_columns(self):
+        self.times = []
+        self.orders = []
+        self.types = []
+        self.channels = []
+        self.data1 = []
+        self.data2 = []
+    
+    def insert_events(self, events):
+        for time, event_type, channel, data1, data2 in events:
+            self.times.append(time)
+            self.orders.append(get_record_order(event_type, data2))
+            self.types.append(event_type)
+            self.channels.append(channel)
+            self.data1.append(data1)
+            self.data2.append(data2)
+    
+    def finalize(self):
+        if not self.times:
+            return
+        
+        # Stable sort of the columns by (tick, event order)
+        order = np.lexsort((np.asarray(self.orders), np.asarray(self.times))).tolist()
+        new_events = [
+            ((self.times[i], self.orders[i]),
+             make_message(self.types[i], self.channels[i], self.data1[i], self.data2[i]))
+            for i in order
+        ]
+        self.clear_columns()
+        
+        runs = split_runs(get_track_events(self))
+        runs.append(new_events)
+        write_track_events(self, merge_runs(runs))
+
+# Track classes by strategy name
+TRACK_STRATEGIES = {
+    'sorted': SortedTrack,
+    'deferred': DeferredTrack,
+    'columnar': ColumnarTrack
+}
+
+class TrackRegistry(dict):
+    """
+    Dictionary of MIDI tracks by channel that allocates tracks on demand.
+    
+    A channel's track is only created and added to the MIDI file the first
+    time the channel is looked up, so channels that never receive an event
+    never get a track. Iterating the registry only yields allocated tracks.
+    """
+    
+    def __init__(self, midi_file, num_channels=16, strategy=None, note_policy=None):
+        """
+        Initialize the track registry.
+        
+        Args:
+            midi_file (MidiFile): MIDI file the tracks are added to
+            num_channels (int): Number of channels tracks can be allocated for
+            strategy (str): Track strategy ('sorted', 'deferred' or 'columnar').
+                DEFAULT_STRATEGY is used if not provided.
+            note_policy (str): Policy for colliding notes of the same channel
+                and pitch ('merge', 'truncate' or 'drop'). Notes are added
+                as-is if not provided.
+        """
+        super().__init__()
+        strategy = strategy or DEFAULT_STRATEGY
+        if strategy not in TRACK_STRATEGIES:
+            raise ValueError(f"Unknown track strategy: {strategy}")
+        
+        self.midi_file = midi_file
+        self.num_channels = num_channels
+        self.track_class = TRACK_STRATEGIES[strategy]
+        self.note_index = NoteIndex(note_policy, self.__getitem__) if note_policy else None
+    
+    def __missing__(self, channel):
+        if not 0 <= channel < self.num_channels:
+            raise KeyError(channel)
+        
+        track = self.track_class()
+        track.name = f"Channel {channel}"
+        track.note_index = self.note_index
+        self.midi_file.tracks.append(track)
+        self[channel] = track
+        return track
+    
+    def finalize(self):
+        """
+        Drop tracks that do not affect playback and order the rest by channel.
+        
+        A track is dropped when all of its channel messages target channels
+        that never play a note anywhere in the file (including tracks with
+        no channel messages at all). Tracks must be finalized first.
+        
+        Returns:
+            int: Number of dropped tracks
+        """
+        # Channels that play at least one note in any track
+        sounding_channels = set()
+        for track in self.midi_file.tracks:
+            for msg in track:
+                if msg.type == 'note_on':
+                    sounding_channels.add(msg.channel)
+        
+        # Tracks not owned by the registry (e.g. the metadata track) stay first
+        owned = {id(track) for track in self.values()}
+        tracks = [track for track in self.midi_file.tracks if id(track) not in owned]
+        
+        dropped = 0
+        for channel in sorted(self):
+            track = self[channel]
+            if any(not msg.is_meta and msg.channel in sounding_channels for msg in track):
+                tracks.append(track)
+            else:
+                del self[channel]
+                dropped += 1
+        
+        self.midi_file.tracks[:] = tracks
+        
+        return dropped
+
+def create_tracks_by_channel(midi_file, num_channels=16, sparse=True, strategy=None, note_policy=None):
     """
     Create separate tracks for each MIDI channel.
     
     Args:
         midi_file (MidiFile): MIDI file object
         num_channels (int): Number of channels to create tracks for
+        sparse (bool): Whether to allocate each channel's track on first use
+            instead of creating all of them up front
+        strategy (str): Track strategy ('sorted', 'deferred' or 'columnar')
+        note_policy (str): Policy for colliding notes ('merge', 'truncate' or 'drop')
         
     Returns:
         dict: Dictionary of tracks by channel number
     """
-    tracks_by_channel = {}
+    tracks_by_channel = TrackRegistry(midi_file, num_channels, strategy, note_policy)
     
     # Create a track for each channel
-    for channel in range(num_channels):
-        track = mido.MidiTrack()
-        track.name = f"Channel {channel}"
-        midi_file.tracks.append(track)
-        tracks_by_channel[channel] = track
+    if not sparse:
+        for channel in range(num_channels):
+            tracks_by_channel[channel]
     
     return tracks_by_channel
 
+def merge_to_format0(midi_file):
+    """
+    Merge all tracks of a MIDI file into a single-track (format 0) file.
+    
+    Args:
+        midi_file (MidiFile): MIDI file object with delta times
+        
+    Returns:
+        MidiFile: Format 0 MIDI file
+    """
+    merged = mido.MidiFile(type=0, ticks_per_beat=midi_file.ticks_per_beat)
+    merged.tracks.append(mido.merge_tracks(midi_file.tracks))
+    return merged
+
 def add_program_change(track, program, channel):
     """
     Add a program change message to a track.
@@ -68,7 +348,7 @@ def add_program_change(track, program, channel):
         program (int): Program number (0-127)
         channel (int): MIDI channel (0-15)
     """
-    track.append(mido.Message('program_change', program=program, channel=channel, time=0))
+    insert_events(track, [(0, 'program_change', channel, program, 0)])
 
 def add_note(track, note, velocity, time, duration, channel):
     """
@@ -82,40 +362,34 @@ def add_note(track, note, velocity, time, duration, channel):
         duration (int): Duration in ticks
         channel (int): MIDI channel (0-15)
     """
-    # Skip rest notes (represented by note=-1)
-    if note < 0:
-        return
+    add_notes(track, [(note, velocity, time, duration)], channel)
+
+def add_notes(track, notes, channel):
+    """
+    Add a batch of notes to a track in a single insert.
     
-    # Ensure note is within MIDI range
-    if note < 0 or note > 127:
-        return
+    Args:
+        track (MidiTrack): MIDI track
+        notes (list): List of (note, velocity, time, duration) tuples with
+            absolute start times in ticks
+        channel (int): MIDI channel (0-15)
+    """
+    # Notes go through the collision index when the track has one
+    note_index = getattr(track, 'note_index', None)
     
-    # Sort the track by absolute time to ensure proper delta time calculation
     events = []
-    
-    # Extract existing events with their absolute times
-    absolute_time = 0
-    for msg in track:
-        absolute_time += msg.time
-        events.append((absolute_time, msg))
-    
-    # Add new note_on and note_off events
-    events.append((time, mido.Message('note_on', note=note, velocity=velocity, channel=channel, time=0)))
-    events.append((time + duration, mido.Message('note_off', note=note, velocity=0, channel=channel, time=0)))
-    
-    # Sort events by absolute time
-    events.sort(key=lambda x: x[0])
-    
-    # Clear the track
-    track.clear()
-    
-    # Recalculate delta times and add messages back to the track
-    prev_time = 0
-    for absolute_time, msg in events:
-        delta_time = absolute_time - prev_time
-        msg.time = delta_time
-        track.append(msg)
-        prev_time = absolute_time
+    for note, velocity, time, duration in notes:
+        # Skip rest notes and notes outside the MIDI range
+        if note < 0 or note > 127:
+            continue
+        if note_index is not None:
+            note_index.add(track, channel, note, velocity, time, duration)
+            continue
+        events.append((time, 'note_on', channel, note, velocity))
+        events.append((time + duration, 'note_off', channel, note, 0))
+    
+    if events:
+        insert_events(track, events)
 
 def add_chord(track, notes, velocity, time, duration, channel):
     """
@@ -129,8 +403,7 @@ def add_chord(track, notes, velocity, time, duration, channel):
         duration (int): Duration in ticks
         channel (int): MIDI channel (0-15)
     """
-    for note in notes:
-        add_note(track, note, velocity, time, duration, channel)
+    add_notes(track, [(note, velocity, time, duration) for note in notes], channel)
 
 def add_control_change(track, control, value, time, channel):
     """
@@ -143,31 +416,7 @@ def add_control_change(track, control, value, time, channel):
         time (int): Time in ticks (absolute)
         channel (int): MIDI channel (0-15)
     """
-    # Sort the track by absolute time to ensure proper delta time calculation
-    events = []
-    
-    # Extract existing events with their absolute times
-    absolute_time = 0
-    for msg in track:
-        absolute_time += msg.time
-        events.append((absolute_time, msg))
-    
-    # Add new control change event
-    events.append((time, mido.Message('control_change', control=control, value=value, channel=channel, time=0)))
-    
-    # Sort events by absolute time
-    events.sort(key=lambda x: x[0])
-    
-    # Clear the track
-    track.clear()
-    
-    # Recalculate delta times and add messages back to the track
-    prev_time = 0
-    for absolute_time, msg in events:
-        delta_time = absolute_time - prev_time
-        msg.time = delta_time
-        track.append(msg)
-        prev_time = absolute_time
+    insert_events(track, [(time, 'control_change', channel, control, value)])
 
 def add_pitch_bend(track, value, time, channel):
     """
@@ -179,31 +428,32 @@ def add_pitch_bend(track, value, time, channel):
         time (int): Time in ticks (absolute)
         channel (int): MIDI channel (0-15)
     """
-    # Sort the track by absolute time to ensure proper delta time calculation
-    events = []
-    
-    # Extract existing events with their absolute times
-    absolute_time = 0
-    for msg in track:
-        absolute_time += msg.time
-        events.append((absolute_time, msg))
-    
-    # Add new pitch bend event
-    events.append((time, mido.Message('pitchwheel', pitch=value, channel=channel, time=0)))
-    
-    # Sort events by absolute time
-    events.sort(key=lambda x: x[0])
+    insert_events(track, [(time, 'pitchwheel', channel, value, 0)])
+
+def add_aftertouch(track, note, value, time, channel):
+    """
+    Add an aftertouch (polyphonic key pressure) message to a track.
     
-    # Clear the track
-    track.clear()
+    Args:
+        track (MidiTrack): MIDI track
+        note (int): MIDI note number
+        value (int): Pressure value (0-127)
+        time (int): Time in ticks (absolute)
+        channel (int): MIDI channel (0-15)
+    """
+    insert_events(track, [(time, 'polytouch', channel, note, value)])
+
+def add_channel_pressure(track, value, time, channel):
+    """
+    Add a channel pressure (monophonic aftertouch) message to a track.
     
-    # Recalculate delta times and add messages back to the track
-    prev_time = 0
-    for absolute_time, msg in events:
-        delta_time = absolute_time - prev_time
-        msg.time = delta_time
-        track.append(msg)
-        prev_time = absolute_time
+    Args:
+        track (MidiTrack): MIDI track
+        value (int): Pressure value (0-127)
+        time (int): Time in ticks (absolute)
+        channel (int): MIDI channel (0-15)
+    """
+    insert_events(track, [(time, 'aftertouch', channel, value, 0)])
 
 def add_sustain_pedal(track, time, duration, channel):
     """
@@ -305,6 +555,66 @@ def add_expression(track, value, time, channel):
     add_control_change(track, 11, value, time, channel)
 
 
+def add_pan(track, value, time, channel):
+    """
+    Add a pan controller message to a MIDI track.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        value (int): Pan value (0-127, 64 is center)
+        time (int): Time in ticks
+        channel (int): MIDI channel (0-15)
+    """
+    add_control_change(track, 10, value, time, channel)
+
+def add_volume(track, value, time, channel):
+    """
+    Add a volume controller message to a MIDI track.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        value (int): Volume value (0-127)
+        time (int): Time in ticks
+        channel (int): MIDI channel (0-15)
+    """
+    add_control_change(track, 7, value, time, channel)
+
+def add_reverb(track, value, time, channel):
+    """
+    Add a reverb controller message to a MIDI track.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        value (int): Reverb value (0-127)
+        time (int): Time in ticks
+        channel (int): MIDI channel (0-15)
+    """
+    add_control_change(track, 91, value, time, channel)
+
+def add_chorus(track, value, time, channel):
+    """
+    Add a chorus controller message to a MIDI track.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        value (int): Chorus value (0-127)
+        time (int): Time in ticks
+        channel (int): MIDI channel (0-15)
+    """
+    add_control_change(track, 93, value, time, channel)
+
+def add_portamento(track, value, time, channel):
+    """
+    Add a portamento controller message to a MIDI track.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        value (int): Portamento value (0-127)
+        time (int): Time in ticks
+        channel (int): MIDI channel (0-15)
+    """
+    add_control_change(track, 5, value, time, channel)
+
 def add_random_variation(value, amount=5):
     """
     Add random variation to a value.
@@ -365,39 +675,157 @@ def save_midi_file(midi_file, filename):
         midi_file (MidiFile): MIDI file object
         filename (str): Output filename
     """
+    # Finalize the tracks before saving
+    finalize_midi_file(midi_file)
     midi_file.save(filename)
 
-def fix_note_timings(midi_file):
+def get_event_order(msg):
     """
-    Fix note timings in a MIDI file to ensure proper playback.
+    Get the order of a message among messages that share the same tick.
+    
+    Meta messages come first, then note-offs, then program and controller
+    changes, then note-ons, so a note ending on a tick never cuts off a note
+    starting on the same tick. End of track always comes last.
     
     Args:
-        midi_file (MidiFile): MIDI file object
+        msg (Message): MIDI message
         
     Returns:
-        MidiFile: Fixed MIDI file
+        int: Order of the message within its tick
     """
-    for track in midi_file.tracks:
-        # Sort messages by absolute time
-        messages = []
-        absolute_time = 0
+    if msg.is_meta:
+        return 5 if msg.type == 'end_of_track' else 0
+    return get_record_order(msg.type, getattr(msg, 'velocity', 0))
+
+def get_track_events(track, absolute_times=False):
+    """
+    Get the messages of a track keyed by (absolute tick, event order).
+    
+    Args:
+        track (MidiTrack): MIDI track
+        absolute_times (bool): Whether message times are absolute ticks
+            instead of delta times
         
-        for msg in track:
-            absolute_time += msg.time
-            messages.append((absolute_time, msg))
+    Returns:
+        list: List of ((time, order), message) tuples in track order
+    """
+    events = []
+    absolute_time = 0
+    for msg in track:
+        absolute_time = msg.time if absolute_times else absolute_time + msg.time
+        events.append(((absolute_time, get_event_order(msg)), msg))
+    return events
+
+def split_runs(events):
+    """
+    Split keyed events into runs that are already in key order.
+    
+    Args:
+        events (list): List of (key, message) tuples
         
-        # Sort messages
-        messages.sort(key=lambda x: x[0])
+    Returns:
+        list: List of runs (lists of (key, message) tuples)
+    """
+    runs = []
+    run = []
+    prev_key = None
+    for event in events:
+        if run and event[0] < prev_key:
+            runs.append(run)
+            run = []
+        run.append(event)
+        prev_key = event[0]
+    if run:
+        runs.append(run)
+    return runs
+
+def merge_runs(runs):
+    """
+    Merge sorted runs of keyed events.
+    
+    The merge is stable, so events with equal keys keep the order of their
+    runs (i.e. their insertion order).
+    
+    Args:
+        runs (list): List of runs (lists of (key, message) tuples)
         
-        # Clear the track
-        track.clear()
+    Returns:
+        iterable: (key, message) tuples in key order
+    """
+    if len(runs) > 1:
+        return heapq.merge(*runs, key=itemgetter(0))
+    return runs[0] if runs else []
+
+def write_track_events(track, events):
+    """
+    Replace the messages of a track with keyed events, rewriting delta times.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        events (iterable): (key, message) tuples in playback order
+    """
+    messages = []
+    prev_time = 0
+    for (absolute_time, _), msg in events:
+        msg.time = absolute_time - prev_time
+        messages.append(msg)
+        prev_time = absolute_time
+    track[:] = messages
+
+def finalize_track(track, absolute_times=False):
+    """
+    Put the messages of a track in playback order and rewrite their delta times.
+    
+    The track is split into runs that are already in (tick, event order)
+    order and the runs are merged, so a track that is built mostly in order
+    is finalized in linear time. Messages are retimed in place.
+    
+    Args:
+        track (MidiTrack): MIDI track
+        absolute_times (bool): Whether message times are absolute ticks
+            instead of delta times
+    """
+    runs = split_runs(get_track_events(track, absolute_times))
+    write_track_events(track, merge_runs(runs))
+
+def finalize_midi_file(midi_file, absolute_times=False):
+    """
+    Finalize every track of a MIDI file for saving.
+    
+    Notes held by collision indexes are written first. Strategy tracks are
+    then finalized by their strategy; plain tracks are sorted in place.
+    
+    Args:
+        midi_file (MidiFile): MIDI file object
+        absolute_times (bool): Whether message times of plain tracks are
+            absolute ticks instead of delta times
         
-        # Recalculate delta times
-        prev_time = 0
-        for absolute_time, msg in messages:
-            new_msg = msg.copy()
-            new_msg.time = absolute_time - prev_time
-            track.append(new_msg)
-            prev_time = absolute_time
-    
-    return midi_file
\ No newline at end of file
+    Returns:
+        MidiFile: Finalized MIDI file
+    """
+    # Write notes held by collision indexes to their tracks
+    for track in midi_file.tracks:
+        note_index = getattr(track, 'note_index', None)
+        if note_index is not None:
+            for note_track, events in note_index.flush():
+                insert_events(note_track, events)
+    
+    for track in midi_file.tracks:
+        if hasattr(track, 'finalize'):
+            track.finalize()
+        else:
+            finalize_track(track, absolute_times)
+    
+    return midi_file
+
+def fix_note_timings(midi_file):
+    """
+    Fix note timings in a MIDI file to ensure proper playback.
+    
+    Args:
+        midi_file (MidiFile): MIDI file object
+        
+    Returns:
+        MidiFile: Fixed MIDI file
+    """
+    return finalize_midi_file(midi_file)
@@ -1,21 +1,29 @@
 """
 MIDI utilities module for the procedural music generation system.
 Provides functions for working with MIDI files and tracks.
+
+This module keeps the older track-tuple API on top of midi_utils. Tracks
+use the 'deferred' strategy, so events are buffered and sorted once when
+the file is saved.
 """
 
 import mido
-from mido import Message, MidiFile, MidiTrack, MetaMessage
-
-# Constants
-TICKS_PER_BEAT = 480  # Standard MIDI resolution
+from mido import MidiFile, MidiTrack, MetaMessage
+from .midi_utils import (
+    add_aftertouch, add_channel_pressure, add_chorus, add_control_change, add_expression,
+    add_modulation, add_pan, add_pitch_bend, add_portamento, add_program_change, add_reverb,
+    add_sustain_pedal, add_volume, create_tracks_by_channel, finalize_midi_file
+)
+from .midi_utils import add_note as _add_note
 
-def create_midi_file(tempo=120, time_signature=(4, 4)):
+def create_midi_file(tempo=120, time_signature=(4, 4), strategy='deferred'):
     """
     Create a new MIDI file with multiple tracks for different instruments.
     
     Args:
         tempo (int): Tempo in BPM
         time_signature (tuple): Time signature as (numerator, denominator)
+        strategy (str): Track strategy ('sorted', 'deferred' or 'columnar')
         
     Returns:
         tuple: (MidiFile, dict of tracks by channel)
@@ -34,22 +42,9 @@ def create_midi_file(tempo=120, time_signature=(4, 4)):
     # Add tempo (microseconds per beat)
     tempo_track.append(MetaMessage('set_tempo', tempo=mido.bpm2tempo(tempo), time=0))
     
-    # Create a dictionary to store tracks by channel
-    tracks_by_channel = {}
-    
     # Create tracks for each channel (0-15)
-    for channel in range(16):
-        track = MidiTrack()
-        mid.tracks.append(track)
-        tracks_by_channel[channel] = track
-        
-        # Add track name
-        if channel == 9:
-            track_name = f"Drums"
-        else:
-            track_name = f"Channel {channel}"
-        
-        track.append(MetaMessage('track_name', name=track_name, time=0))
+    tracks_by_channel = create_tracks_by_channel(mid, 16, sparse=False, strategy=strategy)
+    tracks_by_channel[9].name = "Drums"
     
     return mid, tracks_by_channel
 
@@ -62,7 +57,7 @@ def set_instrument(track, program, channel):
         program (int): Program number (0-127)
         channel (int): MIDI channel (0-15)
     """
-    track.append(Message('program_change', program=program, channel=channel, time=0))
+    add_program_change(track, program, channel)
 
 def add_note(track, note, velocity, time, duration, channel):
     """
@@ -76,18 +71,10 @@ def add_note(track, note, velocity, time, duration, channel):
         duration (int): Duration in ticks
         channel (int): MIDI channel (0-15)
     """
-    # Ensure note is within MIDI range
-    if note < 0 or note > 127:
-        return
-    
     # Ensure velocity is within range
     velocity = max(1, min(127, velocity))
     
-    # Add note_on message
-    track.append(Message('note_on', note=note, velocity=velocity, channel=channel, time=time))
-    
-    # Add note_off message
-    track.append(Message('note_off', note=note, velocity=0, channel=channel, time=time + duration))
+    _add_note(track, note, velocity, time, duration, channel)
 
 def add_chord(track, notes, velocity, time, duration, channel):
     """
@@ -104,19 +91,6 @@ def add_chord(track, notes, velocity, time, duration, channel):
     for note in notes:
         add_note(track, note, velocity, time, duration, channel)
 
-def add_control_change(track, control, value, time, channel):
-    """
-    Add a control change message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        control (int): Control number
-        value (int): Control value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    track.append(Message('control_change', control=control, value=value, channel=channel, time=time))
-
 def apply_filter_sweep(track, start_value, end_value, duration_pct, total_duration, start_time, channel):
     """
     Apply a filter sweep effect.
@@ -182,186 +156,17 @@ def apply_effect_automation(track, cc_number, start_value, end_value, duration,
         # Add control change
         add_control_change(track, cc_number, value, time, channel)
 
-def add_sustain_pedal(track, start_time, duration, channel):
-    """
-    Add sustain pedal to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        start_time (int): Start time in ticks
-        duration (int): Duration in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    # Sustain pedal on
-    add_control_change(track, 64, 127, start_time, channel)
-    
-    # Sustain pedal off
-    add_control_change(track, 64, 0, start_time + duration, channel)
-
-def add_pitch_bend(track, value, time, channel):
-    """
-    Add a pitch bend message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Pitch bend value (-8192 to 8191)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    # Convert to MIDI pitch bend range (0-16383, with 8192 as center)
-    midi_value = value + 8192
-    midi_value = max(0, min(16383, midi_value))
-    
-    # Extract MSB and LSB
-    msb = (midi_value >> 7) & 0x7F
-    lsb = midi_value & 0x7F
-    
-    track.append(Message('pitchwheel', pitch=value, channel=channel, time=time))
-
-def add_aftertouch(track, note, value, time, channel):
-    """
-    Add an aftertouch (polyphonic key pressure) message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        note (int): MIDI note number
-        value (int): Pressure value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    track.append(Message('polytouch', note=note, value=value, channel=channel, time=time))
-
-def add_channel_pressure(track, value, time, channel):
-    """
-    Add a channel pressure (monophonic aftertouch) message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Pressure value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    track.append(Message('aftertouch', value=value, channel=channel, time=time))
-
-def add_modulation(track, value, time, channel):
-    """
-    Add a modulation wheel message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Modulation value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    add_control_change(track, 1, value, time, channel)
-
-def add_expression(track, value, time, channel):
-    """
-    Add an expression controller message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Expression value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    add_control_change(track, 11, value, time, channel)
-
-def add_pan(track, value, time, channel):
-    """
-    Add a pan controller message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Pan value (0-127, 64 is center)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    add_control_change(track, 10, value, time, channel)
-
-def add_volume(track, value, time, channel):
-    """
-    Add a volume controller message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Volume value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    add_control_change(track, 7, value, time, channel)
-
-def add_reverb(track, value, time, channel):
-    """
-    Add a reverb controller message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Reverb value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    add_control_change(track, 91, value, time, channel)
-
-def add_chorus(track, value, time, channel):
-    """
-    Add a chorus controller message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Chorus value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    add_control_change(track, 93, value, time, channel)
-
-def add_portamento(track, value, time, channel):
-    """
-    Add a portamento controller message to a MIDI track.
-    
-    Args:
-        track (MidiTrack): MIDI track
-        value (int): Portamento value (0-127)
-        time (int): Time in ticks
-        channel (int): MIDI channel (0-15)
-    """
-    add_control_change(track, 5, value, time, channel)
-
 def sort_midi_file(midi_file):
     """
     Sort all events in a MIDI file by time.
     
     Args:
-        midi_file (MidiFile): MIDI file to sort
+        midi_file (MidiFile): MIDI file to sort (times in plain tracks are absolute)
         
     Returns:
         MidiFile: Sorted MIDI file
     """
-    for track in midi_file.tracks:
-        # Convert track to a list of (time, message) tuples
-        events = []
-        current_time = 0
-        
-        for msg in track:
-            current_time += msg.time
-            events.append((current_time, msg))
-        
-        # Sort events by time
-        events.sort(key=lambda x: x[0])
-        
-        # Clear the track
-        track.clear()
-        
-        # Add sorted events back to the track
-        prev_time = 0
-        for time, msg in events:
-            # Calculate delta time
-            delta_time = time - prev_time
-            msg.time = delta_time
-            track.append(msg)
-            prev_time = time
-    
-    return midi_file
+    return finalize_midi_file(midi_file, absolute_times=True)
 
 def save_midi_file(midi_file, filename):
     """
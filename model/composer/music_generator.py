@@ -6,14 +6,16 @@ Provides functions for generating complete musical compositions.
 import random
 import json
 import os
+import functools
 import mido
 from .music_theory import get_scale_notes
 from .melody_generator import create_melody, create_catchy_secondary_melody, create_bass_line, create_funky_bass_line, create_background_melody, create_secondary_melody
 from .harmony_generator import generate_chord_progression
 from .rhythm_generator import generate_drum_pattern
-from .song_structure import generate_song_structure, apply_song_structure
-from .midi_utils import create_midi_file, create_tracks_by_channel, add_program_change, fix_note_timings
+from .song_structure import generate_song_structure, apply_song_structure, get_active_instruments, add_section_markers
+from .midi_utils import create_midi_file, create_tracks_by_channel, add_program_change, fix_note_timings, merge_to_format0
 from .audio_effects import apply_reverb, apply_delay, apply_filter
+from .midi_optimizer import optimize_midi_file
 
 # Channel assignments
 DRUM_CHANNEL = 9
@@ -26,6 +28,44 @@ SECONDARY_BG_MELODY_CHANNEL = 5
 SECONDARY_BASS_CHANNEL = 6
 SECONDARY_DRUM_CHANNEL = 10
 
+class PatternBank:
+    """
+    Lazily generated instrument patterns.
+    
+    Each pattern is produced by its factory the first time it is requested
+    and memoized afterwards, so patterns that no section plays are never
+    generated.
+    """
+    
+    def __init__(self, factories):
+        """
+        Initialize the pattern bank.
+        
+        Args:
+            factories (dict): Dictionary of pattern factories by instrument name.
+                Each factory returns a list of (note, velocity, time, duration) tuples.
+        """
+        self.factories = factories
+        self.patterns = {}
+    
+    def __contains__(self, instrument_name):
+        return instrument_name in self.factories
+    
+    def __getitem__(self, instrument_name):
+        if instrument_name not in self.patterns:
+            pattern = self.factories[instrument_name]()
+            self.patterns[instrument_name] = [(note, velocity, time, duration) for note, velocity, time, duration in pattern]
+        return self.patterns[instrument_name]
+    
+    def generated(self):
+        """
+        Get the names of the patterns generated so far.
+        
+        Returns:
+            list: Instrument names in generation order
+        """
+        return list(self.patterns)
+
 def load_instruments():
     """
     Load instrument definitions from JSON file.
@@ -61,13 +101,18 @@ def generate_music(
     is_atmospheric=False,
     is_minimal=False,
     has_breakdown=True,
-    instruments=None
+    instruments=None,
+    midi_format=1,
+    midi_strategy=None,
+    note_policy='truncate',
+    optimize=True
 ):
     """
     Generate a complete musical composition.
     
     Args:
-        output_file (str): Output MIDI filename
+        output_file (str): Output MIDI filename (None to keep the MIDI file
+            in memory and return it)
         tempo (int): Tempo in BPM
         key (int): Key (0=C, 1=C#, etc.)
         scale_type (str): Scale type ('major', 'minor', etc.)
@@ -80,9 +125,18 @@ def generate_music(
         is_minimal (bool): Whether the music should be minimal
         has_breakdown (bool): Whether the music should have a breakdown
         instruments (dict): Dictionary of instrument definitions
+        midi_format (int): MIDI file format to save (1 for one track per
+            channel, 0 for a single merged track)
+        midi_strategy (str): Track strategy used to write events ('sorted',
+            'deferred' or 'columnar'). The fastest strategy is used by default.
+        note_policy (str): Policy for colliding notes of the same channel and
+            pitch ('merge', 'truncate', 'drop' or None to keep every note)
+        optimize (bool): Whether to remove duplicate notes and redundant
+            controller and program changes before saving
         
     Returns:
-        str: Output filename
+        str or MidiFile: Output filename, or the MIDI file object if
+            output_file is None
     """
     print(f"Generating {style} music in {key} {scale_type}...")
     
@@ -93,8 +147,8 @@ def generate_music(
     # Create a new MIDI file
     midi_file = create_midi_file(tempo=tempo)
     
-    # Create tracks for each channel
-    tracks_by_channel = create_tracks_by_channel(midi_file)
+    # Create tracks for each channel (allocated when first used)
+    tracks_by_channel = create_tracks_by_channel(midi_file, strategy=midi_strategy, note_policy=note_policy)
     
     # Set program changes for each instrument
     for instrument_name, instrument_data in instruments.items():
@@ -123,90 +177,119 @@ def generate_music(
         has_breakdown=has_breakdown
     )
     
-    # Generate patterns for each instrument
-    patterns = {}
-    
-    # Generate chord progression
-    chord_progression = generate_chord_progression(key, scale_type, 4, beats_per_bar)
-    patterns['chords'] = [(notes, velocity, time, duration) for notes, velocity, time, duration in chord_progression]
-     
-    # Generate bass line
-    bass_pattern = create_bass_line(
-        key, scale_type, chord_progression, 4 ,beats_per_bar,
-        complexity=complexity * 0.6, octave=2
-    )
-    patterns['bass'] = [(note, velocity, time, duration) for note, velocity, time, duration in bass_pattern]
+    # Generate patterns on demand: only instruments that at least one
+    # section activates get a factory, and each one runs on first use
+    active_instruments = get_active_instruments(sections)
     
-    # Generate funky bass line
-    funky_bass_pattern = create_funky_bass_line(
-        key, scale_type, chord_progression, 4 ,beats_per_bar,
-        complexity=complexity * 0.8, octave=2
-    )
-    patterns['funky_bass'] = [(note, velocity, time, duration) for note, velocity, time, duration in funky_bass_pattern]
+    # The chord progression is shared by the chords and both bass lines
+    @functools.lru_cache(maxsize=None)
+    def get_chord_progression():
+        return generate_chord_progression(key, scale_type, 4, beats_per_bar)
     
-    # Generate melody
-    melody_pattern = create_melody(
-        key, scale_type, 4, beats_per_bar,
-        complexity=complexity, octave=4,
-        rhythm_variation=0.6
-    )
-    # patterns['melody'] = [(note, velocity, time, duration) for note, velocity, time, duration in melody_pattern]
+    pattern_factories = {
+        # Chord progression
+        'chords': lambda: get_chord_progression(),
+        
+        # Bass line
+        'bass': lambda: create_bass_line(
+            key, scale_type, get_chord_progression(), 4, beats_per_bar,
+            complexity=complexity * 0.6, octave=2
+        ),
+        
+        # Funky bass line
+        'funky_bass': lambda: create_funky_bass_line(
+            key, scale_type, get_chord_progression(), 4, beats_per_bar,
+            complexity=complexity * 0.8, octave=2
+        ),
+        
+        # Melody
+        # 'melody': lambda: create_melody(
+        #     key, scale_type, 4, beats_per_bar,
+        #     complexity=complexity, octave=4,
+        #     rhythm_variation=0.6
+        # ),
+        
+        # Secondary melody
+        # 'secondary_melody': lambda: create_secondary_melody(
+        #     key, scale_type, 4, beats_per_bar,
+        #     complexity=complexity * 0.9, octave=5,
+        # ),
+        
+        # Background melody
+        'bg_melody': lambda: create_background_melody(
+            key, scale_type, 4, beats_per_bar,
+            complexity=complexity * 0.7, octave=4
+        ),
+        
+        # Catchy melody
+        'catchy_melody': lambda: create_catchy_secondary_melody(
+            key, scale_type, 4, beats_per_bar,
+            complexity=complexity * 0.6, octave=4
+        ),
+        
+        # Low background melody
+        'bg_melody_low': lambda: create_melody(
+            key, scale_type, 4, beats_per_bar,
+            complexity=complexity * 0.5, octave=3,
+            rhythm_variation=0.3
+        ),
+        
+        # Simple drum pattern
+        'simple_drums': lambda: generate_drum_pattern(
+            4, beats_per_bar, complexity=complexity * 0.6,
+            is_phonk=is_phonk
+        ),
+        
+        # Complex drum pattern
+        'complex_drums': lambda: generate_drum_pattern(
+            4, beats_per_bar,
+            complexity=complexity * 1.2, is_phonk=is_phonk
+        ),
+        
+        # Trap fill pattern
+        # 'trap_fill': lambda: generate_drum_pattern(
+        #     1, beats_per_bar,
+        #     complexity=1.0, is_fill=True
+        # ),
+    }
     
-    # Generate secondary melody
-    secondary_melody_pattern = create_secondary_melody(
-        key, scale_type, 4, beats_per_bar,
-        complexity=complexity * 0.9, octave=5,
-    )
-    # patterns['secondary_melody'] = [(note, velocity, time, duration) for note, velocity, time, duration in secondary_melody_pattern]
+    patterns = PatternBank({
+        instrument_name: factory
+        for instrument_name, factory in pattern_factories.items()
+        if instrument_name in active_instruments
+    })
     
-    # Generate background melody
-    bg_melody_pattern = create_background_melody(
-        key, scale_type, 4, beats_per_bar,
-        complexity=complexity * 0.7, octave=4
-    )
-    patterns['bg_melody'] = [(note, velocity, time, duration) for note, velocity, time, duration in bg_melody_pattern]
+    # Apply song structure to the tracks
+    total_bars = apply_song_structure(sections, patterns, tracks_by_channel, beats_per_bar, style, scale)
     
-    # Generate catchy melody
-    catchy_melody_pattern = create_catchy_secondary_melody(
-        key, scale_type, 4, beats_per_bar,
-        complexity=complexity * 0.6, octave=4
-    )
-    patterns['catchy_melody'] = [(note, velocity, time, duration) for note, velocity, time, duration in catchy_melody_pattern]
+    # Mark section boundaries for renderers that split songs by section
+    add_section_markers(midi_file, sections, beats_per_bar)
     
-    # Generate low background melody
-    bg_melody_low_pattern = create_melody(
-        key, scale_type, 4, beats_per_bar,
-        complexity=complexity * 0.5, octave=3,
-        rhythm_variation=0.3
-    )
-    patterns['bg_melody_low'] = [(note, velocity, time, duration) for note, velocity, time, duration in bg_melody_low_pattern]
+    print(f"Generated patterns: {', '.join(patterns.generated())}")
     
-    # Generate simple drum pattern
-    simple_drum_pattern = generate_drum_pattern(
-        4, beats_per_bar, complexity=complexity * 0.6, 
-        is_phonk=is_phonk
-    )
-    patterns['simple_drums'] = [(note, velocity, time, duration) for note, velocity, time, duration in simple_drum_pattern]
+    # Fix note timings to ensure proper playback
+    midi_file = fix_note_timings(midi_file)
     
-    # Generate complex drum pattern
-    complex_drum_pattern = generate_drum_pattern(
-        4, beats_per_bar,
-        complexity=complexity * 1.2, is_phonk=is_phonk
-    )
-    patterns['complex_drums'] = [(note, velocity, time, duration) for note, velocity, time, duration in complex_drum_pattern]
+    if tracks_by_channel.note_index is not None:
+        print(f"Resolved {tracks_by_channel.note_index.collisions} note collisions ({note_policy})")
     
-    # Generate trap fill pattern
-    # trap_fill_pattern = generate_drum_pattern(
-    #     1, beats_per_bar,
-    #     complexity=1.0, is_fill=True
-    # )
-    # patterns['trap_fill'] = [(note, velocity, time, duration) for note, velocity, time, duration in trap_fill_pattern]
+    # Remove duplicate notes and redundant controller changes
+    if optimize:
+        removed = optimize_midi_file(midi_file)
+        print(f"Optimized MIDI: removed {removed['total']} events "
+              f"({removed['notes']} notes, {removed['controls']} controls, {removed['programs']} programs)")
     
-    # Apply song structure to the tracks
-    total_bars = apply_song_structure(sections, patterns, tracks_by_channel, beats_per_bar, style, scale)
+    # Drop tracks that never reach a sounding channel
+    tracks_by_channel.finalize()
     
-    # Fix note timings to ensure proper playback
-    midi_file = fix_note_timings(midi_file)
+    # Merge into a single track for renderers that parse format 0 faster
+    if midi_format == 0:
+        midi_file = merge_to_format0(midi_file)
+    
+    # Hand the MIDI file over in memory
+    if output_file is None:
+        print(f"Generated {total_bars} bars of music.")
+        return midi_file
     
     # Save the MIDI file
     midi_file.save(output_file)
@@ -0,0 +1,163 @@
+"""
+Note index module for the procedural music generation system.
+Provides an interval index that resolves colliding notes per channel and pitch.
+"""
+
+from bisect import bisect_left, bisect_right
+
+# Collision policies
+NOTE_POLICIES = ('merge', 'truncate', 'drop')
+
+class NoteIndex:
+    """
+    Index of the notes of a song by channel and pitch.
+    
+    Notes of the same channel and pitch are kept as disjoint intervals in
+    sorted start and end lists, so the notes a new note collides with are
+    found with two binary searches. Inserting into the lists still shifts
+    the later notes of the same channel and pitch, which is linear in their
+    number but cheap for the few hundred notes a pitch gets in a song.
+    Collisions are resolved with a policy:
+        - 'merge': colliding notes are joined into one note
+        - 'truncate': a sounding note is cut where the next one starts
+        - 'drop': a note that collides with an existing note is dropped
+    """
+    
+    def __init__(self, policy='truncate', track_for_channel=None):
+        """
+        Initialize the note index.
+        
+        Args:
+            policy (str): Collision policy ('merge', 'truncate' or 'drop')
+            track_for_channel (callable): Returns the track that receives the
+                notes of a channel when the index is flushed. Notes are written
+                to the track they were added to if not provided.
+        """
+        if policy not in NOTE_POLICIES:
+            raise ValueError(f"Unknown note policy: {policy}")
+        
+        self.policy = policy
+        self.track_for_channel = track_for_channel
+        self.starts = {}
+        self.ends = {}
+        self.notes = {}
+        self.collisions = 0
+    
+    def find_collisions(self, channel, note, start, end):
+        """
+        Find the indexed notes that overlap a time range.
+        
+        Args:
+            channel (int): MIDI channel (0-15)
+            note (int): MIDI note number
+            start (int): Start time in ticks
+            end (int): End time in ticks
+        
+        Returns:
+            tuple: (first, last) index range of the colliding notes
+        """
+        key = (channel, note)
+        if key not in self.starts:
+            return 0, 0
+        
+        # Intervals are disjoint, so both lists are sorted
+        first = bisect_right(self.ends[key], start)
+        last = bisect_left(self.starts[key], max(end, start + 1))
+        return first, last
+    
+    def add(self, track, channel, note, velocity, start, duration):
+        """
+        Add a note, resolving collisions with the notes already indexed.
+        
+        Args:
+            track (MidiTrack): Track the note belongs to
+            channel (int): MIDI channel (0-15)
+            note (int): MIDI note number
+            velocity (int): Note velocity (0-127)
+            start (int): Start time in ticks (absolute)
+            duration (int): Duration in ticks (notes are at least one tick long)
+        """
+        key = (channel, note)
+        starts = self.starts.setdefault(key, [])
+        ends = self.ends.setdefault(key, [])
+        notes = self.notes.setdefault(key, [])
+        
+        # An empty interval would break the order of the end list
+        end = max(start + duration, start + 1)
+        first, last = self.find_collisions(channel, note, start, end)
+        
+        if first < last:
+            self.collisions += 1
+            
+            if self.policy == 'drop':
+                return
+            
+            if self.policy == 'merge':
+                # Join the new note and every colliding note
+                start = min(start, starts[first])
+                end = max(end, ends[last - 1])
+                velocity = max([velocity] + [notes[i][1] for i in range(first, last)])
+                track = notes[first][0]
+                del starts[first:last], ends[first:last], notes[first:last]
+                self.insert(key, first, track, velocity, start, end)
+                return
+            
+            # Truncate: an identical attack adds nothing
+            if any(starts[i] == start for i in range(first, last)):
+                return
+            
+            # Cut the note that is sounding when the new note starts
+            if starts[first] < start:
+                ends[first] = start
+                first += 1
+            
+            # Cut the new note where the next note starts
+            if first < last:
+                end = starts[first]
+        
+        position = bisect_left(starts, start)
+        self.insert(key, position, track, velocity, start, end)
+    
+    def insert(self, key, position, track, velocity, start, end):
+        """
+        Insert a note interval at a position of the index.
+        
+        Args:
+            key (tuple): (channel, note)
+            position (int): Position in the sorted lists
+            track (MidiTrack): Track the note belongs to
+            velocity (int): Note velocity (0-127)
+            start (int): Start time in ticks
+            end (int): End time in ticks
+        """
+        self.starts[key].insert(position, start)
+        self.ends[key].insert(position, end)
+        self.notes[key].insert(position, (track, velocity))
+    
+    def flush(self):
+        """
+        Remove every note from the index.
+        
+        Returns:
+            list: List of (track, events) tuples, where events is a list of
+                (time, type, channel, data1, data2) tuples
+        """
+        tracks = {}
+        events_by_track = {}
+        for (channel, note), starts in self.starts.items():
+            ends = self.ends[(channel, note)]
+            for (track, velocity), start, end in zip(self.notes[(channel, note)], starts, ends):
+                # Keep every note of a channel in one track, so a note-off
+                # never follows a note-on of the same tick from another track
+                if self.track_for_channel is not None:
+                    track = self.track_for_channel(channel)
+                tracks[id(track)] = track
+                events = events_by_track.setdefault(id(track), [])
+                events.append((start, 'note_on', channel, note, velocity))
+                events.append((end, 'note_off', channel, note, 0))
+        
+        self.starts = {}
+        self.ends = {}
+        self.notes = {}
+        
+        return [(tracks[track_id], events) for track_id, events in events_by_track.items()]
@@ -5,7 +5,8 @@ Provides functions for creating and applying song structures.
 
 import random
 from collections import namedtuple
-from .midi_utils import add_note, add_chord, add_control_change
+import mido
+from .midi_utils import add_notes
 from .audio_effects import apply_filter_sweep
 from .transitions import apply_transition, apply_ending_transition
 
@@ -252,7 +253,90 @@ def generate_song_structure(num_bars=44, style='trap', is_epic=False, is_phonk=F
     
     return sections
 
-def apply_song_structure(sections, patterns, tracks_by_channel, beats_per_bar, style, scale):
+def get_active_instruments(sections):
+    """
+    Get the instruments that are active in at least one section.
+    
+    Args:
+        sections (list): List of Section objects
+        
+    Returns:
+        set: Names of the instruments whose pattern is used by the song
+    """
+    active = set()
+    for section in sections:
+        for instrument_name, instrument_config in section.active_instruments.items():
+            if instrument_config['pattern']:
+                active.add(instrument_name)
+    return active
+
+def get_section_key(section, patterns):
+    """
+    Get the cache key of a section's pattern events.
+    
+    Two sections with the same key produce identical pattern events relative
+    to their start tick.
+    
+    Args:
+        section (Section): Section of the song
+        patterns (dict): Dictionary of patterns (melody, bass, etc.)
+        
+    Returns:
+        tuple: (section name, number of bars, active instruments, pattern ids)
+    """
+    active = tuple(
+        (instrument_name, instrument_config['channel'])
+        for instrument_name, instrument_config in section.active_instruments.items()
+        if instrument_name in patterns and instrument_config['pattern']
+    )
+    pattern_ids = tuple(id(patterns[instrument_name]) for instrument_name, _ in active)
+    return (section.name, section.num_bars, active, pattern_ids)
+
+def render_section_block(section, patterns, ticks_per_bar):
+    """
+    Render the pattern events of a section relative to its start tick.
+    
+    Args:
+        section (Section): Section of the song
+        patterns (dict): Dictionary of patterns (melody, bass, etc.)
+        ticks_per_bar (int): Number of ticks per bar
+        
+    Returns:
+        dict: Lists of (note, velocity, time, duration) tuples by channel
+    """
+    block = {}
+    section_length_ticks = section.num_bars * ticks_per_bar
+    
+    # Process each active instrument in the section
+    for instrument_name, instrument_config in section.active_instruments.items():
+        if instrument_name in patterns and instrument_config['pattern']:
+            pattern = patterns[instrument_name]
+            channel = instrument_config['channel']
+            
+            # Get pattern length
+            pattern_length = 0
+            for _, _, time, duration in pattern:
+                pattern_length = max(pattern_length, time + duration)
+            
+            if pattern_length == 0:
+                continue
+            
+            # Calculate how many times to repeat the pattern
+            repeats = max(1, section_length_ticks // pattern_length)
+            
+            # Add the pattern to the channel's events
+            events = block.setdefault(channel, [])
+            for repeat in range(repeats):
+                for note, velocity, time, duration in pattern:
+                    # Only include notes that fall within this section
+                    if time + (repeat * pattern_length) < section_length_ticks:
+                        # Skip rest notes (represented by note=-1)
+                        if note >= 0:
+                            events.append((note, velocity, time + (repeat * pattern_length), duration))
+    
+    return block
+
+def apply_song_structure(sections, patterns, tracks_by_channel, beats_per_bar, style, scale, section_cache=None):
     """
     Apply a song structure to multiple MIDI tracks.
     
@@ -263,10 +347,15 @@ def apply_song_structure(sections, patterns, tracks_by_channel, beats_per_bar, s
         beats_per_bar (int): Number of beats per bar
         style (str): Music style
         scale (list): List of scale notes
+        section_cache (dict): Cache of rendered section blocks by section key.
+            A new cache is used if not provided.
         
     Returns:
         int: Total number of bars
     """
+    if section_cache is None:
+        section_cache = {}
+    
     current_bar = 0
     ticks_per_bar = beats_per_bar * 480  # Assuming 480 ticks per beat
     
@@ -281,43 +370,22 @@ def apply_song_structure(sections, patterns, tracks_by_channel, beats_per_bar, s
             prev_section = sections[i-1]
             intensity_change = section.intensity - prev_section.intensity
             
-            # Apply transition based on intensity change
-            for channel, track in tracks_by_channel.items():
-                apply_transition(track, prev_section.intensity, section.intensity, 
+            # Apply transition based on intensity change, once per channel
+            # whether or not its track has been allocated yet
+            for channel in range(tracks_by_channel.num_channels):
+                apply_transition(tracks_by_channel[channel], prev_section.intensity, section.intensity, 
                                 section_start_tick, ticks_per_bar, style, scale)
         
-        # Process each active instrument in the section
-        for instrument_name, instrument_config in section.active_instruments.items():
-            if instrument_name in patterns and instrument_config['pattern']:
-                pattern = patterns[instrument_name]
-                channel = instrument_config['channel']
-                
-                # Get the track for this channel
-                track = tracks_by_channel[channel]
-                
-                # Get pattern length
-                pattern_length = 0
-                for _, _, time, duration in pattern:
-                    pattern_length = max(pattern_length, time + duration)
-                
-                if pattern_length == 0:
-                    continue
-                
-                # Calculate how many times to repeat the pattern
-                section_length_ticks = section.num_bars * ticks_per_bar
-                repeats = max(1, section_length_ticks // pattern_length)
-                
-                # Add the pattern to the track
-                for repeat in range(repeats):
-                    for note, velocity, time, duration in pattern:
-                        # Only include notes that fall within this section
-                        if time + (repeat * pattern_length) < section_length_ticks:
-                            # Skip rest notes (represented by note=-1)
-                            if note >= 0:
-                                # Add the note with the offset
-                                add_note(track, note, velocity, 
-                                        section_start_tick + time + (repeat * pattern_length), 
-                                        duration, channel)
+        # Render the section's pattern events once per distinct section and
+        # stamp the cached block at this section's offset
+        section_key = get_section_key(section, patterns)
+        if section_key not in section_cache:
+            section_cache[section_key] = render_section_block(section, patterns, ticks_per_bar)
+        
+        for channel, events in section_cache[section_key].items():
+            add_notes(tracks_by_channel[channel],
+                      [(note, velocity, section_start_tick + time, duration) for note, velocity, time, duration in events],
+                      channel)
         
         # Apply special effects based on section type
         if section.name == 'build_up':
@@ -336,9 +404,30 @@ def apply_song_structure(sections, patterns, tracks_by_channel, beats_per_bar, s
         current_bar += section.num_bars
     
     # Apply ending transition to all relevant tracks
-    for channel, track in tracks_by_channel.items():
-        if channel in [MELODY_CHANNEL, BASS_CHANNEL, CHORD_CHANNEL, DRUM_CHANNEL]:
-            apply_ending_transition(track, sections[-1].intensity, 
-                                  current_bar * ticks_per_bar, ticks_per_bar, style, scale)
+    for channel in sorted([MELODY_CHANNEL, BASS_CHANNEL, CHORD_CHANNEL, DRUM_CHANNEL]):
+        apply_ending_transition(tracks_by_channel[channel], sections[-1].intensity, 
+                              current_bar * ticks_per_bar, ticks_per_bar, style, scale)
+    
+    return current_bar
+
+def add_section_markers(midi_file, sections, beats_per_bar):
+    """
+    Add a marker meta message at the start of every section.
+    
+    Renderers use the markers to split a song at section boundaries.
+    
+    Args:
+        midi_file (MidiFile): MIDI file object (markers go to the first track)
+        sections (list): List of Section objects
+        beats_per_bar (int): Number of beats per bar
+    """
+    meta_track = midi_file.tracks[0]
+    ticks_per_bar = beats_per_bar * midi_file.ticks_per_beat
     
-    return current_bar
\ No newline at end of file
+    track_end = sum(msg.time for msg in meta_track)
+    section_start_tick = 0
+    for section in sections:
+        delta = max(0, section_start_tick - track_end)
+        meta_track.append(mido.MetaMessage('marker', text=section.name, time=delta))
+        track_end += delta
+        section_start_tick += section.num_bars * ticks_per_bar
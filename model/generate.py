@@ -1,5 +1,9 @@
 import os
+import io
 import sys
+import hashlib
+import threading
+import mido
 import pretty_midi
 import numpy as np
 import tensorflow as tf
@@ -8,6 +12,8 @@ import sys
 from .composer.music_generator import generate_music
 from .composer.music_theory import MAJOR_SCALE, MINOR_SCALE
 from .listen import midi_to_wav
+from .song_cache import SongCache
+from .renderer import DEFAULT_TIER, RenderPool, StreamMaster, get_tier, iter_audio_bytes, iter_slice_samples, to_mono
 
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from transformer import Transformer
@@ -28,8 +34,123 @@ token_to_id = {
 }
 id_to_token = {v: k for k, v in token_to_id.items()}
 
+# Render workers keep the SoundFont loaded between songs
+# SF2_FILE can point to a subset SoundFont built at deploy time (renderer/soundfont.py)
+sf2_path = os.environ.get(
+    "SF2_FILE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "Sound Fonts", "Omega.sf2")
+)
+render_pool = None
+
+def get_render_pool():
+    global render_pool
+    if render_pool is None:
+        render_pool = RenderPool(
+            sf2_path,
+            num_workers=int(os.environ.get("RENDER_WORKERS", 2)),
+            timeout=float(os.environ.get("RENDER_TIMEOUT", 120)),
+            backend=os.environ.get("RENDER_BACKEND", "fluidsynth")
+        )
+    return render_pool
+
+# Generated songs are cached on disk by their parameters and seed
+song_cache = None
+
+def get_song_cache():
+    global song_cache
+    if song_cache is None:
+        song_cache = SongCache(
+            os.environ.get("SONG_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "song_cache")),
+            max_bytes=int(os.environ.get("SONG_CACHE_BYTES", 1024 * 1024 * 1024))
+        )
+    return song_cache
+
+# Composition draws from the global random generators, so seeded songs are
+# composed one at a time
+compose_lock = threading.Lock()
+
+def new_seed():
+    return random.SystemRandom().randrange(2 ** 32)
+
+# Compose a song from a seed, or load it from the song cache
+# Returns the MidiFile and the SHA-256 of its bytes
+def compose_song(tempo, scale_type, seed):
+    cache = get_song_cache()
+    params = {"kind": "midi", "tempo": tempo, "scale_type": scale_type, "seed": seed}
+
+    data = cache.get(params)
+    if data is None:
+        with compose_lock:
+            random.seed(seed)
+            np.random.seed(seed)
+            tf.random.set_seed(seed)
+            midi_file = generate_midi(tempo=tempo, output_file=None, scale_type=scale_type, render=False)
+        buffer = io.BytesIO()
+        midi_file.save(file=buffer)
+        data = buffer.getvalue()
+        return midi_file, cache.put(params, data)
+
+    print(f"Loaded song (seed {seed}) from the song cache")
+    return mido.MidiFile(file=io.BytesIO(data)), hashlib.sha256(data).hexdigest()
+
+# Identity of the SoundFont: its name, size and modification time, so
+# replacing the file (even under the same name) misses the cached audio
+def get_soundfont_id():
+    try:
+        status = os.stat(sf2_path)
+    except OSError:
+        return os.path.basename(sf2_path)
+    return f"{os.path.basename(sf2_path)}:{status.st_size}:{status.st_mtime_ns}"
+
+# Cache parameters of the rendered audio of a song (tier None is the
+# unmastered full quality render)
+def get_audio_params(midi_hash, tier, audio_format):
+    return {
+        "kind": "audio",
+        "midi": midi_hash,
+        "tier": tier,
+        "audio_format": audio_format,
+        "backend": os.environ.get("RENDER_BACKEND", "fluidsynth"),
+        "soundfont": get_soundfont_id()
+    }
+
+# Compose and render a song in a tier (DEFAULT_TIER if None), or load it from the song cache
+# Returns the audio bytes and the seed (a new one if seed is None)
+def generate_song_audio(tempo, scale_type, tier=None, audio_format="wav", seed=None):
+    tier = tier or DEFAULT_TIER
+    seed = new_seed() if seed is None else seed
+    midi_file, midi_hash = compose_song(tempo, scale_type, seed)
+
+    cache = get_song_cache()
+    params = get_audio_params(midi_hash, tier, audio_format)
+    audio = cache.get(params)
+    if audio is None:
+        audio, timing = get_render_pool().render_bytes(midi_file, tier, audio_format)
+        print(f"Conversion successful! Rendered {len(audio)} bytes of {audio_format} in memory "
+              f"(render {timing['render']:.2f}s, encode {timing['encode']:.2f}s)")
+        cache.put(params, audio)
+    return audio, seed
+
+# Master streamed chunks, then release what the limiter held back
+def master_chunks(chunks, master):
+    for chunk in chunks:
+        yield master.process(chunk)
+    yield master.flush()
+
+# Stream a composed song (MIDI path or MidiFile) as WAV or FLAC bytes, section by section
+def stream_song(midi_file, tier=None, audio_format="wav"):
+    settings = get_tier(tier)
+    chunks = iter_slice_samples(midi_file, tier=tier, pool=get_render_pool())
+    if settings['channels'] == 1:
+        chunks = (to_mono(chunk) for chunk in chunks)
+    chunks = master_chunks(chunks, StreamMaster(settings['sample_rate'], settings['loudness'],
+                                                  channels=settings['channels']))
+    return iter_audio_bytes(chunks, settings['sample_rate'], settings['channels'], audio_format)
+
 # Function to generate a short MIDI melody (4 bars)
-def generate_midi(tempo=120, output_file="standard", scale_type=0):
+# With output_file=None nothing touches the disk: the MidiFile is returned,
+# or the audio bytes (in audio_format) if render is set
+def generate_midi(tempo=120, output_file="standard", scale_type=0, render=True, tier=None, audio_format="wav"):
     print(f"Generating 4 bars of music at {tempo} BPM... 🎵")
 
     # MIDI Setup
@@ -88,8 +209,7 @@ def generate_midi(tempo=120, output_file="standard", scale_type=0):
 
             if note_not_found_counter >= MAX_TRIES:
                 print("[ERROR] Too many failed attempts. Restarting script...\n")
-                generate_midi(tempo)  # Restart the function
-                return  # Ensure the current execution stops
+                return generate_midi(tempo, output_file, scale_type, render, tier, audio_format)  # Restart the function
             continue  # Retry the loop
 
         note_not_found_counter = 0  # Reset counter on success
@@ -179,8 +299,8 @@ def generate_midi(tempo=120, output_file="standard", scale_type=0):
         scale_type = MINOR_SCALE
 
 
-    generate_music(
-        output_file=f"{output_file}.mid",
+    midi_file = generate_music(
+        output_file=f"{output_file}.mid" if output_file is not None else None,
         tempo=tempo,
         key=root_note,
         scale_type=scale_type,
@@ -188,9 +308,16 @@ def generate_midi(tempo=120, output_file="standard", scale_type=0):
         style='trap',
     )
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    sf2_file = os.path.join(script_dir, "Sound Fonts", "Omega.sf2")
-    midi_to_wav(f"{output_file}.mid", sf2_file, f"{output_file}.wav")
+    if not render:
+        return midi_file
+
+    if output_file is None:
+        audio, timing = get_render_pool().render_bytes(midi_file, tier, audio_format)
+        print(f"Conversion successful! Rendered {len(audio)} bytes of {audio_format} in memory "
+              f"(render {timing['render']:.2f}s, encode {timing['encode']:.2f}s)")
+        return audio
+
+    midi_to_wav(midi_file, sf2_path, f"{output_file}.wav", pool=get_render_pool(), tier=tier)
 
 
 
@@ -1,13 +1,61 @@
 import subprocess
+from .renderer import CachedRenderer, MasteredRenderer, create_renderer, render_slices_to_wav, render_stems_to_wav
 
-def midi_to_wav(midi_file, sf2_file, output_wav):
+def midi_to_wav(midi_file, sf2_file, output_wav, pool=None, backend='fluidsynth', stems=False, slices=False,
+                block_cache=None, tier=None):
     """
     Convert a MIDI file to WAV using a SoundFont (.sf2) file and FluidSynth.
     
     :param midi_file: Path to the input MIDI file.
     :param sf2_file: Path to the SoundFont (.sf2) file.
     :param output_wav: Path to the output WAV file.
+    :param pool: Optional RenderPool with the SoundFont preloaded. Without
+        one, a new fluidsynth process is started for the song. The pool
+        only keeps the SoundFont loaded with the pyfluidsynth bindings;
+        without them its workers also start a fluidsynth process per song.
+        Render failures of the pool are raised.
+    :param backend: 'fluidsynth', or 'numpy' to render in-process with the
+        software synthesizer (the SoundFont is not used).
+    :param stems: Render the bass, chord, melody and drum stems in parallel
+        processes and mix them down.
+    :param slices: Split the song at its sections, render the slices in
+        parallel processes and stitch them back together.
+    :param block_cache: Optional BlockCache shared between songs. With one,
+        in-process renders reuse the audio of repeated section blocks.
+    :param tier: Render tier, e.g. 'preview' or 'master' (see RENDER_TIERS).
+        Full quality if None. Not applied to stem and slice renders.
+    :return: Job timing in seconds when rendered by the pool or in-process.
     """
+    if pool is not None:
+        timing = pool.render(midi_file, output_wav, tier)
+        print(f"Conversion successful! WAV file saved at: {output_wav} "
+              f"(render {timing['render']:.2f}s, queued {timing['queued']:.2f}s, worker {timing['worker']})")
+        return timing
+    
+    if stems or slices:
+        render_parallel = render_stems_to_wav if stems else render_slices_to_wav
+        timing = render_parallel(midi_file, output_wav, backend, sf2_file)
+        print(f"Conversion successful! WAV file saved at: {output_wav} (render {timing['render']:.2f}s)")
+        return timing
+    
+    if backend == 'numpy':
+        renderer = create_renderer('numpy', tier=tier)
+        if isinstance(renderer, MasteredRenderer) and block_cache is not None:
+            # Master the assembled song, not the blocks
+            renderer.renderer = CachedRenderer(renderer.renderer, block_cache)
+        elif block_cache is not None:
+            renderer = CachedRenderer(renderer, block_cache)
+        timing = renderer.render(midi_file, output_wav)
+        print(f"Conversion successful! WAV file saved at: {output_wav} (render {timing['render']:.2f}s)")
+        return timing
+    
+    if tier is not None:
+        renderer = create_renderer('fluidsynth', sf2_file, tier=tier)
+        timing = renderer.render(midi_file, output_wav)
+        renderer.close()
+        print(f"Conversion successful! WAV file saved at: {output_wav} (render {timing['render']:.2f}s)")
+        return timing
+    
     command = [
         "fluidsynth",
         "-ni", sf2_file,
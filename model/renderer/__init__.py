@@ -0,0 +1,14 @@
+from .wav import *
+from .flac import *
+from .drums import *
+from .synth import *
+from .effects import *
+from .tiers import *
+from .fluid import *
+from .mastering import *
+from .formats import *
+from .pool import *
+from .stems import *
+from .slices import *
+from .blocks import *
+from .cache import *
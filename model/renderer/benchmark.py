@@ -0,0 +1,70 @@
+"""
+Benchmark module for the audio rendering system.
+Provides a benchmark of the render cost of every render tier.
+
+Usage: python -m model.renderer.benchmark song.mid [backend] [sf2_file]
+"""
+
+import io
+import sys
+import time
+import mido
+from .pool import create_renderer
+from .tiers import RENDER_TIERS
+
+def benchmark_tiers(midi_file, backend='numpy', sf2_file=None, tiers=None, repeats=3):
+    """
+    Measure the render cost of render tiers.
+
+    Every tier renders the song once to warm up its caches, then the best of
+    repeats renders to memory is kept.
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file (fluidsynth only)
+        tiers (list): Tier names (every tier if None)
+        repeats (int): Timed renders per tier
+
+    Returns:
+        dict: Render time in seconds ('render'), song seconds rendered per
+            second ('realtime') and WAV size in bytes ('bytes') by tier name
+    """
+    if not isinstance(midi_file, mido.MidiFile):
+        midi_file = mido.MidiFile(midi_file)
+
+    results = {}
+    for tier in tiers or list(RENDER_TIERS):
+        settings = RENDER_TIERS[tier]
+        renderer = create_renderer(backend, sf2_file, tier=tier)
+        try:
+            renderer.render(midi_file, io.BytesIO())
+
+            best = None
+            for _ in range(repeats):
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                renderer.render(midi_file, buffer)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+        finally:
+            renderer.close()
+
+        # 44-byte header, then 2 bytes per sample
+        num_frames = (len(buffer.getvalue()) - 44) // (2 * settings['channels'])
+        results[tier] = {
+            'render': best,
+            'realtime': num_frames / settings['sample_rate'] / best,
+            'bytes': len(buffer.getvalue())
+        }
+
+    return results
+
+if __name__ == "__main__":
+    midi_path = sys.argv[1]
+    backend = sys.argv[2] if len(sys.argv) > 2 else 'numpy'
+    sf2_file = sys.argv[3] if len(sys.argv) > 3 else None
+
+    for tier, result in benchmark_tiers(midi_path, backend, sf2_file).items():
+        print(f"{tier:>8}: {result['render']:.3f}s, {result['realtime']:.1f}x realtime, "
+              f"{result['bytes'] / 1e6:.1f} MB")
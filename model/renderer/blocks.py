@@ -0,0 +1,333 @@
+"""
+Blocks module for the audio rendering system.
+Provides a render cache that renders every distinct section block of a
+channel once and assembles songs from the cached audio.
+"""
+
+import hashlib
+import time
+from collections import defaultdict, deque
+import mido
+import numpy as np
+from .cache import SampleCache
+from .drums import CHOKE_GROUPS, DRUM_CHANNELS
+from .slices import build_tempo_map, get_section_bounds, get_timeline, stitch_slices, tick_to_seconds
+from .wav import seconds_to_frames, to_float, to_mono, write_wav
+
+# Default size bound of a block cache in bytes
+BLOCK_CACHE_BYTES = 256 * 1024 * 1024
+
+# Seconds rendered after the last note of a block, so long tails are not
+# cut where the song would have kept rendering
+BLOCK_TAIL_SECONDS = 6.0
+
+# Level under which the end of a block is trimmed (-100 dBFS)
+SILENCE_LEVEL = 1e-5
+
+class BlockCache(SampleCache):
+    """
+    Least recently used cache of rendered blocks, bounded by size.
+    """
+
+    def __init__(self, max_bytes=BLOCK_CACHE_BYTES):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes (int): Most bytes of audio kept in the cache
+        """
+        super().__init__(max_bytes)
+
+def find_blocks(timeline, bounds):
+    """
+    Group the notes of a song into blocks by section and channel.
+
+    A block holds the notes of one channel that start in one section. It is
+    static when no channel message of its channel falls between the start
+    of the section and the last note-off of the block, so its audio only
+    depends on its notes and the channel state at the start of the section.
+    Drum hits in a choke group are left out of blocks, since they can be cut
+    by a hit in another section or on another drum channel.
+
+    Args:
+        timeline (list): List of (time in ticks, message) tuples
+        bounds (list): Start tick of every section
+
+    Returns:
+        dict: (section index, channel) -> dict with the timeline indices of
+            the block's messages ('messages'), the last note-off tick
+            ('end') and whether the block is static ('static')
+    """
+    blocks = {}
+    open_notes = defaultdict(deque)
+    section = 0
+    for index, (time, msg) in enumerate(timeline):
+        while section + 1 < len(bounds) and time >= bounds[section + 1]:
+            section += 1
+
+        if msg.type not in ('note_on', 'note_off'):
+            continue
+        if msg.channel in DRUM_CHANNELS and msg.note in CHOKE_GROUPS:
+            continue
+
+        if msg.type == 'note_on' and msg.velocity > 0:
+            block = blocks.setdefault((section, msg.channel),
+                                      {'messages': [], 'end': time, 'static': True})
+            block['messages'].append(index)
+            open_notes[(msg.channel, msg.note)].append(block)
+        else:
+            pending = open_notes[(msg.channel, msg.note)]
+            if pending:
+                block = pending.popleft()
+                block['messages'].append(index)
+                block['end'] = max(block['end'], time)
+
+    # Blocks with automation while they sound are not static
+    control_times = defaultdict(list)
+    for time, msg in timeline:
+        if not msg.is_meta and msg.type not in ('note_on', 'note_off'):
+            control_times[msg.channel].append(time)
+
+    for (section, channel), block in blocks.items():
+        start = bounds[section]
+        if any(start < time <= block['end'] for time in control_times[channel]):
+            block['static'] = False
+
+    return blocks
+
+def get_channel_state(timeline, channel, tick):
+    """
+    Get the program, controller and pitch bend state of a channel.
+
+    Args:
+        timeline (list): List of (time in ticks, message) tuples
+        channel (int): MIDI channel (0-15)
+        tick (int): Time in ticks (messages at this tick are included)
+
+    Returns:
+        dict: Last program change, control change of every controller and
+            pitch bend message by state key
+    """
+    state = {}
+    for time, msg in timeline:
+        if time > tick:
+            break
+        if msg.is_meta or msg.channel != channel:
+            continue
+        if msg.type == 'program_change':
+            state['program'] = msg
+        elif msg.type == 'control_change':
+            state[('control', msg.control)] = msg
+        elif msg.type == 'pitchwheel':
+            state['pitch'] = msg
+    return state
+
+def build_midi_file(ticks_per_beat, messages):
+    """
+    Build a format 0 MIDI file from timed messages.
+
+    Args:
+        ticks_per_beat (int): Ticks per beat
+        messages (list): List of (time in ticks, message) tuples, in order
+
+    Returns:
+        MidiFile: MIDI file object
+    """
+    midi_file = mido.MidiFile(type=0, ticks_per_beat=ticks_per_beat)
+    track = mido.MidiTrack()
+    midi_file.tracks.append(track)
+
+    prev_time = 0
+    for time, msg in messages:
+        track.append(msg.copy(time=time - prev_time))
+        prev_time = time
+    return midi_file
+
+def trim_silence(samples):
+    """
+    Trim the silent end of a sample buffer.
+
+    Args:
+        samples (ndarray): Stereo samples
+
+    Returns:
+        ndarray: Samples up to the last frame above SILENCE_LEVEL
+    """
+    audible = np.flatnonzero(np.abs(samples).max(axis=1) > SILENCE_LEVEL)
+    end = audible[-1] + 1 if len(audible) else 0
+    return samples[:end].copy()
+
+def get_block_key(timeline, block, state, start_tick, tempo, sample_rate):
+    """
+    Get the cache key of a static block.
+
+    The notes are identified by a digest of their relative timing, so a
+    pattern block is found again wherever and in whichever song it repeats.
+
+    Args:
+        timeline (list): List of (time in ticks, message) tuples
+        block (dict): Block from find_blocks()
+        state (dict): Channel state at the start of the block
+        start_tick (int): Start of the block's section in ticks
+        tempo (int): Tempo in microseconds per beat
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        tuple: (notes digest, channel state, tempo, sample rate)
+    """
+    digest = hashlib.sha1()
+    for index in block['messages']:
+        time, msg = timeline[index]
+        digest.update(f"{time - start_tick}:{msg.type}:{msg.channel}:{msg.note}:{msg.velocity};".encode())
+
+    channel_state = tuple(sorted(tuple(msg.bytes()) for msg in state.values()))
+    return (digest.hexdigest(), channel_state, tempo, sample_rate)
+
+def render_blocks(midi_file, renderer, cache, tail=None):
+    """
+    Render a song from cached section blocks.
+
+    Static blocks (see find_blocks()) are rendered once per distinct key and
+    placed at their section offsets. Everything else, such as transitions and
+    blocks with automation, is rendered in one pass on top.
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        renderer (NumpySynthRenderer or FluidSynthRenderer): Renderer
+        cache (BlockCache): Block cache
+        tail (float): Seconds rendered after the song (renderer.tail if None)
+
+    Returns:
+        tuple: (float32 stereo samples with shape (frames, 2), number of
+            blocks placed from the cache or rendered)
+    """
+    if not isinstance(midi_file, mido.MidiFile):
+        midi_file = mido.MidiFile(midi_file)
+
+    ticks_per_beat = midi_file.ticks_per_beat
+    sample_rate = renderer.sample_rate
+    timeline = get_timeline(midi_file)
+    tempo_map = build_tempo_map(timeline, ticks_per_beat)
+    bounds = get_section_bounds(midi_file, timeline)
+
+    # Blocks can only be moved in time when the tempo never changes
+    if len(tempo_map) > 2 or (len(tempo_map) == 2 and tempo_map[1][0] > 0):
+        return to_float(renderer.render_samples(midi_file, normalize=False, tail=tail)), 0
+    tempo = tempo_map[-1][2]
+    tempo_meta = mido.MetaMessage('set_tempo', tempo=tempo)
+
+    block_samples = []
+    offsets = []
+    placed = set()
+    song_tail = renderer.tail if tail is None else tail
+    for (section, channel), block in find_blocks(timeline, bounds).items():
+        if not block['static']:
+            continue
+
+        start_tick = bounds[section]
+        state = get_channel_state(timeline, channel, start_tick)
+        key = get_block_key(timeline, block, state, start_tick, tempo, sample_rate)
+
+        samples = cache.get(key)
+        if samples is None:
+            messages = [(0, tempo_meta)] + [(0, msg) for msg in state.values()]
+            messages += [(timeline[index][0] - start_tick, timeline[index][1]) for index in block['messages']]
+            samples = renderer.render_samples(build_midi_file(ticks_per_beat, messages), normalize=False,
+                                              tail=max(song_tail, BLOCK_TAIL_SECONDS))
+            samples = trim_silence(to_float(samples))
+            cache.put(key, samples)
+
+        block_samples.append(samples)
+        offsets.append(seconds_to_frames(tick_to_seconds(start_tick, tempo_map, ticks_per_beat), sample_rate))
+        placed.update(block['messages'])
+
+    # Render the rest of the song (with the full controller state) on top.
+    # The text message at the last tick keeps the length of the song
+    song_end = timeline[-1][0] if timeline else 0
+    residual = [(time, msg) for index, (time, msg) in enumerate(timeline) if index not in placed]
+    residual.append((song_end, mido.MetaMessage('text', text='end')))
+    residual_samples = to_float(renderer.render_samples(build_midi_file(ticks_per_beat, residual), normalize=False,
+                                                        tail=song_tail))
+
+    output = stitch_slices(block_samples + [residual_samples], offsets + [0])
+    return output[:len(residual_samples)], len(block_samples)
+
+class CachedRenderer:
+    """
+    Renderer that assembles songs from cached section blocks.
+
+    Wraps a NumpySynthRenderer or FluidSynthRenderer. The cache outlives
+    songs, so repeated patterns are synthesized once per process.
+    """
+
+    def __init__(self, renderer, cache=None, headroom_db=1.0):
+        """
+        Initialize the renderer.
+
+        Args:
+            renderer (NumpySynthRenderer or FluidSynthRenderer): Renderer
+            cache (BlockCache): Block cache (a new cache if None)
+            headroom_db (float): The result is scaled down so its peak stays
+                this many dB below full scale (when normalizing)
+        """
+        self.renderer = renderer
+        self.cache = cache or BlockCache()
+        self.headroom_db = headroom_db
+
+    @property
+    def sample_rate(self):
+        """Sample rate of the wrapped renderer in Hz."""
+        return self.renderer.sample_rate
+
+    @property
+    def tail(self):
+        """Seconds rendered after the last event."""
+        return self.renderer.tail
+
+    @tail.setter
+    def tail(self, value):
+        self.renderer.tail = value
+
+    def render_samples(self, midi_file, normalize=True, tail=None):
+        """
+        Render a MIDI file to a sample buffer.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            normalize (bool): Scale the result down to the headroom if it is louder
+            tail (float): Seconds rendered after the last event (self.tail if None)
+
+        Returns:
+            ndarray: float32 stereo samples with shape (frames, 2)
+        """
+        output, _ = render_blocks(midi_file, self.renderer, self.cache, tail)
+
+        peak_level = 10.0 ** (-self.headroom_db / 20.0)
+        peak = np.abs(output).max(initial=0.0)
+        if normalize and peak > peak_level:
+            output *= peak_level / peak
+
+        return output
+
+    def render(self, midi_file, output_wav):
+        """
+        Render a MIDI file to a WAV file.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            output_wav (str or file): Output path or writable binary file object
+
+        Returns:
+            dict: Timing of the render in seconds ('render') and the cache
+                hit rate ('cache_hit_rate')
+        """
+        start = time.perf_counter()
+        samples = self.render_samples(midi_file)
+        if getattr(self.renderer, 'channels', 2) == 1:
+            samples = to_mono(samples)
+        write_wav(output_wav, samples, self.sample_rate)
+        return {'render': time.perf_counter() - start, 'cache_hit_rate': self.cache.stats()['hit_rate']}
+
+    def close(self):
+        """Release the wrapped renderer."""
+        self.renderer.close()
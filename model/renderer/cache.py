@@ -0,0 +1,82 @@
+"""
+Cache module for the audio rendering system.
+Provides a thread-safe least recently used cache of rendered samples,
+bounded by the size of the samples it holds.
+"""
+
+import threading
+from collections import OrderedDict
+
+class SampleCache:
+    """
+    Least recently used cache of rendered samples, bounded by size.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes (int): Most bytes of samples kept in the cache
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Get cached samples.
+
+        Args:
+            key (tuple): Samples key
+
+        Returns:
+            ndarray: Cached samples, or None if they are not cached
+        """
+        with self.lock:
+            samples = self.entries.get(key)
+            if samples is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return samples
+
+    def put(self, key, samples):
+        """
+        Add samples, evicting the least recently used entries over the bound.
+
+        Args:
+            key (tuple): Samples key
+            samples (ndarray): Rendered samples
+        """
+        with self.lock:
+            if key in self.entries:
+                return
+
+            self.entries[key] = samples
+            self.size += samples.nbytes
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+            dict: Cached entries, size in bytes, hits, misses and hit rate
+        """
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.entries),
+                'bytes': self.size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
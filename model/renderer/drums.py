@@ -0,0 +1,294 @@
+"""
+Drums module for the audio rendering system.
+Provides a sample-based drum mixer that places every hit with a vectorized
+scatter-add instead of running a synthesizer voice per hit.
+"""
+
+import os
+from functools import lru_cache
+import numpy as np
+from .wav import read_wav, seconds_to_frames, to_float
+
+# Channels rendered as drums (GM drums and the secondary drum channel)
+DRUM_CHANNELS = (9, 10)
+
+# Drum voices by note: (kind, frequency in Hz, decay in seconds, gain)
+DRUM_VOICES = {
+    35: ('kick', 50.0, 0.4, 1.0),
+    36: ('kick', 55.0, 0.35, 1.0),
+    37: ('snare', 400.0, 0.05, 0.4),     # Rim
+    38: ('snare', 180.0, 0.18, 0.7),
+    39: ('clap', 0.0, 0.15, 0.6),
+    40: ('snare', 200.0, 0.15, 0.7),
+    41: ('tom', 80.0, 0.3, 0.6),
+    42: ('hat', 0.0, 0.05, 0.3),         # Closed hat
+    43: ('tom', 95.0, 0.3, 0.6),
+    44: ('hat', 0.0, 0.04, 0.25),        # Pedal hat
+    45: ('tom', 110.0, 0.3, 0.6),
+    46: ('hat', 0.0, 0.35, 0.3),         # Open hat
+    47: ('tom', 130.0, 0.28, 0.6),
+    48: ('tom', 150.0, 0.26, 0.6),
+    49: ('hat', 0.0, 1.2, 0.35),         # Crash
+    50: ('tom', 175.0, 0.25, 0.6),
+    51: ('hat', 0.0, 0.8, 0.2),          # Ride
+    54: ('hat', 0.0, 0.15, 0.25)         # Tambourine
+}
+DEFAULT_DRUM_VOICE = ('hat', 0.0, 0.15, 0.25)
+
+# One-shot sample file of each drum note
+DRUM_SAMPLES = {
+    35: 'kick.wav',
+    36: 'kick.wav',
+    37: 'rim.wav',
+    38: 'snare.wav',
+    39: 'clap.wav',
+    40: 'snare.wav',
+    41: 'low_tom.wav',
+    42: 'closed_hat.wav',
+    44: 'pedal_hat.wav',
+    46: 'open_hat.wav',
+    47: 'mid_tom.wav',
+    49: 'crash.wav',
+    50: 'high_tom.wav',
+    51: 'ride.wav',
+    54: 'tambourine.wav'
+}
+
+# Choke group of each drum note: a hit cuts the sounding hits of its group
+CHOKE_GROUPS = {
+    42: 'hat',
+    44: 'hat',
+    46: 'hat'
+}
+
+# Fade applied when a hit is choked, in seconds
+CHOKE_FADE = 0.005
+
+# Frames scattered per batch, keeping the temporary index arrays small
+MAX_BATCH_SAMPLES = 1 << 18
+
+def resample(samples, source_rate, target_rate):
+    """
+    Resample a mono buffer by linear interpolation.
+
+    Args:
+        samples (ndarray): Mono samples
+        source_rate (int): Sample rate of the samples in Hz
+        target_rate (int): Target sample rate in Hz
+
+    Returns:
+        ndarray: Resampled samples
+    """
+    if source_rate == target_rate:
+        return samples
+    num_frames = int(len(samples) * target_rate / source_rate)
+    positions = np.arange(num_frames) * (source_rate / target_rate)
+    return np.interp(positions, np.arange(len(samples)), samples).astype(np.float32)
+
+@lru_cache(maxsize=None)
+def render_drum_voice(note, sample_rate):
+    """
+    Render a drum hit at full velocity.
+
+    Args:
+        note (int): MIDI drum note number
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        ndarray: Mono samples
+    """
+    kind, frequency, decay, gain = DRUM_VOICES.get(note, DEFAULT_DRUM_VOICE)
+    num_frames = int(decay * 4.0 * sample_rate)
+    t = np.arange(num_frames) / sample_rate
+    envelope = np.exp(-t / decay)
+    noise = np.random.default_rng(note).uniform(-1.0, 1.0, num_frames)
+
+    if kind in ('kick', 'tom'):
+        # Sine with a falling pitch
+        sweep = frequency * (1.0 + 2.0 * np.exp(-t / 0.03))
+        samples = np.sin(2.0 * np.pi * np.cumsum(sweep) / sample_rate)
+    elif kind == 'snare':
+        samples = 0.4 * np.sin(2.0 * np.pi * frequency * t) + 0.6 * noise
+    elif kind == 'clap':
+        # Three quick bursts before the tail
+        bursts = 1.0 + np.isin((t * 100).astype(int), [0, 2]) * 1.5
+        samples = noise * bursts
+    else:
+        # First difference tilts the noise towards the highs
+        samples = np.diff(noise, prepend=0.0)
+
+    return (samples * envelope * gain).astype(np.float32)
+
+def get_choke_limits(starts, notes):
+    """
+    Get the number of frames each hit sounds before it is choked.
+
+    Args:
+        starts (ndarray): Start frame of each hit
+        notes (ndarray): Drum note of each hit
+
+    Returns:
+        ndarray: Frames until the next hit of the same choke group (a large
+            value for hits that are never choked)
+    """
+    limits = np.full(len(starts), np.iinfo(np.int64).max // 2, dtype=np.int64)
+
+    for group in set(CHOKE_GROUPS.values()):
+        members = np.flatnonzero(np.isin(notes, [n for n, g in CHOKE_GROUPS.items() if g == group]))
+        if len(members) < 2:
+            continue
+
+        # Hits of the group in time order, each choked by the next
+        members = members[np.argsort(starts[members], kind='stable')]
+        next_starts = starts[members[1:]]
+        gaps = next_starts - starts[members[:-1]]
+        limits[members[:-1]] = np.where(gaps > 0, gaps, limits[members[:-1]])
+
+    return limits
+
+class DrumKit:
+    """
+    Set of one-shot drum samples, loaded once.
+
+    Samples are read from WAV files in a sample directory. Notes without a
+    sample file use the synthesized drum voices of the software synthesizer.
+    """
+
+    def __init__(self, sample_dir=None, sample_rate=44100):
+        """
+        Initialize the kit and load the samples.
+
+        Args:
+            sample_dir (str): Directory with the one-shot WAV files (see DRUM_SAMPLES)
+            sample_rate (int): Sample rate in Hz
+        """
+        self.sample_dir = sample_dir
+        self.sample_rate = sample_rate
+        self.samples = {}
+
+        if sample_dir is None:
+            return
+
+        for note, filename in DRUM_SAMPLES.items():
+            path = os.path.join(sample_dir, filename)
+            if os.path.exists(path):
+                samples, source_rate = read_wav(path)
+                mono = to_float(samples).mean(axis=1)
+                self.samples[note] = resample(mono, source_rate, sample_rate)
+
+    def get_sample(self, note):
+        """
+        Get the one-shot sample of a drum note.
+
+        Args:
+            note (int): MIDI drum note number
+
+        Returns:
+            ndarray: Mono samples
+        """
+        if note not in self.samples:
+            self.samples[note] = render_drum_voice(note, self.sample_rate)
+        return self.samples[note]
+
+    def render_hits(self, starts, notes, gains, pans, num_frames):
+        """
+        Mix drum hits into a stereo buffer.
+
+        Every hit is expanded to the frames it sounds (cut short when it is
+        choked or reaches the end of the buffer) and the frames of a batch of
+        hits are scattered into the buffer with one bincount per channel, so
+        the cost grows with the number of hits rather than with voices.
+
+        Args:
+            starts (ndarray): Start frame of each hit
+            notes (ndarray): Drum note of each hit
+            gains (ndarray): Gain of each hit (velocity times channel volume)
+            pans (ndarray): Pan of each hit (0-127)
+            num_frames (int): Length of the output buffer
+
+        Returns:
+            ndarray: float32 stereo samples with shape (frames, 2)
+        """
+        output = np.zeros((num_frames, 2), dtype=np.float32)
+        if len(starts) == 0:
+            return output
+
+        # Hits in time order keep the frames of a batch close together
+        order = np.argsort(starts, kind='stable')
+        starts, notes, gains, pans = starts[order], notes[order], gains[order], pans[order]
+
+        limits = get_choke_limits(starts, notes)
+        fade_frames = max(1, int(CHOKE_FADE * self.sample_rate))
+
+        # Equal-power pan
+        angles = pans / 127.0 * np.pi / 2.0
+        channel_gains = np.stack([gains * np.cos(angles), gains * np.sin(angles)], axis=1)
+
+        # One buffer with the sample of every note played
+        unique_notes, note_indices = np.unique(notes, return_inverse=True)
+        samples = [self.get_sample(int(note)) for note in unique_notes]
+        sample_lengths = np.array([len(sample) for sample in samples])
+        bases = np.concatenate([[0], np.cumsum(sample_lengths)[:-1]])
+        bank = np.concatenate(samples)
+
+        lengths = np.minimum(np.minimum(sample_lengths[note_indices], limits), num_frames - starts)
+        lengths = np.maximum(lengths, 0)
+        ends = np.cumsum(lengths)
+        choked = lengths == limits
+
+        # Fade ramp applied to the last frames of choked hits
+        fade = np.linspace(1.0, 0.0, fade_frames + 1)[1:]
+
+        # Split the hits into batches of about MAX_BATCH_SAMPLES frames
+        bounds = np.searchsorted(ends, np.arange(MAX_BATCH_SAMPLES, ends[-1], MAX_BATCH_SAMPLES))
+        bounds = np.unique(np.concatenate([[0], bounds + 1, [len(starts)]]))
+
+        for first, last in zip(bounds[:-1], bounds[1:]):
+            batch_lengths = lengths[first:last]
+            batch_starts = ends[first:last] - batch_lengths - (ends[first] - batch_lengths[0])
+            total = int(batch_lengths.sum())
+            if total == 0:
+                continue
+
+            # Output position and bank position of every frame of the batch
+            frames = np.arange(total)
+            positions = frames + np.repeat(starts[first:last] - batch_starts, batch_lengths)
+            values = bank[frames + np.repeat(bases[note_indices[first:last]] - batch_starts, batch_lengths)]
+
+            # Fade out the end of choked hits
+            batch_choked = np.flatnonzero(choked[first:last] & (batch_lengths >= fade_frames))
+            if len(batch_choked):
+                fade_starts = batch_starts[batch_choked] + batch_lengths[batch_choked] - fade_frames
+                fade_positions = (fade_starts[:, None] + np.arange(fade_frames)[None, :]).ravel()
+                values[fade_positions] *= np.tile(fade, len(batch_choked))
+
+            low = int(positions[0])
+            high = int(positions.max()) + 1
+            for channel in range(2):
+                weights = values * np.repeat(channel_gains[first:last, channel], batch_lengths)
+                output[low:high, channel] += np.bincount(positions - low, weights=weights, minlength=high - low)
+
+        return output
+
+    def render_notes(self, notes, num_frames):
+        """
+        Mix the drum notes of a song into a stereo buffer.
+
+        Args:
+            notes (list): List of (start, end, channel, note, velocity,
+                program, volume, pan) tuples with times in seconds
+            num_frames (int): Length of the output buffer
+
+        Returns:
+            ndarray: float32 stereo samples with shape (frames, 2)
+        """
+        hits = [note for note in notes if note[2] in DRUM_CHANNELS]
+        if not hits:
+            return np.zeros((num_frames, 2), dtype=np.float32)
+
+        columns = np.array([(start, note, velocity, volume, pan)
+                            for start, _, _, note, velocity, _, volume, pan in hits])
+        starts = seconds_to_frames(columns[:, 0], self.sample_rate)
+        notes = columns[:, 1].astype(np.int64)
+        gains = columns[:, 2] / 127.0 * columns[:, 3]
+        return self.render_hits(starts, notes, gains, columns[:, 4], num_frames)
@@ -0,0 +1,345 @@
+"""
+Effects module for the audio rendering system.
+Provides a NumPy effects chain (soft-clip distortion, resonant low-pass
+filter, tempo-synced delay and convolution reverb) driven by the effect
+controllers of a song, so effects sound the same whichever engine renders
+the notes.
+"""
+
+from collections import defaultdict
+from functools import lru_cache
+import numpy as np
+from .synth import iter_timed_messages
+from .wav import seconds_to_frames
+
+# Effect controllers (see composer/audio_effects.py)
+REVERB_CC = 91
+DELAY_CC = 94
+DISTORTION_CC = 92
+FILTER_CUTOFF_CC = 74
+FILTER_RESONANCE_CC = 71
+
+# Controller values of channels that never send them (GM defaults)
+DEFAULT_CONTROLS = {
+    REVERB_CC: 40,
+    DELAY_CC: 0,
+    DISTORTION_CC: 0,
+    FILTER_CUTOFF_CC: 127,
+    FILTER_RESONANCE_CC: 64
+}
+
+# Reverb decay time (RT60) in seconds and level of the reverb return
+REVERB_SECONDS = 2.0
+REVERB_LEVEL = 0.5
+
+# Delay time in beats (dotted eighth), feedback gain and most echoes
+DELAY_BEATS = 0.75
+DELAY_FEEDBACK = 0.35
+MAX_DELAY_REPEATS = 8
+
+# Level at which the ringing of a filter segment is cut, and the longest ring
+FILTER_TAIL_LEVEL = 1e-6
+MAX_FILTER_TAIL_SECONDS = 1.0
+
+# Highest cutoff as a fraction of the sample rate
+MAX_CUTOFF_RATIO = 0.45
+
+# Smallest block of a block convolution, keeping the number of FFTs low
+MIN_CONVOLUTION_BLOCK = 1 << 14
+
+def get_control_changes(midi_file, sample_rate):
+    """
+    Get the effect controller changes of every channel and the song tempo.
+
+    Args:
+        midi_file (MidiFile): MIDI file object
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        tuple: (dict of (channel, control) -> (frame array, value array) in
+            time order, first tempo in microseconds per beat)
+    """
+    changes = defaultdict(lambda: ([], []))
+    tempo = None
+    for seconds, msg in iter_timed_messages(midi_file):
+        if msg.type == 'control_change' and msg.control in DEFAULT_CONTROLS:
+            frames, values = changes[(msg.channel, msg.control)]
+            frames.append(seconds)
+            values.append(msg.value)
+        elif msg.type == 'set_tempo' and tempo is None:
+            tempo = msg.tempo
+
+    changes = {
+        key: (seconds_to_frames(np.array(seconds), sample_rate), np.array(values, dtype=np.float32))
+        for key, (seconds, values) in changes.items()
+    }
+    return changes, tempo or 500000
+
+def control_curve(changes, default, num_frames):
+    """
+    Build the per-frame value of a controller.
+
+    Args:
+        changes (tuple): (frame array, value array), or None for no changes
+        default (float): Value before the first change
+        num_frames (int): Length of the curve
+
+    Returns:
+        ndarray: float32 values, held from each change to the next
+    """
+    if changes is None:
+        return np.full(num_frames, default, dtype=np.float32)
+
+    frames, values = changes
+    bounds = np.clip(frames, 0, num_frames)
+    lengths = np.diff(np.concatenate([[0], bounds, [num_frames]]))
+    return np.repeat(np.concatenate([[default], values]), lengths).astype(np.float32)
+
+def soft_clip(samples, amount):
+    """
+    Apply a tanh soft-clip distortion.
+
+    Args:
+        samples (ndarray): Stereo samples
+        amount (ndarray): Distortion amount of each frame (0.0 leaves the
+            samples untouched, 1.0 is fully driven)
+
+    Returns:
+        ndarray: Distorted stereo samples
+    """
+    amount = amount[:, None]
+    drive = 1.0 + 9.0 * amount
+    wet = np.tanh(samples * drive) / np.tanh(drive)
+    return samples + amount * (wet - samples)
+
+def lowpass_coefficients(cutoff, q, sample_rate):
+    """
+    Get the coefficients of a resonant low-pass biquad.
+
+    Args:
+        cutoff (float): Cutoff frequency in Hz
+        q (float): Resonance (0.707 for a flat passband)
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        tuple: (numerator, denominator) coefficient arrays, normalized so the
+            denominator starts with 1.0
+    """
+    w0 = 2.0 * np.pi * min(cutoff, MAX_CUTOFF_RATIO * sample_rate) / sample_rate
+    alpha = np.sin(w0) / (2.0 * q)
+    cos_w0 = np.cos(w0)
+
+    b = np.array([(1.0 - cos_w0) / 2.0, 1.0 - cos_w0, (1.0 - cos_w0) / 2.0])
+    a = np.array([1.0 + alpha, -2.0 * cos_w0, 1.0 - alpha])
+    return b / a[0], a / a[0]
+
+def impulse_response(b, a, max_frames, tail_level=FILTER_TAIL_LEVEL):
+    """
+    Get the impulse response of an IIR filter, cut where it has rung out.
+
+    The response is read from the frequency response, over an FFT long
+    enough that the wrapped-around ring is below tail_level.
+
+    Args:
+        b (ndarray): Numerator coefficients
+        a (ndarray): Denominator coefficients, starting with 1.0
+        max_frames (int): Longest response
+        tail_level (float): Level below which the response is cut
+
+    Returns:
+        ndarray: Impulse response
+    """
+    radius = np.abs(np.roots(a)).max()
+    length = max_frames if radius >= 1.0 else min(max_frames, int(np.log(tail_level) / np.log(radius)))
+    n = 1 << (2 * length + 1).bit_length()
+    return np.fft.irfft(np.fft.rfft(b, n) / np.fft.rfft(a, n), n)[:length + 1]
+
+def filter_sweep(samples, cutoffs, resonances, sample_rate):
+    """
+    Apply a low-pass filter whose cutoff and resonance follow controllers.
+
+    The song is split where a controller changes, and each segment is
+    convolved with the impulse response of its own biquad. The response
+    rings on past the segment end and is overlap-added, so every frame is
+    filtered by the filter of its own time and coefficient changes do not
+    click.
+
+    Args:
+        samples (ndarray): Stereo samples
+        cutoffs (ndarray): Cutoff controller value of each frame (0-127)
+        resonances (ndarray): Resonance controller value of each frame (0-127)
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        ndarray: Filtered stereo samples
+    """
+    num_frames = len(samples)
+    max_tail = int(MAX_FILTER_TAIL_SECONDS * sample_rate)
+    output = np.zeros((num_frames + max_tail, samples.shape[1]), dtype=np.float32)
+
+    changed = (np.diff(cutoffs) != 0) | (np.diff(resonances) != 0)
+    starts = np.concatenate([[0], np.flatnonzero(changed) + 1])
+    ends = np.concatenate([starts[1:], [num_frames]])
+
+    for start, end in zip(starts, ends):
+        # 20 Hz to 20 kHz, exponential; resonance 64 is a flat passband
+        cutoff = 20.0 * 1000.0 ** (cutoffs[start] / 127.0)
+        q = 0.707 * 2.0 ** ((resonances[start] - 64.0) / 32.0)
+        response = impulse_response(*lowpass_coefficients(cutoff, q, sample_rate), max_tail)
+
+        filtered = convolve(samples[start:end], response[:, None], full=True)
+        output[start:start + len(filtered)] += filtered
+
+    return output[:num_frames]
+
+def tempo_delay(samples, delay_frames, feedback=DELAY_FEEDBACK, max_repeats=MAX_DELAY_REPEATS):
+    """
+    Apply a feedback delay as a sum of decaying echoes.
+
+    Args:
+        samples (ndarray): Stereo samples sent to the delay
+        delay_frames (int): Frames between echoes
+        feedback (float): Gain of each echo relative to the one before
+        max_repeats (int): Most echoes
+
+    Returns:
+        ndarray: Echoes only (no dry signal)
+    """
+    output = np.zeros_like(samples)
+    gain = 1.0
+    for repeat in range(1, max_repeats + 1):
+        offset = repeat * delay_frames
+        if offset >= len(samples) or gain < 1e-3:
+            break
+        output[offset:] += samples[:-offset] * gain
+        gain *= feedback
+    return output
+
+@lru_cache(maxsize=8)
+def build_reverb_response(seconds, sample_rate, seed=0):
+    """
+    Build a stereo reverb impulse response.
+
+    The response is exponentially decaying noise, decorrelated between the
+    channels and seeded, so every render gets the same room.
+
+    Args:
+        seconds (float): Decay time to -60 dB (RT60) in seconds
+        sample_rate (int): Sample rate in Hz
+        seed (int): Noise seed
+
+    Returns:
+        ndarray: float32 stereo impulse response with unit energy per channel
+    """
+    num_frames = int(seconds * sample_rate)
+    t = np.arange(num_frames) / sample_rate
+    envelope = 10.0 ** (-3.0 * t / seconds)
+    noise = np.random.default_rng(seed).standard_normal((num_frames, 2))
+    response = noise * envelope[:, None]
+    return (response / np.sqrt((response ** 2).sum(axis=0))).astype(np.float32)
+
+def convolve(samples, response, full=False):
+    """
+    Convolve stereo samples with an impulse response.
+
+    The samples are convolved block by block (overlap-add), so the FFTs stay
+    about the size of the response.
+
+    Args:
+        samples (ndarray): Stereo samples
+        response (ndarray): Impulse response with shape (frames, 2), or
+            (frames, 1) for the same response on both channels
+        full (bool): Keep the tail past the end of the samples
+
+    Returns:
+        ndarray: float32 convolved samples, cut to the length of the samples
+            unless full is set
+    """
+    num_frames = len(samples)
+    block = max(MIN_CONVOLUTION_BLOCK, 1 << (len(response) - 1).bit_length())
+    n = 2 * block
+    response_spectrum = np.fft.rfft(response, n, axis=0)
+
+    output = np.zeros((num_frames + n, samples.shape[1]), dtype=np.float32)
+    for start in range(0, num_frames, block):
+        spectrum = np.fft.rfft(samples[start:start + block], n, axis=0) * response_spectrum
+        output[start:start + n] += np.fft.irfft(spectrum, n, axis=0)
+    return output[:num_frames + len(response) - 1] if full else output[:num_frames]
+
+class EffectsChain:
+    """
+    Per-channel effects driven by the effect controllers of a song.
+
+    Every channel runs through a soft-clip distortion (CC 92) and a
+    resonant low-pass filter (CC 74 and 71, only on channels that send a
+    cutoff), then sends to a tempo-synced delay (CC 94) and a convolution
+    reverb (CC 91) shared by all channels. Chorus is not rendered.
+    """
+
+    def __init__(self, sample_rate=44100, reverb_seconds=REVERB_SECONDS, reverb_level=REVERB_LEVEL,
+                 delay_beats=DELAY_BEATS, feedback=DELAY_FEEDBACK, max_repeats=MAX_DELAY_REPEATS):
+        """
+        Initialize the chain.
+
+        The reverb time and the number of echoes set the cost of the chain;
+        0 turns the reverb or the delay off.
+
+        Args:
+            sample_rate (int): Sample rate in Hz
+            reverb_seconds (float): Reverb decay time in seconds
+            reverb_level (float): Level of the reverb return
+            delay_beats (float): Delay time in beats
+            feedback (float): Gain of each echo relative to the one before
+            max_repeats (int): Most echoes
+        """
+        self.sample_rate = sample_rate
+        self.reverb_seconds = reverb_seconds
+        self.reverb_level = reverb_level
+        self.delay_beats = delay_beats
+        self.feedback = feedback
+        self.max_repeats = max_repeats
+
+    def process(self, channel_samples, midi_file):
+        """
+        Apply the effects to rendered channels and mix them.
+
+        Args:
+            channel_samples (dict): float stereo samples of each channel by
+                MIDI channel, all of the same length
+            midi_file (MidiFile): MIDI file the channels were rendered from
+
+        Returns:
+            ndarray: float32 stereo mix with shape (frames, 2)
+        """
+        num_frames = max((len(samples) for samples in channel_samples.values()), default=0)
+        changes, tempo = get_control_changes(midi_file, self.sample_rate)
+
+        def curve(channel, control):
+            return control_curve(changes.get((channel, control)), DEFAULT_CONTROLS[control], num_frames)
+
+        mix = np.zeros((num_frames, 2), dtype=np.float32)
+        delay_send = np.zeros_like(mix)
+        reverb_send = np.zeros_like(mix)
+
+        for channel, samples in channel_samples.items():
+            if (channel, DISTORTION_CC) in changes:
+                samples = soft_clip(samples, curve(channel, DISTORTION_CC) / 127.0)
+            if (channel, FILTER_CUTOFF_CC) in changes:
+                samples = filter_sweep(samples, curve(channel, FILTER_CUTOFF_CC),
+                                       curve(channel, FILTER_RESONANCE_CC), self.sample_rate)
+
+            mix[:len(samples)] += samples
+            if self.max_repeats and (channel, DELAY_CC) in changes:
+                delay_send[:len(samples)] += samples * (curve(channel, DELAY_CC) / 127.0)[:len(samples), None]
+            if self.reverb_seconds:
+                reverb_send[:len(samples)] += samples * (curve(channel, REVERB_CC) / 127.0)[:len(samples), None]
+
+        if self.max_repeats and delay_send.any():
+            delay_frames = seconds_to_frames(self.delay_beats * tempo / 1e6, self.sample_rate)
+            mix += tempo_delay(delay_send, delay_frames, self.feedback, self.max_repeats)
+
+        if self.reverb_seconds and reverb_send.any():
+            response = build_reverb_response(self.reverb_seconds, self.sample_rate)
+            mix += convolve(reverb_send, response) * self.reverb_level
+
+        return mix
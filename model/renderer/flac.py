@@ -0,0 +1,478 @@
+"""
+FLAC module for the audio rendering system.
+Provides a NumPy FLAC encoder for 16-bit sample buffers and sample streams.
+
+Frames use the fixed polynomial predictors with partitioned Rice coding and
+stereo decorrelation. Every stage works on a batch of frames at once; the
+bitstream is assembled by placing all fields with one cumulative sum.
+"""
+
+import functools
+import hashlib
+import struct
+import numpy as np
+from .wav import to_int16
+
+# Samples per channel in a frame
+FLAC_BLOCK_SIZE = 4096
+
+# Frames encoded together (bounds the memory of a batch)
+FLAC_BATCH_FRAMES = 128
+
+# Highest fixed predictor order, Rice partition order and Rice parameter
+MAX_FIXED_ORDER = 4
+MAX_PARTITION_ORDER = 8
+MAX_RICE_PARAMETER = 14
+
+# Frame header sample rate codes (others are read from STREAMINFO)
+SAMPLE_RATE_CODES = {
+    88200: 0b0001, 176400: 0b0010, 192000: 0b0011, 8000: 0b0100,
+    16000: 0b0101, 22050: 0b0110, 24000: 0b0111, 32000: 0b1000,
+    44100: 0b1001, 48000: 0b1010, 96000: 0b1011
+}
+
+# Stereo channel assignments: codes and the signals stored in each
+CHANNEL_ASSIGNMENTS = (
+    (0b0001, 'left', 'right'),
+    (0b1000, 'left', 'side'),
+    (0b1001, 'side', 'right'),
+    (0b1010, 'mid', 'side')
+)
+
+# Frame header fields of 8 bits reserved per frame
+HEADER_SLOTS = 16
+
+def crc8(data):
+    """
+    Get the CRC-8 of a FLAC frame header (polynomial 0x07).
+
+    Args:
+        data (bytes): Header bytes
+
+    Returns:
+        int: CRC
+    """
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+    return crc
+
+@functools.lru_cache(maxsize=1)
+def crc16_table():
+    """
+    Get the CRC-16 (polynomial 0x8005) of every 16-bit word.
+
+    Returns:
+        ndarray: uint16 CRC by word
+    """
+    crc = np.arange(1 << 16, dtype=np.uint32)
+    for _ in range(16):
+        crc = np.where(crc & 0x8000, (crc << 1) ^ 0x8005, crc << 1) & 0xFFFF
+    return crc.astype(np.uint16)
+
+def crc16_frames(data, starts, lengths):
+    """
+    Get the CRC-16 of many byte ranges at once.
+
+    The ranges are right-aligned in a zero-padded matrix (leading zeros do
+    not change a CRC that starts at zero) and fed 16 bits at a time, all
+    ranges together.
+
+    Args:
+        data (ndarray): uint8 bytes
+        starts (ndarray): Start of every range
+        lengths (ndarray): Length of every range
+
+    Returns:
+        ndarray: uint16 CRC of every range
+    """
+    width = int(lengths.max(initial=0) + 1) // 2 * 2
+    rows = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+    matrix = np.zeros((len(starts), width), dtype=np.uint8)
+    matrix[rows, width - lengths[rows] + offsets] = data[starts[rows] + offsets]
+    words = np.ascontiguousarray(matrix.view('>u2').astype(np.uint16).T)
+
+    table = crc16_table()
+    crc = np.zeros(len(starts), dtype=np.uint16)
+    for column in words:
+        crc = table[crc ^ column]
+    return crc
+
+def encode_frame_number(value):
+    """
+    Encode a frame number in the UTF-8 style coding of FLAC frame headers.
+
+    Args:
+        value (int): Frame number
+
+    Returns:
+        bytes: Coded number
+    """
+    if value < 0x80:
+        return bytes([value])
+
+    num_bytes = 2
+    while value >= 1 << (5 * num_bytes + 1):
+        num_bytes += 1
+
+    coded = []
+    for _ in range(num_bytes - 1):
+        coded.append(0x80 | value & 0x3F)
+        value >>= 6
+    coded.append((0xFF00 >> num_bytes) & 0xFF | value)
+    return bytes(reversed(coded))
+
+def build_frame_header(frame_number, block_size, sample_rate, channel_code):
+    """
+    Build the header of a FLAC frame.
+
+    Args:
+        frame_number (int): Frame number
+        block_size (int): Samples per channel in the frame
+        sample_rate (int): Sample rate in Hz
+        channel_code (int): Channel assignment code
+
+    Returns:
+        bytes: Header, ending with its CRC-8
+    """
+    if block_size & (block_size - 1) == 0 and 256 <= block_size <= 32768:
+        block_code = 8 + block_size.bit_length() - 9
+    else:
+        block_code = 0b0111
+
+    header = struct.pack('>HBB', 0xFFF8, block_code << 4 | SAMPLE_RATE_CODES.get(sample_rate, 0),
+                         channel_code << 4 | 0b100 << 1)
+    header += encode_frame_number(frame_number)
+    if block_code == 0b0111:
+        header += struct.pack('>H', block_size - 1)
+    return header + bytes([crc8(header)])
+
+def build_flac_header(sample_rate, num_channels=2, num_frames=None, md5=None, block_size=FLAC_BLOCK_SIZE):
+    """
+    Build the stream marker and STREAMINFO block of a FLAC file.
+
+    Args:
+        sample_rate (int): Sample rate in Hz
+        num_channels (int): Number of channels
+        num_frames (int): Samples per channel (None for a stream of unknown length)
+        md5 (bytes): MD5 of the samples (None if unknown)
+        block_size (int): Samples per channel in a frame
+
+    Returns:
+        bytes: Stream header
+    """
+    if num_frames is not None:
+        block_size = max(16, min(block_size, num_frames))
+    info = (sample_rate << 44) | (num_channels - 1) << 41 | 15 << 36 | (num_frames or 0)
+
+    return (b'fLaC' + bytes([0x80, 0, 0, 34])
+            + struct.pack('>HH3s3sQ', block_size, block_size, bytes(3), bytes(3), info)
+            + (md5 or bytes(16)))
+
+def fixed_residuals(signal):
+    """
+    Get the residuals of every fixed predictor order.
+
+    Args:
+        signal (ndarray): int64 samples with shape (frames, block_size)
+
+    Returns:
+        list: Residuals of order 0 to MAX_FIXED_ORDER, order n with shape
+            (frames, block_size - n)
+    """
+    residuals = [signal]
+    for _ in range(MAX_FIXED_ORDER):
+        residuals.append(np.diff(residuals[-1], axis=1))
+    return residuals
+
+def fixed_costs(residuals):
+    """
+    Estimate the coded size of every fixed predictor order.
+
+    Args:
+        residuals (list): Residuals from fixed_residuals()
+
+    Returns:
+        ndarray: Sum of absolute residuals with shape (frames, orders),
+            measured after the longest warm-up so orders compare fairly
+    """
+    return np.stack([np.abs(residual[:, MAX_FIXED_ORDER - order:]).sum(axis=1)
+                     for order, residual in enumerate(residuals)], axis=1)
+
+def rice_parameters(sums, counts):
+    """
+    Choose the Rice parameter of partitions from their residual sums.
+
+    Args:
+        sums (ndarray): Sum of the zigzag coded residuals of every partition
+        counts (ndarray): Residuals in every partition
+
+    Returns:
+        tuple: (parameters, estimated bits) with the shape of sums
+    """
+    mean = np.maximum(sums * np.log(2) / np.maximum(counts, 1), 1.0)
+    low = np.clip(np.floor(np.log2(mean)), 0, MAX_RICE_PARAMETER - 1)
+    candidates = np.stack([low, low + 1])
+    bits = counts * (candidates + 1) + sums / 2.0 ** candidates
+    best = bits.argmin(axis=0)
+    return np.take_along_axis(candidates, best[None], 0)[0].astype(np.int64), bits.min(axis=0)
+
+def encode_subframes(signal, bps):
+    """
+    Lay out the subframes of one channel of a batch of frames.
+
+    Every sample gets two fields: a prefix (subframe header, residual
+    header, Rice parameter) and its code. A field is (value, value_bits,
+    width), the value right-aligned in its width and zeros before it, which
+    is how a Rice code's unary quotient is written.
+
+    Args:
+        signal (ndarray): int64 samples with shape (frames, block_size)
+        bps (int): Bits per sample of the channel (17 for a side channel)
+
+    Returns:
+        tuple: (values, value_bits, widths), each with shape
+            (frames, block_size, 2)
+    """
+    num_frames, block_size = signal.shape
+    rows = np.arange(num_frames)
+    values = np.zeros((num_frames, block_size, 2), dtype=np.uint64)
+    value_bits = np.zeros((num_frames, block_size, 2), dtype=np.int64)
+
+    residuals = fixed_residuals(signal)
+    orders = fixed_costs(residuals).argmin(axis=1)
+    orders = np.minimum(orders, block_size - 1)
+    constant = (signal == signal[:, :1]).all(axis=1)
+
+    # Residuals of the chosen orders in place, zero during warm-up
+    residual = np.zeros_like(signal)
+    for order, order_residual in enumerate(residuals):
+        selected = (orders == order) & ~constant
+        residual[selected, order:] = order_residual[selected]
+    codes = ((residual << 1) ^ (residual >> 63)).astype(np.uint64)
+
+    # Partition order with the fewest estimated bits; the first partition
+    # starts after the warm-up samples
+    positions = np.arange(block_size)
+    best_bits = np.full(num_frames, np.inf)
+    partition_orders = np.zeros(num_frames, dtype=np.int64)
+    for partition_order in range(MAX_PARTITION_ORDER + 1):
+        num_partitions = 1 << partition_order
+        if block_size % num_partitions or block_size // num_partitions <= MAX_FIXED_ORDER:
+            break
+        sums = codes.reshape(num_frames, num_partitions, -1).sum(axis=2).astype(np.float64)
+        counts = np.full(sums.shape, block_size // num_partitions)
+        counts[:, 0] -= orders
+        _, bits = rice_parameters(sums, counts)
+        bits = bits.sum(axis=1) + 4 * num_partitions
+        better = bits < best_bits
+        best_bits[better] = bits[better]
+        partition_orders[better] = partition_order
+
+    parameters = np.zeros((num_frames, block_size), dtype=np.int64)
+    for partition_order in np.unique(partition_orders):
+        selected = partition_orders == partition_order
+        num_partitions = 1 << partition_order
+        sums = codes[selected].reshape(-1, num_partitions, block_size // num_partitions).sum(axis=2)
+        counts = np.full(sums.shape, block_size // num_partitions)
+        counts[:, 0] -= orders[selected]
+        partition_parameters, _ = rice_parameters(sums.astype(np.float64), counts)
+        parameters[selected] = np.repeat(partition_parameters, block_size // num_partitions, axis=1)
+
+    # Sample codes: warm-up samples verbatim, then Rice codes
+    mask = np.uint64((1 << bps) - 1)
+    rice = parameters.astype(np.uint64)
+    values[:, :, 1] = (np.uint64(1) << rice) | (codes & ((np.uint64(1) << rice) - np.uint64(1)))
+    value_bits[:, :, 1] = parameters + 1
+    widths = value_bits.copy()
+    widths[:, :, 1] += (codes >> rice).astype(np.int64)
+
+    warm_up = positions < orders[:, None]
+    values[:, :, 1][warm_up] = signal[warm_up].astype(np.uint64) & mask
+    value_bits[:, :, 1][warm_up] = widths[:, :, 1][warm_up] = bps
+
+    # Prefixes, appended in stream order
+    def append(frame_rows, columns, field, bits):
+        prefix_values = values[frame_rows, columns, 0]
+        values[frame_rows, columns, 0] = (prefix_values << np.uint64(bits)) | np.asarray(field, dtype=np.uint64)
+        value_bits[frame_rows, columns, 0] += bits
+
+    fixed = np.nonzero(~constant)[0]
+    append(rows, 0, np.where(constant, 0, (8 | orders) << 1), 8)
+    append(fixed, orders[fixed], partition_orders[fixed], 6)
+    append(fixed, orders[fixed], parameters[fixed, 0], 4)
+    for partition_order in range(1, MAX_PARTITION_ORDER + 1):
+        selected = fixed[partition_orders[fixed] >= partition_order]
+        if len(selected) == 0:
+            break
+        partition_size = block_size >> partition_order
+        for start in range(partition_size, block_size, 2 * partition_size):
+            # Partition starts that are new at this partition order
+            append(selected, start, parameters[selected, start], 4)
+
+    # A constant subframe is its header and one sample
+    values[constant, :, 1] = value_bits[constant, :, 1] = widths[constant, :, 1] = 0
+    values[constant, 0, 1] = signal[constant, 0].astype(np.uint64) & mask
+    value_bits[constant, 0, 1] = widths[constant, 0, 1] = bps
+    widths[:, :, 0] = value_bits[:, :, 0]
+
+    return values, value_bits, widths
+
+def encode_flac_batch(blocks, sample_rate, first_frame):
+    """
+    Encode a batch of frames of the same block size.
+
+    Args:
+        blocks (ndarray): int64 samples with shape (frames, block_size, channels)
+        sample_rate (int): Sample rate in Hz
+        first_frame (int): Number of the first frame
+
+    Returns:
+        bytes: Encoded frames
+    """
+    num_frames, block_size, num_channels = blocks.shape
+
+    # Stereo: the pair of signals with the smallest estimated size
+    if num_channels == 2:
+        left, right = blocks[:, :, 0], blocks[:, :, 1]
+        signals = {'left': left, 'right': right, 'mid': (left + right) >> 1, 'side': left - right}
+        costs = {name: fixed_costs(fixed_residuals(signal)).min(axis=1) for name, signal in signals.items()}
+        assignment = np.stack([costs[first] + costs[second]
+                               for _, first, second in CHANNEL_ASSIGNMENTS], axis=1).argmin(axis=1)
+        channel_codes = np.array([code for code, _, _ in CHANNEL_ASSIGNMENTS])[assignment]
+        channels = []
+        for channel in range(2):
+            names = [assignment_names[channel + 1] for assignment_names in CHANNEL_ASSIGNMENTS]
+            stacked = np.stack([signals[name] for name in names])
+            channels.append((stacked[assignment, np.arange(num_frames)],
+                             np.array([17 if name == 'side' else 16 for name in names])[assignment]))
+    else:
+        channel_codes = np.full(num_frames, num_channels - 1)
+        channels = [(blocks[:, :, channel], np.full(num_frames, 16)) for channel in range(num_channels)]
+
+    # Fields of every frame: header bytes, subframes, byte padding, CRC-16
+    num_slots = HEADER_SLOTS + num_channels * block_size * 2 + 2
+    values = np.zeros((num_frames, num_slots), dtype=np.uint64)
+    value_bits = np.zeros((num_frames, num_slots), dtype=np.int64)
+    widths = np.zeros((num_frames, num_slots), dtype=np.int64)
+
+    for frame in range(num_frames):
+        header = build_frame_header(first_frame + frame, block_size, sample_rate, int(channel_codes[frame]))
+        values[frame, :len(header)] = np.frombuffer(header, dtype=np.uint8)
+        value_bits[frame, :len(header)] = widths[frame, :len(header)] = 8
+
+    for channel, (signal, bps) in enumerate(channels):
+        start = HEADER_SLOTS + channel * block_size * 2
+        for channel_bps in np.unique(bps):
+            selected = bps == channel_bps
+            fields = encode_subframes(signal[selected], int(channel_bps))
+            for target, field in zip((values, value_bits, widths), fields):
+                target[selected, start:start + block_size * 2] = field.reshape(field.shape[0], -1)
+
+    frame_bits = widths.sum(axis=1)
+    widths[:, -2] = -frame_bits % 8
+    widths[:, -1] = 16
+    frame_bytes = widths.sum(axis=1) // 8
+
+    # Every value lands in at most two 32-bit words; fields never overlap,
+    # so summing them is the same as OR-ing their bits
+    values, value_bits, widths = values.ravel(), value_bits.ravel(), widths.ravel()
+    starts = np.cumsum(widths) - value_bits
+    written = value_bits > 0
+    values, value_bits, starts = values[written], value_bits[written], starts[written]
+
+    words = starts >> 5
+    shifted = values << (64 - (starts & 31) - value_bits).astype(np.uint64)
+    num_words = int(frame_bytes.sum()) // 4 + 2
+    packed = (np.bincount(words, weights=(shifted >> np.uint64(32)).astype(np.float64), minlength=num_words)
+              + np.bincount(words + 1, weights=(shifted & np.uint64(0xFFFFFFFF)).astype(np.float64),
+                            minlength=num_words))
+    data = np.frombuffer(packed[:num_words].astype('>u4').tobytes(), dtype=np.uint8)[:int(frame_bytes.sum())].copy()
+
+    frame_starts = np.cumsum(frame_bytes) - frame_bytes
+    crc = crc16_frames(data, frame_starts, frame_bytes - 2)
+    data[frame_starts + frame_bytes - 2] = crc >> 8
+    data[frame_starts + frame_bytes - 1] = crc & 0xFF
+    return data.tobytes()
+
+def encode_flac_frames(samples, sample_rate, first_frame=0, block_size=FLAC_BLOCK_SIZE):
+    """
+    Encode samples as FLAC frames.
+
+    Args:
+        samples (ndarray): Samples with shape (frames, channels)
+        sample_rate (int): Sample rate in Hz
+        first_frame (int): Number of the first FLAC frame
+        block_size (int): Samples per channel in a frame (the last frame
+            may be shorter)
+
+    Returns:
+        tuple: (encoded frames, number of FLAC frames)
+    """
+    samples = to_int16(samples).astype(np.int64)
+    num_blocks = len(samples) // block_size
+
+    encoded = []
+    for batch_start in range(0, num_blocks, FLAC_BATCH_FRAMES):
+        batch = samples[batch_start * block_size:min(batch_start + FLAC_BATCH_FRAMES, num_blocks) * block_size]
+        encoded.append(encode_flac_batch(batch.reshape(-1, block_size, samples.shape[1]), sample_rate,
+                                         first_frame + batch_start))
+
+    remainder = samples[num_blocks * block_size:]
+    if len(remainder):
+        encoded.append(encode_flac_batch(remainder[None], sample_rate, first_frame + num_blocks))
+        num_blocks += 1
+
+    return b''.join(encoded), num_blocks
+
+def encode_flac(samples, sample_rate):
+    """
+    Encode a sample buffer as a FLAC file.
+
+    Args:
+        samples (ndarray): Samples with shape (frames,) or (frames, channels)
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        bytes: FLAC file
+    """
+    samples = to_int16(samples)
+    if samples.ndim == 1:
+        samples = samples[:, None]
+
+    md5 = hashlib.md5(np.ascontiguousarray(samples).astype('<i2').tobytes()).digest()
+    frames, _ = encode_flac_frames(samples, sample_rate)
+    return build_flac_header(sample_rate, samples.shape[1], len(samples), md5) + frames
+
+def iter_flac_bytes(chunks, sample_rate, num_channels=2):
+    """
+    Encode a stream of sample buffers as a FLAC stream.
+
+    Args:
+        chunks (iterable): Sample buffers with shape (frames, channels)
+        sample_rate (int): Sample rate in Hz
+        num_channels (int): Number of channels
+
+    Yields:
+        bytes: The header, then the FLAC frames completed by each chunk
+    """
+    yield build_flac_header(sample_rate, num_channels)
+
+    pending = np.zeros((0, num_channels), dtype=np.int16)
+    frame_number = 0
+    for samples in chunks:
+        pending = np.concatenate([pending, to_int16(samples)])
+        complete = len(pending) // FLAC_BLOCK_SIZE * FLAC_BLOCK_SIZE
+        if complete:
+            frames, num_frames = encode_flac_frames(pending[:complete], sample_rate, frame_number)
+            frame_number += num_frames
+            pending = pending[complete:]
+            yield frames
+
+    if len(pending):
+        frames, _ = encode_flac_frames(pending, sample_rate, frame_number)
+        yield frames
@@ -0,0 +1,224 @@
+"""
+FluidSynth module for the audio rendering system.
+Provides a SoundFont renderer that keeps the synthesizer loaded between songs.
+"""
+
+import os
+import subprocess
+import tempfile
+import time
+import mido
+import numpy as np
+from .drums import DRUM_CHANNELS
+from .synth import get_note_events, iter_timed_messages
+from .wav import read_wav, seconds_to_frames, to_float, to_int16, to_mono, write_wav
+
+try:
+    import fluidsynth
+except (ImportError, OSError):
+    # pyfluidsynth (or the libfluidsynth library) is not installed, so songs
+    # are rendered with the fluidsynth command instead
+    fluidsynth = None
+
+# Seconds rendered after the last event so releases can ring out
+TAIL_SECONDS = 2.0
+
+# Directory for the files the fluidsynth command needs (tmpfs when available)
+SPILL_DIR = '/dev/shm' if os.path.isdir('/dev/shm') else None
+
+def get_synth_settings(polyphony=None, effects=True):
+    """
+    Get the FluidSynth settings of a render quality.
+
+    Args:
+        polyphony (int): Most voices sounding at once (FluidSynth default if None)
+        effects (bool): Whether reverb and chorus are rendered
+
+    Returns:
+        dict: FluidSynth setting values by setting name
+    """
+    settings = {}
+    if polyphony is not None:
+        settings['synth.polyphony'] = polyphony
+    if not effects:
+        settings['synth.reverb.active'] = 0
+        settings['synth.chorus.active'] = 0
+    return settings
+
+class FluidSynthRenderer:
+    """
+    SoundFont renderer built on FluidSynth.
+
+    With the pyfluidsynth bindings the SoundFont is loaded once and the
+    synthesizer is reset between songs. Without them every song is rendered
+    by a new fluidsynth process.
+    """
+
+    def __init__(self, sf2_file, sample_rate=44100, gain=0.2, tail=TAIL_SECONDS, drum_kit=None,
+                 polyphony=None, effects=True, channels=2):
+        """
+        Initialize the renderer and load the SoundFont.
+
+        Args:
+            sf2_file (str): Path to the SoundFont (.sf2) file
+            sample_rate (int): Sample rate in Hz
+            gain (float): Synthesizer master gain
+            tail (float): Seconds rendered after the last event
+            drum_kit (DrumKit): Drum samples mixed in place of the SoundFont
+                drums (in-process rendering only)
+            polyphony (int): Most voices sounding at once (FluidSynth
+                default if None)
+            effects (bool): Whether reverb and chorus are rendered
+            channels (int): Channels of the WAV files written by render()
+        """
+        self.sf2_file = sf2_file
+        self.sample_rate = sample_rate
+        self.gain = gain
+        self.tail = tail
+        self.drum_kit = drum_kit
+        self.settings = get_synth_settings(polyphony, effects)
+        self.channels = channels
+        self.synth = None
+        self.load_time = 0.0
+
+        if fluidsynth is not None:
+            start = time.perf_counter()
+            self.synth = fluidsynth.Synth(gain=gain, samplerate=float(sample_rate), **self.settings)
+            self.sfid = self.synth.sfload(sf2_file, update_midi_preset=1)
+            self.load_time = time.perf_counter() - start
+
+    @property
+    def in_process(self):
+        """Whether songs are rendered in-process with a preloaded SoundFont."""
+        return self.synth is not None
+
+    def reset(self):
+        """Reset every channel to its default program and controllers."""
+        if hasattr(self.synth, 'system_reset'):
+            self.synth.system_reset()
+            return
+
+        for channel in range(16):
+            self.synth.cc(channel, 120, 0)  # All sound off
+            self.synth.cc(channel, 121, 0)  # Reset all controllers
+            self.synth.program_select(channel, self.sfid, 128 if channel == 9 else 0, 0)
+
+    def send(self, msg):
+        """
+        Send a MIDI message to the synthesizer.
+
+        Args:
+            msg (Message): MIDI channel message
+        """
+        if msg.type == 'note_on':
+            self.synth.noteon(msg.channel, msg.note, msg.velocity)
+        elif msg.type == 'note_off':
+            self.synth.noteoff(msg.channel, msg.note)
+        elif msg.type == 'control_change':
+            self.synth.cc(msg.channel, msg.control, msg.value)
+        elif msg.type == 'program_change':
+            self.synth.program_change(msg.channel, msg.program)
+        elif msg.type == 'pitchwheel':
+            self.synth.pitch_bend(msg.channel, msg.pitch)
+
+    def render_samples(self, midi_file, normalize=False, tail=None):
+        """
+        Render a MIDI file to a sample buffer.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            normalize (bool): Unused; FluidSynth output is never normalized
+            tail (float): Seconds rendered after the last event (self.tail
+                if None; the fluidsynth command renders its own tail)
+
+        Returns:
+            ndarray: int16 stereo samples with shape (frames, 2)
+        """
+        if not self.in_process:
+            # Render through a temporary WAV file with the fluidsynth command
+            with tempfile.TemporaryDirectory(dir=SPILL_DIR) as temp_dir:
+                if isinstance(midi_file, mido.MidiFile):
+                    midi_path = os.path.join(temp_dir, 'song.mid')
+                    midi_file.save(midi_path)
+                    midi_file = midi_path
+                output_wav = os.path.join(temp_dir, 'song.wav')
+                self.run_command(midi_file, output_wav)
+                samples, _ = read_wav(output_wav)
+            return samples
+
+        if not isinstance(midi_file, mido.MidiFile):
+            midi_file = mido.MidiFile(midi_file)
+
+        self.reset()
+        skipped_channels = DRUM_CHANNELS if self.drum_kit is not None else ()
+
+        chunks = []
+        rendered_frames = 0
+        for seconds, msg in iter_timed_messages(midi_file):
+            # Render the audio up to this message
+            frames = seconds_to_frames(seconds, self.sample_rate) - rendered_frames
+            if frames > 0:
+                chunks.append(self.synth.get_samples(frames))
+                rendered_frames += frames
+
+            if not msg.is_meta and msg.channel not in skipped_channels:
+                self.send(msg)
+
+        tail = self.tail if tail is None else tail
+        chunks.append(self.synth.get_samples(int(tail * self.sample_rate)))
+        samples = np.concatenate(chunks).astype(np.int16).reshape(-1, 2)
+
+        if self.drum_kit is None:
+            return samples
+
+        # Mix the drum channels from the sample-based drum mixer
+        notes, _ = get_note_events(midi_file)
+        drums = self.drum_kit.render_notes(notes, len(samples))
+        return to_int16(to_float(samples) + drums)
+
+    def render(self, midi_file, output_wav):
+        """
+        Render a MIDI file to a WAV file.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            output_wav (str or file): Output path or writable binary file object
+
+        Returns:
+            dict: Timing of the render in seconds ('render')
+        """
+        start = time.perf_counter()
+
+        if self.channels == 1:
+            write_wav(output_wav, to_mono(self.render_samples(midi_file)), self.sample_rate)
+        elif self.in_process or isinstance(midi_file, mido.MidiFile) or not isinstance(output_wav, str):
+            write_wav(output_wav, self.render_samples(midi_file), self.sample_rate)
+        else:
+            self.run_command(midi_file, output_wav)
+
+        return {'render': time.perf_counter() - start}
+
+    def run_command(self, midi_path, output_wav):
+        """
+        Render a MIDI file with the fluidsynth command.
+
+        Args:
+            midi_path (str): Path to the MIDI file
+            output_wav (str): Path to the output WAV file
+        """
+        options = [f"{name}={value}" for name, value in self.settings.items()]
+        command = [
+            "fluidsynth",
+            *[arg for option in options for arg in ("-o", option)],
+            "-ni", self.sf2_file,
+            midi_path,
+            "-F", output_wav,
+            "-r", str(self.sample_rate)
+        ]
+        subprocess.run(command, check=True, capture_output=True)
+
+    def close(self):
+        """Release the synthesizer."""
+        if self.synth is not None:
+            self.synth.delete()
+            self.synth = None
@@ -0,0 +1,127 @@
+"""
+Formats module for the audio rendering system.
+Provides the audio delivery formats: WAV, FLAC and, when the ffmpeg command
+is installed, lossy MP3 and Ogg Opus.
+"""
+
+import io
+import shutil
+import subprocess
+from .flac import encode_flac, iter_flac_bytes
+from .wav import iter_wav_bytes, read_wav, write_wav
+
+# MIME type and file extension by audio format
+AUDIO_FORMATS = {
+    'wav': ('audio/wav', 'wav'),
+    'flac': ('audio/flac', 'flac'),
+    'mp3': ('audio/mpeg', 'mp3'),
+    'opus': ('audio/ogg', 'ogg')
+}
+
+# ffmpeg output options of the lossy formats
+LOSSY_OPTIONS = {
+    'mp3': ['-f', 'mp3', '-codec:a', 'libmp3lame', '-b:a', '160k'],
+    'opus': ['-f', 'ogg', '-codec:a', 'libopus', '-b:a', '96k', '-ar', '48000']
+}
+
+# Formats that can be encoded while the song is still rendering
+STREAM_FORMATS = ('wav', 'flac')
+
+# Path of the ffmpeg command (lossy formats are unavailable without it)
+FFMPEG = shutil.which('ffmpeg')
+
+def available_formats(stream=False):
+    """
+    Get the audio formats that can be encoded here.
+
+    Args:
+        stream (bool): Only formats that can be streamed
+
+    Returns:
+        list: Format names, lossless first
+    """
+    formats = [name for name in AUDIO_FORMATS if name not in LOSSY_OPTIONS or FFMPEG]
+    if stream:
+        formats = [name for name in formats if name in STREAM_FORMATS]
+    return formats
+
+def encode_lossy(samples, sample_rate, audio_format):
+    """
+    Encode a sample buffer in a lossy format with the ffmpeg command.
+
+    Args:
+        samples (ndarray): Samples with shape (frames, channels)
+        sample_rate (int): Sample rate in Hz
+        audio_format (str): Lossy format ('mp3' or 'opus')
+
+    Returns:
+        bytes: Encoded audio
+    """
+    if FFMPEG is None:
+        raise RuntimeError(f"Encoding {audio_format} needs the ffmpeg command")
+
+    wav = io.BytesIO()
+    write_wav(wav, samples, sample_rate)
+    command = [FFMPEG, '-v', 'error', '-f', 'wav', '-i', 'pipe:0'] + LOSSY_OPTIONS[audio_format] + ['pipe:1']
+    result = subprocess.run(command, input=wav.getvalue(), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed to encode {audio_format}: {result.stderr.decode(errors='replace')}")
+    return result.stdout
+
+def encode_audio(samples, sample_rate, audio_format='wav'):
+    """
+    Encode a sample buffer in an audio format.
+
+    Args:
+        samples (ndarray): Samples with shape (frames, channels)
+        sample_rate (int): Sample rate in Hz
+        audio_format (str): Format name (see AUDIO_FORMATS)
+
+    Returns:
+        bytes: Encoded audio
+    """
+    if audio_format not in AUDIO_FORMATS:
+        raise ValueError(f"Unknown audio format: {audio_format}")
+
+    if audio_format == 'wav':
+        wav = io.BytesIO()
+        write_wav(wav, samples, sample_rate)
+        return wav.getvalue()
+    if audio_format == 'flac':
+        return encode_flac(samples, sample_rate)
+    return encode_lossy(samples, sample_rate, audio_format)
+
+def transcode_wav(wav, audio_format='wav'):
+    """
+    Encode WAV bytes in an audio format.
+
+    Args:
+        wav (bytes): WAV file bytes
+        audio_format (str): Format name (see AUDIO_FORMATS)
+
+    Returns:
+        bytes: Encoded audio (the WAV bytes themselves for 'wav')
+    """
+    if audio_format == 'wav':
+        return wav
+    samples, sample_rate = read_wav(io.BytesIO(wav))
+    return encode_audio(samples, sample_rate, audio_format)
+
+def iter_audio_bytes(chunks, sample_rate, num_channels=2, audio_format='wav'):
+    """
+    Encode a stream of sample buffers in a streamable audio format.
+
+    Args:
+        chunks (iterable): Sample buffers with shape (frames, channels)
+        sample_rate (int): Sample rate in Hz
+        num_channels (int): Number of channels
+        audio_format (str): Format name (see STREAM_FORMATS)
+
+    Returns:
+        iterator: Encoded bytes, header first
+    """
+    if audio_format == 'wav':
+        return iter_wav_bytes(chunks, sample_rate, num_channels)
+    if audio_format == 'flac':
+        return iter_flac_bytes(chunks, sample_rate, num_channels)
+    raise ValueError(f"Audio format cannot be streamed: {audio_format}")
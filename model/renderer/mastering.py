@@ -0,0 +1,416 @@
+"""
+Mastering module for the audio rendering system.
+Provides loudness measurement (ITU-R BS.1770), loudness normalization and a
+look-ahead peak limiter, for whole songs and for streamed blocks.
+"""
+
+import time
+import numpy as np
+from .effects import convolve, impulse_response
+from .wav import to_float, to_mono, write_wav
+
+# Integrated loudness songs are normalized to, in LUFS
+TARGET_LUFS = -14.0
+
+# Peak level of the limiter output in dBFS
+CEILING_DB = -1.0
+
+# Limiter look-ahead and release in seconds
+LOOKAHEAD_SECONDS = 0.005
+RELEASE_SECONDS = 0.05
+
+# Most gain applied to quiet songs in dB
+MAX_GAIN_DB = 20.0
+
+# Loudness gates in LUFS (absolute) and LU below the ungated loudness (relative)
+ABSOLUTE_GATE = -70.0
+RELATIVE_GATE = -10.0
+
+# Longest K-weighting filter response in seconds
+K_WEIGHTING_SECONDS = 0.5
+
+def k_weighting_coefficients(sample_rate):
+    """
+    Get the coefficients of the BS.1770 K-weighting filter.
+
+    The high shelf and the high-pass stages are combined into one filter.
+
+    Args:
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        tuple: (numerator, denominator) coefficient arrays
+    """
+    # Stage 1: high shelf modelling the head
+    k = np.tan(np.pi * 1681.974450955533 / sample_rate)
+    q = 0.7071752369554196
+    vh = 10.0 ** (3.999843853973347 / 20.0)
+    vb = vh ** 0.4996667741545416
+    a0 = 1.0 + k / q + k * k
+    shelf_b = np.array([vh + vb * k / q + k * k, 2.0 * (k * k - vh), vh - vb * k / q + k * k]) / a0
+    shelf_a = np.array([1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0])
+
+    # Stage 2: RLB high-pass
+    k = np.tan(np.pi * 38.13547087602444 / sample_rate)
+    q = 0.5003270373238773
+    a0 = 1.0 + k / q + k * k
+    highpass_b = np.array([1.0, -2.0, 1.0])
+    highpass_a = np.array([1.0, 2.0 * (k * k - 1.0) / a0, (1.0 - k / q + k * k) / a0])
+
+    return np.convolve(shelf_b, highpass_b), np.convolve(shelf_a, highpass_a)
+
+def sliding_min(values, window):
+    """
+    Get the minimum of every window of consecutive values.
+
+    Minimums over spans of 1, 2, 4, ... values are built by doubling, and a
+    window is covered by two overlapping spans, so the cost grows with the
+    log of the window.
+
+    Args:
+        values (ndarray): 1D values
+        window (int): Window length
+
+    Returns:
+        ndarray: Minimum of values[i:i + window] for every full window
+    """
+    result = values
+    span = 1
+    while span * 2 <= window:
+        result = np.minimum(result[:-span], result[span:])
+        span *= 2
+
+    count = len(values) - window + 1
+    return np.minimum(result[:count], result[window - span:window - span + count])
+
+def channel_peaks(samples):
+    """
+    Get the peak level of every frame across its channels.
+
+    Args:
+        samples (ndarray): float samples with shape (frames, channels)
+
+    Returns:
+        ndarray: Peak levels with shape (frames,)
+    """
+    levels = np.abs(samples)
+    peaks = levels[:, 0].copy()
+    for channel in range(1, levels.shape[1]):
+        np.maximum(peaks, levels[:, channel], out=peaks)
+    return peaks
+
+class LoudnessMeter:
+    """
+    Integrated loudness meter (ITU-R BS.1770), fed block by block.
+
+    Samples are K-weighted and their energy is summed over 100 ms hops;
+    gating blocks are 400 ms, so four hops with 75% overlap.
+    """
+
+    def __init__(self, sample_rate=44100):
+        """
+        Initialize the meter.
+
+        Args:
+            sample_rate (int): Sample rate in Hz
+        """
+        self.sample_rate = sample_rate
+        self.hop = sample_rate // 10
+        self.response = impulse_response(*k_weighting_coefficients(sample_rate),
+                                         int(K_WEIGHTING_SECONDS * sample_rate))[:, None]
+        self.carry = None
+        self.pending = None
+        self.hop_energies = []
+
+    def add(self, samples):
+        """
+        Measure a block of samples.
+
+        Args:
+            samples (ndarray): Samples with shape (frames, channels)
+        """
+        samples = to_float(samples)
+
+        # K-weight the block, carrying the filter ring into the next block
+        weighted = convolve(samples, self.response, full=True)
+        if self.carry is not None:
+            weighted[:len(self.carry)] += self.carry
+        self.carry = weighted[len(samples):]
+        weighted = weighted[:len(samples)]
+
+        if self.pending is not None:
+            weighted = np.concatenate([self.pending, weighted])
+        num_hops = len(weighted) // self.hop
+        hops = weighted[:num_hops * self.hop].reshape(num_hops, self.hop, weighted.shape[1])
+        self.hop_energies.extend((hops.astype(np.float64) ** 2).sum(axis=1))
+        self.pending = weighted[num_hops * self.hop:]
+
+    def integrated(self):
+        """
+        Get the gated integrated loudness of the samples measured so far.
+
+        Returns:
+            float: Loudness in LUFS, or None before the first audible block
+        """
+        if len(self.hop_energies) < 4:
+            return None
+
+        energies = np.array(self.hop_energies)
+        blocks = (energies[:-3] + energies[1:-2] + energies[2:-1] + energies[3:]) / (4 * self.hop)
+        powers = blocks.sum(axis=1)
+
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10.0 * np.log10(powers)
+        gated = powers[loudness > ABSOLUTE_GATE]
+        if len(gated) == 0:
+            return None
+
+        relative_gate = -0.691 + 10.0 * np.log10(gated.mean()) + RELATIVE_GATE
+        gated = gated[-0.691 + 10.0 * np.log10(gated) > relative_gate]
+        return -0.691 + 10.0 * np.log10(gated.mean())
+
+class PeakLimiter:
+    """
+    Look-ahead peak limiter, fed block by block.
+
+    The gain each frame needs to stay under the ceiling is held by a
+    sliding minimum over the look-ahead plus release, then smoothed by a
+    moving average over the look-ahead, so the gain is already down when a
+    peak arrives and never rises above what any peak needs. The output lags
+    the input by the look-ahead.
+    """
+
+    def __init__(self, sample_rate=44100, ceiling_db=CEILING_DB, lookahead=LOOKAHEAD_SECONDS,
+                 release=RELEASE_SECONDS, channels=2):
+        """
+        Initialize the limiter.
+
+        Args:
+            sample_rate (int): Sample rate in Hz
+            ceiling_db (float): Peak level of the output in dBFS
+            lookahead (float): Look-ahead in seconds
+            release (float): Release time in seconds
+            channels (int): Number of channels of the samples
+        """
+        self.channels = channels
+        self.ceiling = 10.0 ** (ceiling_db / 20.0)
+        self.lookahead = max(1, int(lookahead * sample_rate))
+        self.window = self.lookahead + max(0, int(release * sample_rate))
+
+        # Gains needed by the frames before the held back ones (silence at
+        # the start needs none), then by the held back frames
+        self.needed = np.ones(self.window - 1, dtype=np.float32)
+        self.pending = None
+
+    def process(self, samples):
+        """
+        Limit a block of samples.
+
+        Args:
+            samples (ndarray): Samples with shape (frames, channels)
+
+        Returns:
+            ndarray: float32 limited samples, lagging the input by the
+                look-ahead
+        """
+        samples = to_float(samples)
+        peaks = channel_peaks(samples)
+        needed = np.concatenate([self.needed, np.minimum(1.0, self.ceiling / np.maximum(peaks, 1e-9), dtype=np.float32)])
+        if self.pending is not None:
+            samples = np.concatenate([self.pending, samples])
+
+        count = len(samples) - self.lookahead + 1
+        if count <= 0:
+            self.needed, self.pending = needed, samples
+            return np.zeros((0, samples.shape[1]), dtype=np.float32)
+
+        held = sliding_min(needed, self.window)
+        sums = np.concatenate([[0.0], np.cumsum(held, dtype=np.float64)])
+        gains = ((sums[self.lookahead:] - sums[:-self.lookahead]) / self.lookahead).astype(np.float32)
+
+        output = samples[:count] * gains[:, None]
+        self.needed, self.pending = needed[count:], samples[count:]
+        return output
+
+    def flush(self):
+        """
+        Limit the frames held back for the look-ahead.
+
+        Returns:
+            ndarray: float32 limited samples
+        """
+        if self.pending is None:
+            return np.zeros((0, self.channels), dtype=np.float32)
+        return self.process(np.zeros((self.lookahead - 1, self.pending.shape[1]), dtype=np.float32))
+
+def loudness_gain(loudness, target_lufs=TARGET_LUFS, max_gain_db=MAX_GAIN_DB):
+    """
+    Get the gain that brings a loudness to the target.
+
+    Args:
+        loudness (float): Integrated loudness in LUFS (None for silence)
+        target_lufs (float): Target loudness in LUFS
+        max_gain_db (float): Most gain applied in dB
+
+    Returns:
+        float: Linear gain
+    """
+    if loudness is None:
+        return 1.0
+    return 10.0 ** (min(target_lufs - loudness, max_gain_db) / 20.0)
+
+def master_samples(samples, sample_rate=44100, target_lufs=TARGET_LUFS, ceiling_db=CEILING_DB):
+    """
+    Normalize a whole song to the target loudness and limit its peaks.
+
+    Args:
+        samples (ndarray): Samples with shape (frames, channels)
+        sample_rate (int): Sample rate in Hz
+        target_lufs (float): Target integrated loudness in LUFS
+        ceiling_db (float): Peak level of the output in dBFS
+
+    Returns:
+        ndarray: float32 mastered samples with the same shape
+    """
+    meter = LoudnessMeter(sample_rate)
+    meter.add(samples)
+    gain = loudness_gain(meter.integrated(), target_lufs)
+
+    limiter = PeakLimiter(sample_rate, ceiling_db, channels=samples.shape[1])
+    output = limiter.process(to_float(samples) * np.float32(gain))
+    return np.concatenate([output, limiter.flush()])
+
+class StreamMaster:
+    """
+    Loudness normalization and peak limiting of a song streamed in blocks.
+
+    The loudness of a streamed song is only known at its end, so every block
+    is normalized by the integrated loudness measured so far, with the gain
+    ramped across the block to avoid steps. The output lags the input by
+    the limiter look-ahead; flush() returns the rest.
+    """
+
+    def __init__(self, sample_rate=44100, target_lufs=TARGET_LUFS, ceiling_db=CEILING_DB, channels=2):
+        """
+        Initialize the mastering.
+
+        Args:
+            sample_rate (int): Sample rate in Hz
+            target_lufs (float): Target integrated loudness in LUFS
+            ceiling_db (float): Peak level of the output in dBFS
+            channels (int): Number of channels of the streamed samples
+        """
+        self.target_lufs = target_lufs
+        self.meter = LoudnessMeter(sample_rate)
+        self.limiter = PeakLimiter(sample_rate, ceiling_db, channels=channels)
+        self.gain = None
+
+    def process(self, samples):
+        """
+        Master a block of samples.
+
+        Args:
+            samples (ndarray): Samples with shape (frames, channels)
+
+        Returns:
+            ndarray: float32 mastered samples
+        """
+        self.meter.add(samples)
+        gain = loudness_gain(self.meter.integrated(), self.target_lufs)
+        start = gain if self.gain is None else self.gain
+        self.gain = gain
+
+        ramp = np.linspace(start, gain, len(samples), endpoint=False, dtype=np.float32)
+        return self.limiter.process(to_float(samples) * ramp[:, None])
+
+    def flush(self):
+        """
+        Master the frames held back for the limiter look-ahead.
+
+        Returns:
+            ndarray: float32 mastered samples
+        """
+        return self.limiter.flush()
+
+class MasteredRenderer:
+    """
+    Renderer that masters its songs to a loudness target.
+
+    Wraps any renderer. Unnormalized renders (stems, slices) are passed
+    through untouched, so they can still be mixed and mastered together.
+    """
+
+    def __init__(self, renderer, target_lufs=TARGET_LUFS, ceiling_db=CEILING_DB):
+        """
+        Initialize the renderer.
+
+        Args:
+            renderer (NumpySynthRenderer, FluidSynthRenderer or CachedRenderer): Renderer
+            target_lufs (float): Target integrated loudness in LUFS
+            ceiling_db (float): Peak level of the output in dBFS
+        """
+        self.renderer = renderer
+        self.target_lufs = target_lufs
+        self.ceiling_db = ceiling_db
+
+    @property
+    def sample_rate(self):
+        """Sample rate of the wrapped renderer in Hz."""
+        return self.renderer.sample_rate
+
+    @property
+    def channels(self):
+        """Output channels of the wrapped renderer."""
+        return getattr(self.renderer, 'channels', 2)
+
+    @property
+    def tail(self):
+        """Seconds rendered after the last event."""
+        return self.renderer.tail
+
+    @tail.setter
+    def tail(self, value):
+        self.renderer.tail = value
+
+    def render_samples(self, midi_file, normalize=True, tail=None):
+        """
+        Render a MIDI file to a sample buffer.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            normalize (bool): Master the result to the loudness target
+            tail (float): Seconds rendered after the last event (self.tail if None)
+
+        Returns:
+            ndarray: float32 stereo samples with shape (frames, 2)
+        """
+        samples = self.renderer.render_samples(midi_file, normalize=False, tail=tail)
+        if not normalize:
+            return samples
+        return master_samples(samples, self.sample_rate, self.target_lufs, self.ceiling_db)
+
+    def render(self, midi_file, output_wav):
+        """
+        Render a MIDI file to a WAV file.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            output_wav (str or file): Output path or writable binary file object
+
+        Returns:
+            dict: Timing of the render in seconds ('render')
+        """
+        start = time.perf_counter()
+        samples = self.renderer.render_samples(midi_file, normalize=False)
+
+        # Mono is measured after the downmix, as it is heard
+        if self.channels == 1:
+            samples = to_mono(samples)
+        samples = master_samples(samples, self.sample_rate, self.target_lufs, self.ceiling_db)
+
+        write_wav(output_wav, samples, self.sample_rate)
+        return {'render': time.perf_counter() - start}
+
+    def close(self):
+        """Release the wrapped renderer."""
+        self.renderer.close()
@@ -0,0 +1,371 @@
+"""
+Render pool module for the audio rendering system.
+Provides a pool of long-lived render workers that keep the SoundFont loaded.
+"""
+
+import io
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from .effects import EffectsChain
+from .fluid import FluidSynthRenderer
+from .formats import transcode_wav
+from .mastering import MasteredRenderer
+from .synth import NumpySynthRenderer
+from .tiers import DEFAULT_TIER, get_tier
+from .wav import to_float
+
+# Render backends by name
+RENDER_BACKENDS = ('fluidsynth', 'numpy')
+
+# Start method of render worker processes. Workers are started from
+# processes that run threads (the web server, the pool dispatchers), which
+# forking would copy mid-operation, so they are started from a clean server
+# process where the platform has one
+START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+def create_renderer(backend, sf2_file=None, sample_rate=44100, tier=None):
+    """
+    Create a renderer.
+
+    Args:
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file (fluidsynth only)
+        sample_rate (int): Sample rate in Hz (ignored when a tier is given)
+        tier (str): Render tier (see RENDER_TIERS); full quality at
+            sample_rate if None
+
+    Returns:
+        FluidSynthRenderer, NumpySynthRenderer or MasteredRenderer: Renderer,
+            mastered to the loudness target of the tier if it has one
+    """
+    settings = {}
+    if tier is not None:
+        settings = dict(get_tier(tier))
+        sample_rate = settings.pop('sample_rate')
+    loudness = settings.pop('loudness', None)
+
+    if backend == 'fluidsynth':
+        renderer = FluidSynthRenderer(sf2_file, sample_rate, **settings)
+    elif backend == 'numpy':
+        effects = EffectsChain(sample_rate) if settings.pop('effects', False) else None
+        renderer = NumpySynthRenderer(sample_rate, effects=effects, **settings)
+    else:
+        raise ValueError(f"Unknown render backend: {backend}")
+
+    if loudness is not None:
+        renderer = MasteredRenderer(renderer, loudness)
+    return renderer
+
+def render_worker(conn, backend, sf2_file, sample_rate):
+    """
+    Render jobs received over a pipe until told to stop.
+
+    Args:
+        conn (Connection): Worker end of the pipe
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file
+        sample_rate (int): Sample rate in Hz
+    """
+    # Renderers by tier, the default tier (used by the app) loaded up front
+    renderer = create_renderer(backend, sf2_file, sample_rate, DEFAULT_TIER)
+    renderers = {DEFAULT_TIER: renderer}
+    conn.send(('ready', getattr(getattr(renderer, 'renderer', renderer), 'load_time', 0.0)))
+
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            break
+        if job is None:
+            break
+
+        midi_file, output_wav, tier, audio_format, tail = job
+        try:
+            if tier not in renderers:
+                renderers[tier] = create_renderer(backend, sf2_file, sample_rate, tier)
+            renderer = renderers[tier]
+
+            # Without an output path the audio is sent back as bytes, or
+            # without a format as unnormalized float samples (slices)
+            if output_wav is None and audio_format is None:
+                start = time.perf_counter()
+                samples = renderer.render_samples(midi_file, normalize=False, tail=tail)
+                timing = {'samples': to_float(samples), 'render': time.perf_counter() - start}
+            elif output_wav is None:
+                buffer = io.BytesIO()
+                timing = renderer.render(midi_file, buffer)
+                start = time.perf_counter()
+                timing['audio'] = transcode_wav(buffer.getvalue(), audio_format)
+                timing['encode'] = time.perf_counter() - start
+            else:
+                timing = renderer.render(midi_file, output_wav)
+            conn.send(('ok', timing))
+        except Exception as e:
+            conn.send(('error', f"{type(e).__name__}: {e}"))
+
+    for renderer in renderers.values():
+        renderer.close()
+
+class RenderWorker:
+    """
+    Handle to a render worker process.
+    """
+
+    def __init__(self, context, index, backend, sf2_file, sample_rate):
+        """
+        Initialize the handle. The process is started by start().
+
+        Args:
+            context (BaseContext): Multiprocessing context
+            index (int): Worker number
+            backend (str): Render backend ('fluidsynth' or 'numpy')
+            sf2_file (str): Path to the SoundFont (.sf2) file
+            sample_rate (int): Sample rate in Hz
+        """
+        self.context = context
+        self.index = index
+        self.backend = backend
+        self.sf2_file = sf2_file
+        self.sample_rate = sample_rate
+        self.process = None
+        self.conn = None
+        self.restarts = -1
+
+    def start(self, timeout):
+        """
+        Start the worker process and wait for the SoundFont to load.
+
+        Args:
+            timeout (float): Seconds to wait for the worker to be ready
+        """
+        self.stop()
+
+        self.conn, worker_conn = self.context.Pipe()
+        self.process = self.context.Process(
+            target=render_worker,
+            args=(worker_conn, self.backend, self.sf2_file, self.sample_rate),
+            daemon=True
+        )
+        self.process.start()
+        worker_conn.close()
+        self.restarts += 1
+
+        if not self.conn.poll(timeout):
+            self.stop()
+            raise TimeoutError(f"Render worker {self.index} did not start within {timeout}s")
+        self.conn.recv()
+
+    def is_alive(self):
+        """Whether the worker process is running."""
+        return self.process is not None and self.process.is_alive()
+
+    def render(self, midi_file, output_wav, timeout, tier=None, audio_format='wav', tail=None):
+        """
+        Render a job on the worker, restarting it if it hangs or dies.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            output_wav (str): Path to the output WAV file (None to get the
+                audio bytes back in the timing dict)
+            timeout (float): Seconds to wait for the render
+            tier (str): Render tier (full quality if None)
+            audio_format (str): Format of the audio bytes (see AUDIO_FORMATS;
+                None to get the float samples back)
+            tail (float): Seconds rendered after the last event of a samples
+                job (renderer default if None)
+
+        Returns:
+            dict: Timing of the render in seconds
+        """
+        if not self.is_alive():
+            self.start(timeout)
+
+        try:
+            self.conn.send((midi_file, output_wav, tier, audio_format, tail))
+            if not self.conn.poll(timeout):
+                self.stop()
+                raise TimeoutError(f"Render of {output_wav or 'song'} timed out after {timeout}s")
+            status, result = self.conn.recv()
+        except (EOFError, BrokenPipeError, ConnectionResetError):
+            self.stop()
+            raise RuntimeError(f"Render worker {self.index} died while rendering {output_wav or 'song'}")
+
+        if status == 'error':
+            raise RuntimeError(result)
+        return result
+
+    def stop(self):
+        """Stop the worker process."""
+        if self.conn is not None:
+            try:
+                self.conn.send(None)
+            except (OSError, BrokenPipeError):
+                pass
+            self.conn.close()
+            self.conn = None
+
+        if self.process is not None:
+            self.process.join(1.0)
+            if self.process.is_alive():
+                self.process.kill()
+                self.process.join()
+            self.process = None
+
+class RenderPool:
+    """
+    Pool of render workers fed from a job queue.
+
+    Every worker is a long-lived process with the SoundFont preloaded, so
+    songs are rendered without paying for process startup and SoundFont
+    loading. A dispatcher thread per worker takes jobs from the queue; a
+    worker that times out or dies is restarted and its job fails. The
+    fluidsynth backend only keeps the SoundFont loaded with the pyfluidsynth
+    bindings; without them every job still runs a fluidsynth process, and
+    the pool only bounds how many run at once.
+    """
+
+    def __init__(self, sf2_file, num_workers=2, sample_rate=44100, timeout=60.0, start_method=START_METHOD,
+                 backend='fluidsynth'):
+        """
+        Initialize the pool and start the workers.
+
+        Args:
+            sf2_file (str): Path to the SoundFont (.sf2) file
+            num_workers (int): Number of worker processes
+            sample_rate (int): Sample rate in Hz
+            timeout (float): Seconds a render may take before its worker is restarted
+            start_method (str): Multiprocessing start method (platform default if None)
+            backend (str): Render backend ('fluidsynth' or 'numpy')
+        """
+        if backend not in RENDER_BACKENDS:
+            raise ValueError(f"Unknown render backend: {backend}")
+
+        self.sf2_file = sf2_file
+        self.backend = backend
+        self.sample_rate = sample_rate
+        self.timeout = timeout
+        self.jobs = queue.Queue()
+        self.closed = False
+
+        context = multiprocessing.get_context(start_method)
+        self.workers = [RenderWorker(context, index, backend, sf2_file, sample_rate)
+                        for index in range(num_workers)]
+        for worker in self.workers:
+            worker.start(timeout)
+
+        self.threads = [threading.Thread(target=self.dispatch, args=(worker,), daemon=True)
+                        for worker in self.workers]
+        for thread in self.threads:
+            thread.start()
+
+    def dispatch(self, worker):
+        """
+        Run jobs from the queue on a worker until the pool is closed.
+
+        Args:
+            worker (RenderWorker): Worker that runs the jobs
+        """
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+
+            future, midi_file, output_wav, tier, audio_format, tail, queued_at = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            started_at = time.perf_counter()
+            try:
+                timing = worker.render(midi_file, output_wav, self.timeout, tier, audio_format, tail)
+            except Exception as e:
+                future.set_exception(e)
+                continue
+
+            finished_at = time.perf_counter()
+            timing.update({
+                'queued': started_at - queued_at,
+                'total': finished_at - queued_at,
+                'worker': worker.index
+            })
+            future.set_result(timing)
+
+        worker.stop()
+
+    def submit(self, midi_file, output_wav, tier=None, audio_format='wav', tail=None):
+        """
+        Queue a render job.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            output_wav (str): Path to the output WAV file (None to render to
+                memory)
+            tier (str): Render tier (see RENDER_TIERS; full quality if None)
+            audio_format (str): Format of the audio rendered to memory (see
+                AUDIO_FORMATS; None for unnormalized float samples)
+            tail (float): Seconds rendered after the last event of a samples
+                job (renderer default if None)
+
+        Returns:
+            Future: Resolves to the job timing in seconds ('queued', 'render',
+                'total'), the worker number ('worker') and, when rendered to
+                memory, the encoding time ('encode') and audio bytes ('audio')
+                or the float samples ('samples')
+        """
+        if self.closed:
+            raise RuntimeError("Render pool is closed")
+
+        future = Future()
+        self.jobs.put((future, midi_file, output_wav, tier, audio_format, tail, time.perf_counter()))
+        return future
+
+    def render(self, midi_file, output_wav, tier=None):
+        """
+        Render a MIDI file to a WAV file and wait for the result.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            output_wav (str): Path to the output WAV file
+            tier (str): Render tier (full quality if None)
+
+        Returns:
+            dict: Job timing (see submit())
+        """
+        return self.submit(midi_file, output_wav, tier).result()
+
+    def render_bytes(self, midi_file, tier=None, audio_format='wav'):
+        """
+        Render a MIDI file to audio bytes in memory and wait for the result.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            tier (str): Render tier (full quality if None)
+            audio_format (str): Audio format (see AUDIO_FORMATS)
+
+        Returns:
+            tuple: (audio bytes, job timing (see submit()))
+        """
+        timing = self.submit(midi_file, None, tier, audio_format).result()
+        return timing.pop('audio'), timing
+
+    def restarts(self):
+        """
+        Get the number of worker restarts.
+
+        Returns:
+            int: Restarts across all workers
+        """
+        return sum(worker.restarts for worker in self.workers)
+
+    def close(self):
+        """Finish the queued jobs and stop the workers."""
+        if self.closed:
+            return
+        self.closed = True
+
+        for _ in self.threads:
+            self.jobs.put(None)
+        for thread in self.threads:
+            thread.join()
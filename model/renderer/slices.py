@@ -0,0 +1,375 @@
+"""
+Slices module for the audio rendering system.
+Provides functions for splitting a song into time slices at section
+boundaries, rendering the slices in parallel and stitching them together.
+"""
+
+import multiprocessing
+import time
+from bisect import bisect_right
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import mido
+import numpy as np
+from .pool import START_METHOD
+from .stems import get_render_executor, render_stem, HEADROOM_DB
+from .tiers import get_tier
+from .wav import seconds_to_frames, write_wav
+
+# Seconds rendered after the last note of a slice for release and reverb tails
+OVERLAP_SECONDS = 2.0
+
+# Bars per section when a song has no section markers
+DEFAULT_SECTION_BARS = 4
+
+def get_timeline(midi_file):
+    """
+    Get every message of a MIDI file in playback order.
+
+    Args:
+        midi_file (MidiFile): MIDI file object with delta times
+
+    Returns:
+        list: List of (time in ticks, message) tuples
+    """
+    timeline = []
+    for track_index, track in enumerate(midi_file.tracks):
+        absolute_time = 0
+        for position, msg in enumerate(track):
+            absolute_time += msg.time
+            if msg.type != 'end_of_track':
+                timeline.append((absolute_time, track_index, position, msg))
+
+    timeline.sort(key=lambda x: x[:3])
+    return [(time, msg) for time, _, _, msg in timeline]
+
+def build_tempo_map(timeline, ticks_per_beat):
+    """
+    Build a map from ticks to seconds.
+
+    Args:
+        timeline (list): List of (time in ticks, message) tuples
+        ticks_per_beat (int): Ticks per beat
+
+    Returns:
+        list: List of (tick, seconds, tempo) tuples, one per tempo change
+    """
+    tempo_map = [(0, 0.0, 500000)]
+    for time, msg in timeline:
+        if msg.type == 'set_tempo':
+            tick, seconds, tempo = tempo_map[-1]
+            seconds += mido.tick2second(time - tick, ticks_per_beat, tempo)
+            tempo_map.append((time, seconds, msg.tempo))
+    return tempo_map
+
+def tick_to_seconds(tick, tempo_map, ticks_per_beat):
+    """
+    Convert a time in ticks to seconds.
+
+    Args:
+        tick (int): Time in ticks
+        tempo_map (list): List of (tick, seconds, tempo) tuples
+        ticks_per_beat (int): Ticks per beat
+
+    Returns:
+        float: Time in seconds
+    """
+    index = bisect_right([entry[0] for entry in tempo_map], tick) - 1
+    start_tick, seconds, tempo = tempo_map[index]
+    return seconds + mido.tick2second(tick - start_tick, ticks_per_beat, tempo)
+
+def get_section_bounds(midi_file, timeline):
+    """
+    Get the start tick of every section of a song.
+
+    Sections are read from the marker meta messages. Songs without markers
+    are split every DEFAULT_SECTION_BARS bars.
+
+    Args:
+        midi_file (MidiFile): MIDI file object
+        timeline (list): List of (time in ticks, message) tuples
+
+    Returns:
+        list: Sorted start ticks, beginning with 0
+    """
+    bounds = {time for time, msg in timeline if msg.type == 'marker'}
+
+    if not bounds:
+        numerator, denominator = 4, 4
+        for time, msg in timeline:
+            if msg.type == 'time_signature':
+                numerator, denominator = msg.numerator, msg.denominator
+                break
+        ticks_per_bar = midi_file.ticks_per_beat * numerator * 4 // denominator
+        song_end = timeline[-1][0] if timeline else 0
+        bounds = set(range(0, song_end, ticks_per_bar * DEFAULT_SECTION_BARS))
+
+    return sorted(bounds | {0})
+
+def slice_midi_file(midi_file, timeline, start_tick, end_tick, overlap_ticks):
+    """
+    Cut the part of a song that belongs to a slice.
+
+    A slice owns the notes that start inside it and renders them to their
+    note-off, so notes held across the boundary are not retriggered. The
+    program, controller and pitch bend state at the start of the slice is
+    carried in at tick 0, and the channel messages that follow are kept
+    until the slice's notes have rung out, so automation still applies to
+    the tails.
+
+    Args:
+        midi_file (MidiFile): MIDI file object
+        timeline (list): List of (time in ticks, message) tuples
+        start_tick (int): Start of the slice in ticks
+        end_tick (int): End of the slice in ticks (None for the last slice)
+        overlap_ticks (int): Ticks kept after the last note-off of the slice
+
+    Returns:
+        MidiFile: Format 0 MIDI file of the slice, starting at tick 0
+    """
+    def owns(time):
+        return time >= start_tick and (end_tick is None or time < end_tick)
+
+    # Pair note-ons with note-offs and keep the notes the slice owns
+    open_notes = defaultdict(deque)
+    owned = set()
+    release_end = end_tick if end_tick is not None else start_tick
+    for index, (time, msg) in enumerate(timeline):
+        if msg.type == 'note_on' and msg.velocity > 0:
+            open_notes[(msg.channel, msg.note)].append(index)
+            if owns(time):
+                owned.add(index)
+        elif msg.type in ('note_on', 'note_off'):
+            pending = open_notes[(msg.channel, msg.note)]
+            if pending and pending.popleft() in owned:
+                owned.add(index)
+                release_end = max(release_end, time)
+
+    control_end = None if end_tick is None else release_end + overlap_ticks
+
+    # State before the slice: tempo plus the last value of every controller
+    state = {}
+    events = []
+    for index, (time, msg) in enumerate(timeline):
+        if msg.type in ('note_on', 'note_off'):
+            if index in owned:
+                events.append((time - start_tick, msg))
+            continue
+
+        if time < start_tick:
+            if msg.type == 'set_tempo':
+                state['tempo'] = msg
+            elif msg.type == 'program_change':
+                state[(msg.channel, 'program')] = msg
+            elif msg.type == 'control_change':
+                state[(msg.channel, 'control', msg.control)] = msg
+            elif msg.type == 'pitchwheel':
+                state[(msg.channel, 'pitch')] = msg
+        elif control_end is None or time < control_end:
+            events.append((time - start_tick, msg))
+
+    slice_file = mido.MidiFile(type=0, ticks_per_beat=midi_file.ticks_per_beat)
+    track = mido.MidiTrack()
+    slice_file.tracks.append(track)
+
+    prev_time = 0
+    for time, msg in [(0, msg) for msg in state.values()] + events:
+        track.append(msg.copy(time=time - prev_time))
+        prev_time = time
+
+    return slice_file
+
+def stitch_slices(slice_samples, offsets):
+    """
+    Stitch rendered slices into one buffer.
+
+    Every note is rendered by exactly one slice, so the slices are
+    overlap-added: the tail of a slice sums with the start of the next one
+    sample for sample, and nothing is faded out.
+
+    Args:
+        slice_samples (list): float stereo samples of each slice
+        offsets (list): Start frame of each slice
+
+    Returns:
+        ndarray: float32 stereo samples with shape (frames, 2)
+    """
+    num_frames = max((offset + len(samples) for samples, offset in zip(slice_samples, offsets)), default=0)
+    output = np.zeros((num_frames, 2), dtype=np.float32)
+    for samples, offset in zip(slice_samples, offsets):
+        output[offset:offset + len(samples)] += samples
+    return output
+
+def prepare_slices(midi_file, sample_rate=44100, num_slices=None, overlap=OVERLAP_SECONDS):
+    """
+    Cut a song into slices at its section boundaries.
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        sample_rate (int): Sample rate in Hz
+        num_slices (int): Most slices; consecutive sections are grouped into
+            slices of about equal length (one slice per section if None)
+        overlap (float): Seconds rendered after the last note of each slice
+
+    Returns:
+        tuple: (list of slice MidiFiles, list of start frames)
+    """
+    if not isinstance(midi_file, mido.MidiFile):
+        midi_file = mido.MidiFile(midi_file)
+
+    ticks_per_beat = midi_file.ticks_per_beat
+    timeline = get_timeline(midi_file)
+    tempo_map = build_tempo_map(timeline, ticks_per_beat)
+
+    bounds = get_section_bounds(midi_file, timeline)
+    if num_slices is not None and len(bounds) > num_slices:
+        step = -(-len(bounds) // num_slices)
+        bounds = bounds[::step]
+
+    # Overlap in ticks at the slowest tempo of the song
+    slowest_tempo = max(tempo for _, _, tempo in tempo_map)
+    overlap_ticks = int(mido.second2tick(overlap, ticks_per_beat, slowest_tempo))
+
+    slice_files = [
+        slice_midi_file(midi_file, timeline, start, end, overlap_ticks)
+        for start, end in zip(bounds, bounds[1:] + [None])
+    ]
+    offsets = [seconds_to_frames(tick_to_seconds(start, tempo_map, ticks_per_beat), sample_rate) for start in bounds]
+    return slice_files, offsets
+
+def render_slices(midi_file, backend='fluidsynth', sf2_file=None, sample_rate=44100, executor=None,
+                  max_workers=None, num_slices=None, overlap=OVERLAP_SECONDS, headroom_db=HEADROOM_DB):
+    """
+    Render a song in time slices in parallel and stitch them together.
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file (fluidsynth only)
+        sample_rate (int): Sample rate in Hz
+        executor (Executor): Process pool to render on (the shared render
+            pool if None)
+        max_workers (int): Render on a temporary pool with this many workers,
+            created and shut down for the song, instead of the shared pool
+        num_slices (int): Most slices; consecutive sections are grouped into
+            slices of about equal length (one slice per section if None)
+        overlap (float): Seconds rendered after the last note of each slice
+        headroom_db (float): The result is scaled down so its peak stays this
+            many dB below full scale
+
+    Returns:
+        ndarray: float32 stereo samples with shape (frames, 2)
+    """
+    slice_files, offsets = prepare_slices(midi_file, sample_rate, num_slices, overlap)
+
+    own_executor = executor is None and max_workers is not None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(START_METHOD))
+    elif executor is None:
+        executor = get_render_executor()
+
+    try:
+        futures = [executor.submit(render_stem, backend, sf2_file, sample_rate, slice_file, overlap)
+                   for slice_file in slice_files]
+        slice_samples = [future.result()[0] for future in futures]
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    output = stitch_slices(slice_samples, offsets)
+
+    peak_level = 10.0 ** (-headroom_db / 20.0)
+    peak = np.abs(output).max(initial=0.0)
+    if peak > peak_level:
+        output *= peak_level / peak
+
+    return output
+
+def iter_slice_samples(midi_file, backend='fluidsynth', sf2_file=None, sample_rate=44100, executor=None,
+                       num_slices=None, overlap=OVERLAP_SECONDS, tier=None, pool=None):
+    """
+    Render a song slice by slice and yield the audio as soon as it is final.
+
+    Once a slice is rendered, no later slice reaches back before its end
+    boundary, so everything up to the start of the next slice can be sent.
+    The first chunk is ready after one section instead of the whole song.
+    Without the whole song the peak is unknown, so the chunks are not
+    normalized (to_int16() clips them at full scale).
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file (fluidsynth only)
+        sample_rate (int): Sample rate in Hz
+        executor (Executor): Pool that renders the slices ahead in parallel
+            (rendered one at a time in the current process if None)
+        num_slices (int): Most slices (one slice per section if None)
+        overlap (float): Seconds rendered after the last note of each slice
+        tier (str): Render tier, which overrides the sample rate (full
+            quality if None)
+        pool (RenderPool): Render pool that renders the slices ahead on its
+            workers, in place of the executor (its backend, SoundFont and
+            sample rate are used)
+
+    Yields:
+        ndarray: float32 stereo samples with shape (frames, 2)
+    """
+    if pool is not None:
+        sample_rate = pool.sample_rate
+    if tier is not None:
+        sample_rate = get_tier(tier)['sample_rate']
+    slice_files, offsets = prepare_slices(midi_file, sample_rate, num_slices, overlap)
+
+    if pool is not None:
+        futures = [pool.submit(slice_file, None, tier, None, overlap) for slice_file in slice_files]
+        results = ((timing['samples'], timing['render']) for timing in (future.result() for future in futures))
+    elif executor is not None:
+        futures = [executor.submit(render_stem, backend, sf2_file, sample_rate, slice_file, overlap, tier)
+                   for slice_file in slice_files]
+        results = (future.result() for future in futures)
+    else:
+        results = (render_stem(backend, sf2_file, sample_rate, slice_file, overlap, tier)
+                   for slice_file in slice_files)
+
+    # Mixed audio from frame position on that later slices can still add to
+    pending = np.zeros((0, 2), dtype=np.float32)
+    position = 0
+    for index, (samples, _) in enumerate(results):
+        start = offsets[index] - position
+        final = offsets[index + 1] - position if index + 1 < len(offsets) else start + len(samples)
+        num_frames = max(start + len(samples), final)
+        if num_frames > len(pending):
+            pending = np.concatenate([pending, np.zeros((num_frames - len(pending), 2), dtype=np.float32)])
+        pending[start:start + len(samples)] += samples
+
+        if index + 1 == len(offsets):
+            final = len(pending)
+        if final > 0:
+            yield pending[:final]
+            pending = pending[final:]
+            position += final
+
+def render_slices_to_wav(midi_file, output_wav, backend='fluidsynth', sf2_file=None, sample_rate=44100,
+                         executor=None, num_slices=None, overlap=OVERLAP_SECONDS):
+    """
+    Render a song in time slices in parallel and write it to a WAV file.
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        output_wav (str): Path to the output WAV file
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file (fluidsynth only)
+        sample_rate (int): Sample rate in Hz
+        executor (Executor): Process pool to render on (the shared render
+            pool if None)
+        num_slices (int): Most slices (one slice per section if None)
+        overlap (float): Seconds rendered after the last note of each slice
+
+    Returns:
+        dict: Timing of the render in seconds ('render')
+    """
+    start = time.perf_counter()
+    output = render_slices(midi_file, backend, sf2_file, sample_rate, executor,
+                           num_slices=num_slices, overlap=overlap)
+    write_wav(output_wav, output, sample_rate)
+    return {'render': time.perf_counter() - start}
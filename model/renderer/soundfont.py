@@ -0,0 +1,282 @@
+"""
+SoundFont module for the audio rendering system.
+Provides a SoundFont (.sf2) subsetter that keeps only the presets a set of
+instrument maps uses, with their instruments and samples.
+
+Usage: python -m model.renderer.soundfont input.sf2 output.sf2 instruments.json [...]
+
+Run it at deploy time and point SF2_FILE at the output.
+"""
+
+import json
+import struct
+import sys
+import numpy as np
+
+# Bank of the percussion presets
+DRUM_BANK = 128
+
+# Presets always kept: the piano channels start on and the standard kit
+DEFAULT_PRESETS = ((0, 0), (DRUM_BANK, 0))
+
+# Generators that point to an instrument (preset zones) and a sample
+# (instrument zones)
+INSTRUMENT_GENERATOR = 41
+SAMPLE_GENERATOR = 53
+
+# Zero sample points the SoundFont format requires after every sample
+SAMPLE_PADDING = 46
+
+# Records of the preset data (pdta) chunks, little-endian
+PDTA_RECORDS = {
+    'phdr': np.dtype([('name', 'S20'), ('preset', '<u2'), ('bank', '<u2'), ('bag', '<u2'),
+                      ('library', '<u4'), ('genre', '<u4'), ('morphology', '<u4')]),
+    'pbag': np.dtype([('generator', '<u2'), ('modulator', '<u2')]),
+    'pmod': np.dtype([('source', '<u2'), ('destination', '<u2'), ('amount', '<i2'),
+                      ('amount_source', '<u2'), ('transform', '<u2')]),
+    'pgen': np.dtype([('operator', '<u2'), ('amount', '<u2')]),
+    'inst': np.dtype([('name', 'S20'), ('bag', '<u2')]),
+    'ibag': np.dtype([('generator', '<u2'), ('modulator', '<u2')]),
+    'imod': np.dtype([('source', '<u2'), ('destination', '<u2'), ('amount', '<i2'),
+                      ('amount_source', '<u2'), ('transform', '<u2')]),
+    'igen': np.dtype([('operator', '<u2'), ('amount', '<u2')]),
+    'shdr': np.dtype([('name', 'S20'), ('start', '<u4'), ('end', '<u4'), ('loop_start', '<u4'),
+                      ('loop_end', '<u4'), ('sample_rate', '<u4'), ('pitch', 'u1'),
+                      ('correction', 'i1'), ('link', '<u2'), ('type', '<u2')])
+}
+
+def read_chunks(data, offset, end):
+    """
+    Read the RIFF chunks in a byte range.
+
+    Args:
+        data (bytes): File bytes
+        offset (int): Start of the first chunk
+        end (int): End of the range
+
+    Returns:
+        dict: Chunk data by chunk id; LIST chunks by 'LIST' plus their type
+            (for example 'LISTpdta')
+    """
+    chunks = {}
+    while offset + 8 <= end:
+        chunk_id, size = struct.unpack_from('<4sI', data, offset)
+        chunk_id = chunk_id.decode('latin-1')
+        body = data[offset + 8:offset + 8 + size]
+        if chunk_id == 'LIST':
+            chunk_id += body[:4].decode('latin-1')
+        chunks[chunk_id] = body
+        offset += 8 + size + (size & 1)
+    return chunks
+
+def build_chunk(chunk_id, body):
+    """
+    Build a RIFF chunk.
+
+    Args:
+        chunk_id (str): Four character chunk id
+        body (bytes): Chunk data (for LIST chunks, starting with the list type)
+
+    Returns:
+        bytes: Chunk, padded to an even size
+    """
+    return struct.pack('<4sI', chunk_id.encode('latin-1'), len(body)) + body + b'\0' * (len(body) & 1)
+
+def read_soundfont(sf2_file):
+    """
+    Read a SoundFont.
+
+    Args:
+        sf2_file (str): Path to the SoundFont (.sf2) file
+
+    Returns:
+        dict: INFO list bytes ('info'), sample data ('smpl', int16, and
+            'sm24' if present, uint8) and the preset data records by chunk id
+    """
+    with open(sf2_file, 'rb') as f:
+        data = f.read()
+
+    riff, _, form = struct.unpack_from('<4sI4s', data)
+    if riff != b'RIFF' or form != b'sfbk':
+        raise ValueError(f"Not a SoundFont: {sf2_file}")
+
+    chunks = read_chunks(data, 12, len(data))
+    sdta = read_chunks(chunks['LISTsdta'], 4, len(chunks['LISTsdta']))
+    pdta = read_chunks(chunks['LISTpdta'], 4, len(chunks['LISTpdta']))
+
+    soundfont = {'info': chunks['LISTINFO'], 'smpl': np.frombuffer(sdta['smpl'], dtype='<i2')}
+    if 'sm24' in sdta:
+        soundfont['sm24'] = np.frombuffer(sdta['sm24'], dtype=np.uint8)
+    for chunk_id, dtype in PDTA_RECORDS.items():
+        soundfont[chunk_id] = np.frombuffer(pdta[chunk_id], dtype=dtype).copy()
+    return soundfont
+
+def write_soundfont(sf2_file, soundfont):
+    """
+    Write a SoundFont.
+
+    Args:
+        sf2_file (str): Output path
+        soundfont (dict): SoundFont as returned by read_soundfont()
+    """
+    sdta = build_chunk('smpl', soundfont['smpl'].astype('<i2').tobytes())
+    if 'sm24' in soundfont:
+        sdta += build_chunk('sm24', soundfont['sm24'].tobytes())
+    pdta = b''.join(build_chunk(chunk_id, soundfont[chunk_id].tobytes()) for chunk_id in PDTA_RECORDS)
+
+    body = (b'sfbk' + build_chunk('LIST', soundfont['info'])
+            + build_chunk('LIST', b'sdta' + sdta) + build_chunk('LIST', b'pdta' + pdta))
+    with open(sf2_file, 'wb') as f:
+        f.write(struct.pack('<4sI', b'RIFF', len(body)) + body)
+
+def get_used_presets(instrument_maps):
+    """
+    Get the presets an instrument map uses.
+
+    Maps are either {name: program} (instruments.json) or {name: {'program':
+    program, 'channel': channel}} (load_instruments()). Drum entries, by
+    name or on the drum channel, select a kit in the percussion bank.
+
+    Args:
+        instrument_maps (list): Instrument maps
+
+    Returns:
+        set: (bank, preset) pairs, with DEFAULT_PRESETS
+    """
+    presets = set(DEFAULT_PRESETS)
+    for instrument_map in instrument_maps:
+        for name, instrument in instrument_map.items():
+            if isinstance(instrument, dict):
+                if 'program' not in instrument:
+                    continue
+                is_drums = 'drum' in name or instrument.get('channel') == 9
+                program = instrument['program']
+            else:
+                is_drums = 'drum' in name
+                program = instrument
+            presets.add((DRUM_BANK if is_drums else 0, int(program)))
+    return presets
+
+def subset_zones(headers, bags, modulators, generators, keep):
+    """
+    Copy the zones of the kept presets or instruments.
+
+    Args:
+        headers (ndarray): phdr or inst records, terminal record last
+        bags (ndarray): pbag or ibag records, terminal record last
+        modulators (ndarray): pmod or imod records, terminal record last
+        generators (ndarray): pgen or igen records, terminal record last
+        keep (ndarray): Indices of the kept headers (not the terminal one)
+
+    Returns:
+        tuple: (headers, bags, modulators, generators) of the kept zones,
+            each with its terminal record
+    """
+    new_headers, new_bags, new_modulators, new_generators = [], [], [], []
+    num_bags = num_modulators = num_generators = 0
+
+    for index in list(keep) + [len(headers) - 1]:
+        header = headers[index:index + 1].copy()
+        header['bag'] = num_bags
+        new_headers.append(header)
+        if index == len(headers) - 1:
+            break
+
+        zone_bags = bags[headers['bag'][index]:headers['bag'][index + 1] + 1].copy()
+        first_generator, last_generator = int(zone_bags['generator'][0]), int(zone_bags['generator'][-1])
+        first_modulator, last_modulator = int(zone_bags['modulator'][0]), int(zone_bags['modulator'][-1])
+        new_generators.append(generators[first_generator:last_generator])
+        new_modulators.append(modulators[first_modulator:last_modulator])
+
+        zone_bags['generator'] = zone_bags['generator'].astype(np.int64) - first_generator + num_generators
+        zone_bags['modulator'] = zone_bags['modulator'].astype(np.int64) - first_modulator + num_modulators
+        new_bags.append(zone_bags[:-1])
+
+        num_bags += len(zone_bags) - 1
+        num_generators += last_generator - first_generator
+        num_modulators += last_modulator - first_modulator
+
+    terminal_bag = np.zeros(1, dtype=bags.dtype)
+    terminal_bag['generator'], terminal_bag['modulator'] = num_generators, num_modulators
+    return (np.concatenate(new_headers),
+            np.concatenate(new_bags + [terminal_bag]),
+            np.concatenate(new_modulators + [np.zeros(1, dtype=modulators.dtype)]),
+            np.concatenate(new_generators + [np.zeros(1, dtype=generators.dtype)]))
+
+def subset_soundfont(soundfont, presets):
+    """
+    Reduce a SoundFont to some of its presets.
+
+    Args:
+        soundfont (dict): SoundFont as returned by read_soundfont()
+        presets (set): (bank, preset) pairs to keep
+
+    Returns:
+        dict: Reduced SoundFont
+    """
+    phdr = soundfont['phdr']
+    kept_presets = [index for index in range(len(phdr) - 1)
+                    if (int(phdr['bank'][index]), int(phdr['preset'][index])) in presets]
+    phdr, pbag, pmod, pgen = subset_zones(phdr, soundfont['pbag'], soundfont['pmod'], soundfont['pgen'],
+                                          kept_presets)
+
+    # Instruments of the kept presets, in their original order
+    instrument_zones = pgen['operator'] == INSTRUMENT_GENERATOR
+    kept_instruments = np.unique(pgen['amount'][instrument_zones])
+    instrument_map = np.zeros(len(soundfont['inst']), dtype=np.uint16)
+    instrument_map[kept_instruments] = np.arange(len(kept_instruments))
+    pgen['amount'][instrument_zones] = instrument_map[pgen['amount'][instrument_zones]]
+
+    inst, ibag, imod, igen = subset_zones(soundfont['inst'], soundfont['ibag'], soundfont['imod'],
+                                          soundfont['igen'], kept_instruments)
+
+    # Samples of the kept instruments, with the other half of stereo pairs
+    shdr = soundfont['shdr']
+    sample_zones = igen['operator'] == SAMPLE_GENERATOR
+    kept_samples = set(igen['amount'][sample_zones].tolist())
+    linked = {int(shdr['link'][index]) for index in kept_samples if shdr['type'][index] & 0x0E}
+    kept_samples = np.array(sorted(kept_samples | {index for index in linked if index < len(shdr) - 1}),
+                            dtype=np.int64)
+    sample_map = np.zeros(len(shdr), dtype=np.uint16)
+    sample_map[kept_samples] = np.arange(len(kept_samples))
+    igen['amount'][sample_zones] = sample_map[igen['amount'][sample_zones]]
+
+    # Sample data of the kept samples, each followed by the required padding
+    new_shdr = np.concatenate([shdr[kept_samples], shdr[-1:]])
+    old_starts = shdr['start'][kept_samples].astype(np.int64)
+    lengths = shdr['end'][kept_samples].astype(np.int64) - old_starts
+    new_starts = np.cumsum(lengths + SAMPLE_PADDING) - lengths - SAMPLE_PADDING
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    sources = np.repeat(old_starts, lengths) + offsets
+    targets = np.repeat(new_starts, lengths) + offsets
+
+    reduced = dict(soundfont, phdr=phdr, pbag=pbag, pmod=pmod, pgen=pgen, inst=inst, ibag=ibag,
+                   imod=imod, igen=igen, shdr=new_shdr)
+    for chunk_id in ('smpl', 'sm24'):
+        if chunk_id in soundfont:
+            data = np.zeros(int((lengths + SAMPLE_PADDING).sum()), dtype=soundfont[chunk_id].dtype)
+            data[targets] = soundfont[chunk_id][sources]
+            reduced[chunk_id] = data
+
+    # Sample positions move with the data; links follow the renumbering
+    for field in ('start', 'end', 'loop_start', 'loop_end'):
+        new_shdr[field][:-1] = new_shdr[field][:-1].astype(np.int64) - old_starts + new_starts
+    is_linked = (new_shdr['type'][:-1] & 0x0E) != 0
+    new_shdr['link'][:-1][is_linked] = sample_map[new_shdr['link'][:-1][is_linked]]
+    return reduced
+
+if __name__ == "__main__":
+    input_sf2, output_sf2 = sys.argv[1], sys.argv[2]
+    instrument_maps = []
+    for map_file in sys.argv[3:]:
+        with open(map_file) as f:
+            instrument_maps.append(json.load(f))
+
+    presets = get_used_presets(instrument_maps)
+    soundfont = read_soundfont(input_sf2)
+    reduced = subset_soundfont(soundfont, presets)
+    write_soundfont(output_sf2, reduced)
+
+    print(f"Kept {len(reduced['phdr']) - 1} of {len(soundfont['phdr']) - 1} presets, "
+          f"{len(reduced['shdr']) - 1} of {len(soundfont['shdr']) - 1} samples "
+          f"({len(reduced['smpl']) * 2 / 1e6:.1f} of {len(soundfont['smpl']) * 2 / 1e6:.1f} MB of sample data)")
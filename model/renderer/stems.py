@@ -0,0 +1,246 @@
+"""
+Stems module for the audio rendering system.
+Provides functions for splitting a song into stems by channel, rendering the
+stems in parallel and mixing them down.
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+import mido
+import numpy as np
+from .pool import START_METHOD, create_renderer
+from .wav import to_float, write_wav
+
+# Channels of each stem
+STEMS = {
+    'bass': (0, 6),           # Bass and secondary bass
+    'chords': (1,),
+    'melodies': (2, 3, 4, 5),   # Melody, background and secondary melodies
+    'drums': (9, 10)          # Drums and secondary drums
+}
+
+# Peak level of the mix (-1 dBFS)
+HEADROOM_DB = 1.0
+
+# Renderers of the current process and their locks by (backend, SoundFont,
+# sample rate, tier). Renderers are not thread-safe, so threads take turns
+process_renderers = {}
+process_renderers_lock = threading.Lock()
+
+# Process pool shared by stem and slice renders, so its workers keep their
+# renderers loaded between songs
+render_executor = None
+render_executor_lock = threading.Lock()
+
+def get_render_executor():
+    """
+    Get the shared render process pool, starting it on first use.
+
+    Returns:
+        ProcessPoolExecutor: Pool with one worker per CPU
+    """
+    global render_executor
+    with render_executor_lock:
+        if render_executor is None:
+            render_executor = ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                                  mp_context=multiprocessing.get_context(START_METHOD))
+        return render_executor
+
+def split_stems(midi_file, stems=STEMS):
+    """
+    Split a MIDI file into one MIDI file per stem.
+
+    Every stem keeps the meta messages (tempo, time signature) of the song
+    and the channel messages of its channels. Channels that are in no stem
+    form an 'other' stem.
+
+    Args:
+        midi_file (MidiFile): MIDI file object
+        stems (dict): Channels of each stem by stem name
+
+    Returns:
+        dict: MidiFile of each stem that has notes, by stem name
+    """
+    stem_of_channel = {channel: name for name, channels in stems.items() for channel in channels}
+
+    names = list(stems) + ['other']
+    stem_files = {name: mido.MidiFile(type=1, ticks_per_beat=midi_file.ticks_per_beat) for name in names}
+
+    for track in midi_file.tracks:
+        stem_tracks = {name: mido.MidiTrack() for name in names}
+        prev_times = dict.fromkeys(names, 0)
+
+        absolute_time = 0
+        for msg in track:
+            absolute_time += msg.time
+            if msg.is_meta:
+                if msg.type == 'end_of_track':
+                    continue
+                targets = names
+            else:
+                targets = [stem_of_channel.get(msg.channel, 'other')]
+
+            for name in targets:
+                stem_tracks[name].append(msg.copy(time=absolute_time - prev_times[name]))
+                prev_times[name] = absolute_time
+
+        for name in names:
+            stem_files[name].tracks.append(stem_tracks[name])
+
+    # Drop stems without notes
+    return {
+        name: stem_file for name, stem_file in stem_files.items()
+        if any(msg.type == 'note_on' for track in stem_file.tracks for msg in track)
+    }
+
+def render_stem(backend, sf2_file, sample_rate, stem_file, tail=None, tier=None):
+    """
+    Render a stem in the current process.
+
+    The renderer of each backend is created once per process, so a worker
+    keeps its SoundFont loaded between stems. Threads of the process render
+    on it one at a time.
+
+    Args:
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file
+        sample_rate (int): Sample rate in Hz
+        stem_file (MidiFile): MIDI file of the stem
+        tail (float): Seconds rendered after the last event (renderer
+            default if None)
+        tier (str): Render tier, which sets the sample rate (full quality
+            if None)
+
+    Returns:
+        tuple: (float32 stereo samples, render time in seconds)
+    """
+    key = (backend, sf2_file, sample_rate, tier)
+    with process_renderers_lock:
+        if key not in process_renderers:
+            process_renderers[key] = (create_renderer(backend, sf2_file, sample_rate, tier), threading.Lock())
+        renderer, lock = process_renderers[key]
+
+    # Stems are scaled together at mixdown, not one by one
+    with lock:
+        start = time.perf_counter()
+        samples = renderer.render_samples(stem_file, normalize=False, tail=tail)
+        return to_float(samples), time.perf_counter() - start
+
+def pan_gains(pan):
+    """
+    Get the left and right gains of a stereo pan position.
+
+    Args:
+        pan (float): Pan position (-1.0 left, 0.0 center, 1.0 right)
+
+    Returns:
+        ndarray: (left, right) gains, 1.0 for both at the center
+    """
+    angle = (pan + 1.0) * np.pi / 4.0
+    return np.array([np.cos(angle), np.sin(angle)], dtype=np.float32) * np.sqrt(2.0)
+
+def mix_stems(stem_samples, gains=None, pans=None, headroom_db=HEADROOM_DB):
+    """
+    Mix rendered stems down to one stereo buffer.
+
+    Args:
+        stem_samples (dict): float stereo samples of each stem by stem name
+        gains (dict): Gain of each stem in dB (0 dB if not given)
+        pans (dict): Pan position of each stem (-1.0 to 1.0, center if not given)
+        headroom_db (float): The mix is scaled down so its peak stays this
+            many dB below full scale
+
+    Returns:
+        ndarray: float32 stereo samples with shape (frames, 2)
+    """
+    gains = gains or {}
+    pans = pans or {}
+
+    num_frames = max((len(samples) for samples in stem_samples.values()), default=0)
+    mix = np.zeros((num_frames, 2), dtype=np.float32)
+
+    for name, samples in stem_samples.items():
+        gain = 10.0 ** (gains.get(name, 0.0) / 20.0)
+        mix[:len(samples)] += samples * (gain * pan_gains(pans.get(name, 0.0)))
+
+    peak_level = 10.0 ** (-headroom_db / 20.0)
+    peak = np.abs(mix).max(initial=0.0)
+    if peak > peak_level:
+        mix *= peak_level / peak
+
+    return mix
+
+def render_stems(midi_file, backend='fluidsynth', sf2_file=None, sample_rate=44100, executor=None,
+                 max_workers=None, gains=None, pans=None, return_stems=False):
+    """
+    Render a song stem by stem in parallel and mix the stems down.
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file (fluidsynth only)
+        sample_rate (int): Sample rate in Hz
+        executor (Executor): Process pool to render on (the shared render
+            pool if None)
+        max_workers (int): Render on a temporary pool with this many workers,
+            created and shut down for the song, instead of the shared pool
+        gains (dict): Gain of each stem in dB
+        pans (dict): Pan position of each stem (-1.0 to 1.0)
+        return_stems (bool): Also return the samples of every stem
+
+    Returns:
+        ndarray or tuple: float32 stereo mix, or (mix, dict of stem samples
+            by stem name) if return_stems is set
+    """
+    if not isinstance(midi_file, mido.MidiFile):
+        midi_file = mido.MidiFile(midi_file)
+
+    stem_files = split_stems(midi_file)
+
+    own_executor = executor is None and max_workers is not None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context(START_METHOD))
+    elif executor is None:
+        executor = get_render_executor()
+
+    try:
+        futures = {
+            name: executor.submit(render_stem, backend, sf2_file, sample_rate, stem_file)
+            for name, stem_file in stem_files.items()
+        }
+        stem_samples = {name: future.result()[0] for name, future in futures.items()}
+    finally:
+        if own_executor:
+            executor.shutdown()
+
+    mix = mix_stems(stem_samples, gains, pans)
+    if return_stems:
+        return mix, stem_samples
+    return mix
+
+def render_stems_to_wav(midi_file, output_wav, backend='fluidsynth', sf2_file=None, sample_rate=44100,
+                        executor=None, gains=None, pans=None):
+    """
+    Render a song stem by stem in parallel and write the mix to a WAV file.
+
+    Args:
+        midi_file (str or MidiFile): MIDI file path or object
+        output_wav (str): Path to the output WAV file
+        backend (str): Render backend ('fluidsynth' or 'numpy')
+        sf2_file (str): Path to the SoundFont (.sf2) file (fluidsynth only)
+        sample_rate (int): Sample rate in Hz
+        executor (Executor): Process pool to render on (the shared render
+            pool if None)
+        gains (dict): Gain of each stem in dB
+        pans (dict): Pan position of each stem (-1.0 to 1.0)
+
+    Returns:
+        dict: Timing of the render in seconds ('render')
+    """
+    start = time.perf_counter()
+    mix = render_stems(midi_file, backend, sf2_file, sample_rate, executor, gains=gains, pans=pans)
+    write_wav(output_wav, mix, sample_rate)
+    return {'render': time.perf_counter() - start}
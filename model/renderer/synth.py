@@ -0,0 +1,415 @@
+"""
+Synth module for the audio rendering system.
+Provides an in-process software synthesizer built on NumPy wavetables and
+ADSR envelopes, so songs can be rendered without FluidSynth or a SoundFont.
+"""
+
+import heapq
+import time
+from collections import defaultdict, deque
+from functools import lru_cache
+import mido
+import numpy as np
+from .cache import SampleCache
+from .drums import DRUM_CHANNELS, DrumKit
+from .wav import seconds_to_frames, to_mono, write_wav
+
+# Samples per wavetable cycle
+TABLE_SIZE = 2048
+
+# Most harmonics in a wavetable
+MAX_HARMONICS = 64
+
+# Seconds rendered after the last note so releases can ring out
+TAIL_SECONDS = 2.0
+
+# Peak level of the mix (-1 dBFS)
+PEAK_LEVEL = 0.89
+
+# Most bytes of rendered voices cached per process
+VOICE_CACHE_BYTES = 64 * 1024 * 1024
+
+# Voice family of each GM program group (program // 8)
+PROGRAM_FAMILIES = [
+    'keys',   # Piano
+    'keys',   # Chromatic percussion
+    'pad',    # Organ
+    'pluck',  # Guitar
+    'bass',   # Bass
+    'pad',    # Strings
+    'pad',    # Ensemble
+    'lead',   # Brass
+    'lead',   # Reed
+    'lead',   # Pipe
+    'lead',   # Synth lead
+    'pad',    # Synth pad
+    'pad',    # Synth effects
+    'pluck',  # Ethnic
+    'pluck',  # Percussive
+    'pad'     # Sound effects
+]
+
+# Oscillator and ADSR settings by voice family (times in seconds)
+FAMILY_VOICES = {
+    'bass': {'waveform': 'saw', 'harmonics': 16, 'attack': 0.005, 'decay': 0.2,
+             'sustain': 0.6, 'release': 0.08, 'gain': 0.5},
+    'keys': {'waveform': 'triangle', 'harmonics': 32, 'attack': 0.005, 'decay': 0.8,
+             'sustain': 0.3, 'release': 0.3, 'gain': 0.35},
+    'pluck': {'waveform': 'saw', 'harmonics': 24, 'attack': 0.002, 'decay': 0.3,
+              'sustain': 0.0, 'release': 0.1, 'gain': 0.3},
+    'pad': {'waveform': 'saw', 'harmonics': 8, 'attack': 0.3, 'decay': 0.5,
+            'sustain': 0.7, 'release': 0.6, 'gain': 0.2},
+    'lead': {'waveform': 'square', 'harmonics': 32, 'attack': 0.01, 'decay': 0.1,
+             'sustain': 0.7, 'release': 0.15, 'gain': 0.25}
+}
+
+def note_to_frequency(note):
+    """
+    Get the frequency of a MIDI note.
+
+    Args:
+        note (int): MIDI note number
+
+    Returns:
+        float: Frequency in Hz
+    """
+    return 440.0 * 2.0 ** ((note - 69) / 12.0)
+
+def get_program_family(program):
+    """
+    Get the voice family of a GM program.
+
+    Args:
+        program (int): Program number (0-127)
+
+    Returns:
+        str: Voice family ('bass', 'keys', 'pluck', 'pad' or 'lead')
+    """
+    return PROGRAM_FAMILIES[program // 8]
+
+@lru_cache(maxsize=None)
+def build_wavetable(waveform, num_harmonics):
+    """
+    Build a band-limited single-cycle wavetable by additive synthesis.
+
+    Args:
+        waveform (str): Waveform ('sine', 'saw', 'square' or 'triangle')
+        num_harmonics (int): Number of harmonics
+
+    Returns:
+        ndarray: TABLE_SIZE samples with a peak of 1.0
+    """
+    phase = np.arange(TABLE_SIZE) / TABLE_SIZE
+    harmonics = np.arange(1, num_harmonics + 1)
+
+    if waveform == 'sine':
+        amplitudes = (harmonics == 1).astype(float)
+    elif waveform == 'saw':
+        amplitudes = 1.0 / harmonics
+    elif waveform == 'square':
+        amplitudes = (harmonics % 2) / harmonics
+    elif waveform == 'triangle':
+        amplitudes = (harmonics % 2) * (-1.0) ** ((harmonics - 1) // 2) / harmonics ** 2
+    else:
+        raise ValueError(f"Unknown waveform: {waveform}")
+
+    table = amplitudes @ np.sin(2.0 * np.pi * np.outer(harmonics, phase))
+    return (table / np.abs(table).max()).astype(np.float32)
+
+def build_envelope(num_frames, hold_frames, attack, decay, sustain, release, sample_rate):
+    """
+    Build an ADSR envelope.
+
+    Args:
+        num_frames (int): Length of the envelope (hold plus release)
+        hold_frames (int): Frames until the note-off
+        attack (float): Attack time in seconds
+        decay (float): Decay time in seconds
+        sustain (float): Sustain level (0.0-1.0)
+        release (float): Release time in seconds
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        ndarray: Envelope values
+    """
+    t = np.arange(num_frames) / sample_rate
+    envelope = np.interp(t, [0.0, attack, attack + decay], [0.0, 1.0, sustain])
+
+    # Fade from the level at the note-off
+    hold_time = hold_frames / sample_rate
+    level = np.interp(hold_time, [0.0, attack, attack + decay], [0.0, 1.0, sustain])
+    released = t >= hold_time
+    envelope[released] = level * np.maximum(0.0, 1.0 - (t[released] - hold_time) / release)
+    return envelope.astype(np.float32)
+
+# Rendered voices of the current process
+voice_cache = SampleCache(VOICE_CACHE_BYTES)
+
+def render_voice(family, note, hold_frames, sample_rate):
+    """
+    Render a melodic note at full velocity.
+
+    Voices are cached (see VOICE_CACHE_BYTES), since loop-based songs repeat
+    the same notes. The returned samples are shared and must not be changed.
+
+    Args:
+        family (str): Voice family
+        note (int): MIDI note number
+        hold_frames (int): Frames until the note-off
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        ndarray: Mono samples
+    """
+    key = (family, note, hold_frames, sample_rate)
+    samples = voice_cache.get(key)
+    if samples is not None:
+        return samples
+
+    voice = FAMILY_VOICES[family]
+    frequency = note_to_frequency(note)
+    num_frames = hold_frames + int(voice['release'] * sample_rate)
+
+    # Drop the harmonics above the Nyquist frequency
+    num_harmonics = int(min(voice['harmonics'], MAX_HARMONICS, sample_rate / 2.0 // frequency))
+    table = build_wavetable(voice['waveform'], max(1, num_harmonics))
+
+    positions = (np.arange(num_frames) * (frequency * TABLE_SIZE / sample_rate)) % TABLE_SIZE
+    samples = table[positions.astype(np.int64)]
+
+    envelope = build_envelope(num_frames, hold_frames, voice['attack'], voice['decay'],
+                              voice['sustain'], voice['release'], sample_rate)
+    samples = samples * envelope * voice['gain']
+    voice_cache.put(key, samples)
+    return samples
+
+def iter_timed_messages(midi_file):
+    """
+    Iterate over the messages of a MIDI file with their absolute times.
+
+    Times are computed from the absolute tick of each message and the tempo
+    in effect, rather than by summing delta times in seconds, so a message
+    lands on the same frame whatever other messages the file contains.
+
+    Args:
+        midi_file (MidiFile): MIDI file object
+
+    Yields:
+        tuple: (time in seconds, message)
+    """
+    ticks_per_beat = midi_file.ticks_per_beat
+    tempo = 500000
+    tempo_tick = 0
+    tempo_seconds = 0.0
+
+    absolute_tick = 0
+    for msg in mido.merge_tracks(midi_file.tracks):
+        absolute_tick += msg.time
+        seconds = tempo_seconds + mido.tick2second(absolute_tick - tempo_tick, ticks_per_beat, tempo)
+        yield seconds, msg
+
+        if msg.type == 'set_tempo':
+            tempo, tempo_tick, tempo_seconds = msg.tempo, absolute_tick, seconds
+
+def get_note_events(midi_file):
+    """
+    Get the notes of a MIDI file with the channel state at each note.
+
+    Args:
+        midi_file (MidiFile): MIDI file object
+
+    Returns:
+        tuple: (list of (start, end, channel, note, velocity, program, volume,
+            pan) tuples with times in seconds, song length in seconds)
+    """
+    programs = defaultdict(int)
+    controls = defaultdict(lambda: {7: 100, 10: 64, 11: 127})
+    open_notes = defaultdict(deque)
+    notes = []
+
+    current_time = 0.0
+    for current_time, msg in iter_timed_messages(midi_file):
+        if msg.type == 'program_change':
+            programs[msg.channel] = msg.program
+        elif msg.type == 'control_change':
+            controls[msg.channel][msg.control] = msg.value
+        elif msg.type == 'note_on' and msg.velocity > 0:
+            state = controls[msg.channel]
+            volume = state[7] / 127.0 * state[11] / 127.0
+            open_notes[(msg.channel, msg.note)].append(
+                (current_time, msg.velocity, programs[msg.channel], volume, state[10])
+            )
+        elif msg.type in ('note_on', 'note_off'):
+            key = (msg.channel, msg.note)
+            if open_notes[key]:
+                start, velocity, program, volume, pan = open_notes[key].popleft()
+                notes.append((start, current_time, msg.channel, msg.note, velocity, program, volume, pan))
+
+    # Close notes that are never released
+    for (channel, note), pending in open_notes.items():
+        for start, velocity, program, volume, pan in pending:
+            notes.append((start, current_time, channel, note, velocity, program, volume, pan))
+
+    return notes, current_time
+
+def limit_polyphony(notes, polyphony):
+    """
+    Drop the melodic notes that would exceed a voice limit.
+
+    A note is dropped when it starts while the limit of notes is already
+    held. Drum hits are never dropped.
+
+    Args:
+        notes (list): List of (start, end, channel, note, velocity, program,
+            volume, pan) tuples with times in seconds
+        polyphony (int): Most melodic notes held at once
+
+    Returns:
+        list: Kept notes in start order
+    """
+    held = []
+    kept = []
+    for note in sorted(notes):
+        start, end, channel = note[:3]
+        if channel not in DRUM_CHANNELS:
+            while held and held[0] <= start:
+                heapq.heappop(held)
+            if len(held) >= polyphony:
+                continue
+            heapq.heappush(held, end)
+        kept.append(note)
+    return kept
+
+class NumpySynthRenderer:
+    """
+    Software synthesizer rendering MIDI files with NumPy.
+
+    Melodic channels use band-limited wavetables with an ADSR envelope chosen
+    by the voice family of the channel program. Drum channels are mixed by
+    a DrumKit. Volume, expression and pan are read at each note-on. Effect
+    controllers are only rendered with an effects chain, which renders every
+    channel on its own; pitch bend is not rendered.
+    """
+
+    def __init__(self, sample_rate=44100, tail=TAIL_SECONDS, drum_kit=None, polyphony=None, channels=2,
+                 effects=None):
+        """
+        Initialize the renderer.
+
+        Args:
+            sample_rate (int): Sample rate in Hz
+            tail (float): Seconds rendered after the last note
+            drum_kit (DrumKit): Drum samples (synthesized one-shots if None)
+            polyphony (int): Most melodic notes held at once (no limit if None)
+            channels (int): Channels of the WAV files written by render()
+            effects (EffectsChain): Effects applied to every channel (no
+                effects if None)
+        """
+        self.sample_rate = sample_rate
+        self.tail = tail
+        self.drum_kit = drum_kit or DrumKit(sample_rate=sample_rate)
+        self.polyphony = polyphony
+        self.channels = channels
+        self.effects = effects
+
+    def get_voice(self, note, program, duration):
+        """
+        Get the samples of a melodic note at full velocity.
+
+        Args:
+            note (int): MIDI note number
+            program (int): Program number (0-127)
+            duration (float): Duration in seconds
+
+        Returns:
+            ndarray: Mono samples
+        """
+        hold_frames = max(1, int(round(duration * self.sample_rate)))
+        return render_voice(get_program_family(program), note, hold_frames, self.sample_rate)
+
+    def render_notes(self, notes, length, tail=None):
+        """
+        Mix notes into a stereo buffer.
+
+        Args:
+            notes (list): List of (start, end, channel, note, velocity,
+                program, volume, pan) tuples with times in seconds
+            length (float): Song length in seconds
+            tail (float): Seconds rendered after the song (self.tail if None)
+
+        Returns:
+            ndarray: float32 stereo samples with shape (frames, 2)
+        """
+        tail = self.tail if tail is None else tail
+        num_frames = int((length + tail) * self.sample_rate)
+        if self.polyphony is not None:
+            notes = limit_polyphony(notes, self.polyphony)
+        output = self.drum_kit.render_notes(notes, num_frames)
+
+        for start, end, channel, note, velocity, program, volume, pan in notes:
+            if channel in DRUM_CHANNELS:
+                continue
+            voice = self.get_voice(note, program, end - start)
+
+            offset = seconds_to_frames(start, self.sample_rate)
+            voice = voice[:num_frames - offset]
+
+            # Equal-power pan
+            angle = pan / 127.0 * np.pi / 2.0
+            gain = velocity / 127.0 * volume
+            output[offset:offset + len(voice), 0] += voice * (gain * np.cos(angle))
+            output[offset:offset + len(voice), 1] += voice * (gain * np.sin(angle))
+
+        return output
+
+    def render_samples(self, midi_file, normalize=True, tail=None):
+        """
+        Render a MIDI file to a sample buffer.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            normalize (bool): Scale the mix down to PEAK_LEVEL if it is louder
+            tail (float): Seconds rendered after the last note (self.tail if None)
+
+        Returns:
+            ndarray: float32 stereo samples with shape (frames, 2)
+        """
+        if not isinstance(midi_file, mido.MidiFile):
+            midi_file = mido.MidiFile(midi_file)
+
+        notes, length = get_note_events(midi_file)
+        if self.effects is None:
+            output = self.render_notes(notes, length, tail)
+        else:
+            channel_notes = defaultdict(list)
+            for note in notes:
+                channel_notes[note[2]].append(note)
+            channel_samples = {channel: self.render_notes(notes, length, tail)
+                               for channel, notes in channel_notes.items()}
+            output = self.effects.process(channel_samples, midi_file)
+
+        # Scale the mix down to leave headroom
+        peak = np.abs(output).max(initial=0.0)
+        if normalize and peak > PEAK_LEVEL:
+            output *= PEAK_LEVEL / peak
+
+        return output
+
+    def render(self, midi_file, output_wav):
+        """
+        Render a MIDI file to a WAV file.
+
+        Args:
+            midi_file (str or MidiFile): MIDI file path or object
+            output_wav (str or file): Output path or writable binary file object
+
+        Returns:
+            dict: Timing of the render in seconds ('render')
+        """
+        start = time.perf_counter()
+        samples = self.render_samples(midi_file)
+        write_wav(output_wav, to_mono(samples) if self.channels == 1 else samples, self.sample_rate)
+        return {'render': time.perf_counter() - start}
+
+    def close(self):
+        """Release the renderer (nothing to release)."""
@@ -0,0 +1,42 @@
+"""
+Tiers module for the audio rendering system.
+Provides the named render quality tiers, from cheap previews to full
+quality masters.
+"""
+
+# Render settings by tier name
+RENDER_TIERS = {
+    'preview': {
+        'sample_rate': 22050,
+        'channels': 1,
+        'polyphony': 32,      # Most voices sounding at once
+        'effects': False,     # Reverb and chorus
+        'loudness': -14.0     # Integrated loudness target in LUFS
+    },
+    'master': {
+        'sample_rate': 44100,
+        'channels': 2,
+        'polyphony': 256,
+        'effects': True,
+        'loudness': -14.0
+    }
+}
+
+# Tier used when none is requested
+DEFAULT_TIER = 'master'
+
+def get_tier(tier=None):
+    """
+    Get the render settings of a tier.
+
+    Args:
+        tier (str): Tier name (DEFAULT_TIER if None)
+
+    Returns:
+        dict: Sample rate, channels, polyphony, effects and loudness target
+            of the tier
+    """
+    tier = tier or DEFAULT_TIER
+    if tier not in RENDER_TIERS:
+        raise ValueError(f"Unknown render tier: {tier}")
+    return RENDER_TIERS[tier]
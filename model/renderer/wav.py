@@ -0,0 +1,146 @@
+"""
+WAV module for the audio rendering system.
+Provides functions for converting sample buffers and reading and writing WAV files.
+"""
+
+import struct
+import wave
+import numpy as np
+
+# Data size written to the header of a WAV stream whose length is not known
+STREAMING_SIZE = 0xFFFFFFFF
+
+def to_int16(samples):
+    """
+    Convert a sample buffer to 16-bit PCM.
+
+    Args:
+        samples (ndarray): Float samples in [-1.0, 1.0] or int16 samples
+
+    Returns:
+        ndarray: int16 samples
+    """
+    if samples.dtype == np.int16:
+        return samples
+    return (np.clip(samples, -1.0, 1.0) * 32767.0).astype(np.int16)
+
+def to_float(samples):
+    """
+    Convert a sample buffer to float samples in [-1.0, 1.0].
+
+    Args:
+        samples (ndarray): int16 or float samples
+
+    Returns:
+        ndarray: float32 samples
+    """
+    if samples.dtype == np.int16:
+        return samples.astype(np.float32) / 32768.0
+    return samples.astype(np.float32, copy=False)
+
+def to_mono(samples):
+    """
+    Mix a stereo sample buffer down to mono.
+
+    Args:
+        samples (ndarray): int16 or float samples with shape (frames, 2)
+
+    Returns:
+        ndarray: float32 samples with shape (frames, 1)
+    """
+    return to_float(samples).mean(axis=1, keepdims=True)
+
+def seconds_to_frames(seconds, sample_rate):
+    """
+    Convert times in seconds to frame positions.
+
+    Products are rounded to 6 decimals before flooring, which absorbs the
+    float error of tick to second conversions, so a tick lands on the same
+    frame whether it is measured from the song start or from a section start.
+
+    Args:
+        seconds (float or ndarray): Times in seconds
+        sample_rate (int): Sample rate in Hz
+
+    Returns:
+        int or ndarray: Frame positions
+    """
+    frames = np.floor(np.round(np.asarray(seconds) * sample_rate, 6)).astype(np.int64)
+    return int(frames) if frames.ndim == 0 else frames
+
+def write_wav(output_wav, samples, sample_rate):
+    """
+    Write a sample buffer to a 16-bit WAV file.
+
+    Args:
+        output_wav (str or file): Output path or writable binary file object
+        samples (ndarray): Samples with shape (frames,) or (frames, channels)
+        sample_rate (int): Sample rate in Hz
+    """
+    samples = to_int16(samples)
+    num_channels = 1 if samples.ndim == 1 else samples.shape[1]
+
+    with wave.open(output_wav, 'wb') as wav_file:
+        wav_file.setnchannels(num_channels)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(np.ascontiguousarray(samples).tobytes())
+
+def read_wav(input_wav):
+    """
+    Read a 16-bit WAV file.
+
+    Args:
+        input_wav (str or file): Input path or readable binary file object
+
+    Returns:
+        tuple: (int16 samples with shape (frames, channels), sample rate)
+    """
+    with wave.open(input_wav, 'rb') as wav_file:
+        num_channels = wav_file.getnchannels()
+        sample_rate = wav_file.getframerate()
+        frames = wav_file.readframes(wav_file.getnframes())
+
+    samples = np.frombuffer(frames, dtype=np.int16).reshape(-1, num_channels)
+    return samples, sample_rate
+
+def build_wav_header(sample_rate, num_channels=2, num_frames=None):
+    """
+    Build the header of a 16-bit WAV file.
+
+    Args:
+        sample_rate (int): Sample rate in Hz
+        num_channels (int): Number of channels
+        num_frames (int): Number of frames (None for a stream of unknown
+            length, which sets the sizes to STREAMING_SIZE)
+
+    Returns:
+        bytes: 44-byte RIFF header
+    """
+    block_align = num_channels * 2
+    if num_frames is None:
+        data_size = riff_size = STREAMING_SIZE
+    else:
+        data_size = num_frames * block_align
+        riff_size = data_size + 36
+
+    return (struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE')
+            + struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, num_channels, sample_rate,
+                          sample_rate * block_align, block_align, 16)
+            + struct.pack('<4sI', b'data', data_size))
+
+def iter_wav_bytes(chunks, sample_rate, num_channels=2):
+    """
+    Encode a stream of sample buffers as a WAV stream.
+
+    Args:
+        chunks (iterable): Sample buffers with shape (frames, channels)
+        sample_rate (int): Sample rate in Hz
+        num_channels (int): Number of channels
+
+    Yields:
+        bytes: The header, then the 16-bit PCM data of each chunk
+    """
+    yield build_wav_header(sample_rate, num_channels)
+    for samples in chunks:
+        yield np.ascontiguousarray(to_int16(samples)).tobytes()
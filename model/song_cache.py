@@ -0,0 +1,221 @@
+"""
+Song cache module.
+Provides a content-addressed on-disk cache of generated songs (MIDI and
+rendered audio), bounded by size with least recently used eviction.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+# Version of the generation pipeline, part of every key; bump it when
+# changes to the composer or renderer would change cached songs
+CACHE_VERSION = 2
+
+# Default size bound of a song cache in bytes
+SONG_CACHE_BYTES = 1024 * 1024 * 1024
+
+# Seconds an unreferenced blob is kept, since another worker may be about
+# to write the entry that references it
+BLOB_GRACE_SECONDS = 60.0
+
+def get_cache_key(params):
+    """
+    Get the cache key of generation parameters.
+
+    Args:
+        params (dict): JSON serializable parameters
+
+    Returns:
+        str: SHA-256 of the canonical JSON of the parameters and CACHE_VERSION
+    """
+    data = json.dumps(dict(params, version=CACHE_VERSION), sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+def write_atomic(path, data):
+    """
+    Write a file so readers see either nothing or all of it.
+
+    Args:
+        path (str): Output path
+        data (bytes): File contents
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+class SongCache:
+    """
+    On-disk cache of songs keyed by their generation parameters.
+
+    Entries (entries/<key>.json) point to blobs stored by the SHA-256 of their
+    contents (blobs/<hash>), so identical songs are stored once. Files are
+    written atomically and readers tolerate entries evicted under them, so
+    workers in several processes can share a cache directory. The entry
+    modification time is the last use.
+    """
+
+    def __init__(self, directory, max_bytes=SONG_CACHE_BYTES):
+        """
+        Initialize the cache.
+
+        Args:
+            directory (str): Cache directory (created if missing)
+            max_bytes (int): Most bytes of blobs kept in the cache
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries_dir = os.path.join(directory, 'entries')
+        self.blobs_dir = os.path.join(directory, 'blobs')
+        os.makedirs(self.entries_dir, exist_ok=True)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_entry_path(self, key):
+        """Path of the entry of a cache key."""
+        return os.path.join(self.entries_dir, f"{key}.json")
+
+    def get_blob_path(self, content_hash):
+        """Path of the blob of a content hash."""
+        return os.path.join(self.blobs_dir, content_hash)
+
+    def get(self, params):
+        """
+        Get a cached song.
+
+        Args:
+            params (dict): Generation parameters
+
+        Returns:
+            bytes: Cached data, or None if it is not cached
+        """
+        entry_path = self.get_entry_path(get_cache_key(params))
+        try:
+            with open(entry_path) as f:
+                entry = json.load(f)
+            with open(self.get_blob_path(entry['blob']), 'rb') as f:
+                data = f.read()
+            os.utime(entry_path)
+        except (OSError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        return data
+
+    def put(self, params, data):
+        """
+        Add a song, evicting the least recently used songs over the bound.
+
+        Args:
+            params (dict): Generation parameters
+            data (bytes): Data to cache
+
+        Returns:
+            str: SHA-256 of the data
+        """
+        content_hash = hashlib.sha256(data).hexdigest()
+        blob_path = self.get_blob_path(content_hash)
+        if os.path.exists(blob_path):
+            os.utime(blob_path)
+        else:
+            write_atomic(blob_path, data)
+
+        entry = {'blob': content_hash, 'size': len(data), 'params': params, 'created': time.time()}
+        write_atomic(self.get_entry_path(get_cache_key(params)), json.dumps(entry).encode('utf-8'))
+        self.evict()
+        return content_hash
+
+    def scan(self):
+        """
+        List the entries and blobs on disk.
+
+        Returns:
+            tuple: (entries as (last use, path, blob hash) sorted oldest
+                first, blob sizes by hash, blob modification times by hash)
+        """
+        entries = []
+        for name in os.listdir(self.entries_dir):
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self.entries_dir, name)
+            try:
+                with open(path) as f:
+                    entries.append((os.path.getmtime(path), path, json.load(f)['blob']))
+            except (OSError, ValueError, KeyError):
+                continue
+        entries.sort()
+
+        sizes, modified = {}, {}
+        for name in os.listdir(self.blobs_dir):
+            if name.startswith('.'):
+                continue
+            try:
+                status = os.stat(os.path.join(self.blobs_dir, name))
+            except OSError:
+                continue
+            sizes[name], modified[name] = status.st_size, status.st_mtime
+        return entries, sizes, modified
+
+    def evict(self):
+        """Remove the least recently used entries over the bound, then unreferenced blobs."""
+        entries, sizes, modified = self.scan()
+        references = Counter(blob for _, _, blob in entries)
+        size = sum(sizes.values())
+
+        for _, path, blob in entries:
+            if size <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            references[blob] -= 1
+            if references[blob] == 0 and blob in sizes:
+                self.remove_blob(blob)
+                size -= sizes.pop(blob)
+
+        now = time.time()
+        for blob in list(sizes):
+            if references[blob] <= 0 and now - modified[blob] > BLOB_GRACE_SECONDS:
+                self.remove_blob(blob)
+
+    def remove_blob(self, content_hash):
+        """Delete a blob, if another worker has not already."""
+        try:
+            os.unlink(self.get_blob_path(content_hash))
+        except OSError:
+            pass
+
+    def stats(self):
+        """
+        Get the cache statistics.
+
+        Returns:
+            dict: Cached entries, size in bytes, hits, misses and hit rate
+                (hits and misses of this process)
+        """
+        entries, sizes, _ = self.scan()
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(entries),
+                'bytes': sum(sizes.values()),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
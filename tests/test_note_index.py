@@ -0,0 +1,44 @@
+"""
+Tests for the note index: indexed notes must stay sorted, disjoint intervals
+whatever notes are added.
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from model.composer.note_index import NOTE_POLICIES, NoteIndex
+
+def check_intervals(index):
+    """Assert every channel and pitch of an index holds sorted, disjoint intervals."""
+    for key, starts in index.starts.items():
+        ends = index.ends[key]
+        assert len(starts) == len(ends) == len(index.notes[key])
+        for i, (start, end) in enumerate(zip(starts, ends)):
+            assert start < end, (key, i, start, end)
+            if i + 1 < len(starts):
+                assert end <= starts[i + 1], (key, i, end, starts[i + 1])
+
+@pytest.mark.parametrize('policy', NOTE_POLICIES)
+@pytest.mark.parametrize('seed', [0, 1, 2, 3])
+def test_random_notes_stay_sorted_and_disjoint(policy, seed):
+    rng = random.Random(seed)
+    index = NoteIndex(policy)
+    track = object()
+    for _ in range(2000):
+        index.add(track, rng.randrange(2), rng.randrange(60, 63), rng.randrange(1, 128),
+                  rng.randrange(0, 480 * 8, 30), rng.choice([0, 0, 1, 30, 120, 480, 960]))
+        check_intervals(index)
+
+@pytest.mark.parametrize('policy', NOTE_POLICIES)
+def test_zero_length_notes(policy):
+    index = NoteIndex(policy)
+    track = object()
+    for start in [480, 480, 0, 960, 481]:
+        index.add(track, 0, 60, 100, start, 0)
+    check_intervals(index)
+    assert index.starts[(0, 60)][0] == 0
@@ -0,0 +1,100 @@
+"""
+Conformance tests for the MIDI track strategies: every strategy must write
+byte-identical files.
+"""
+
+import io
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from model.composer.midi_utils import TRACK_STRATEGIES, finalize_midi_file
+from model.composer.midi_utils2 import add_chord, add_control_change, add_note, add_pitch_bend, create_midi_file
+from model.composer.music_generator import generate_music
+from model.composer.music_theory import MAJOR_SCALE, MINOR_SCALE
+from model.composer.note_index import NOTE_POLICIES
+
+STRATEGIES = sorted(TRACK_STRATEGIES)
+
+def get_bytes(midi_file):
+    """Bytes of a MIDI file as saved to disk."""
+    buffer = io.BytesIO()
+    midi_file.save(file=buffer)
+    return buffer.getvalue()
+
+def compose(seed, strategy, note_policy, scale_type=MAJOR_SCALE):
+    """Compose a seeded song with a track strategy and return its bytes."""
+    random.seed(seed)
+    np.random.seed(seed)
+    midi_file = generate_music(
+        output_file=None,
+        tempo=120,
+        key=60,
+        scale_type=scale_type,
+        num_bars=44,
+        style='trap',
+        midi_strategy=strategy,
+        note_policy=note_policy
+    )
+    return get_bytes(midi_file)
+
+@pytest.mark.parametrize('note_policy', list(NOTE_POLICIES) + [None])
+@pytest.mark.parametrize('seed', [7, 1234])
+def test_songs_identical_across_strategies(seed, note_policy):
+    songs = {strategy: compose(seed, strategy, note_policy) for strategy in STRATEGIES}
+    assert len(set(songs.values())) == 1, {strategy: len(data) for strategy, data in songs.items()}
+
+def test_minor_song_identical_across_strategies():
+    songs = {strategy: compose(42, strategy, 'truncate', MINOR_SCALE) for strategy in STRATEGIES}
+    assert len(set(songs.values())) == 1
+
+def write_random_events(strategy, seed, num_events=500):
+    """Write random notes, controllers and pitch bends through midi_utils2."""
+    rng = random.Random(seed)
+    midi_file, tracks_by_channel = create_midi_file(tempo=110, strategy=strategy)
+    for _ in range(num_events):
+        channel = rng.randrange(16)
+        track = tracks_by_channel[channel]
+        time = rng.randrange(0, 480 * 64, 60)
+        kind = rng.random()
+        if kind < 0.6:
+            add_note(track, rng.randrange(36, 96), rng.randrange(1, 128), time, rng.randrange(30, 960), channel)
+        elif kind < 0.85:
+            add_control_change(track, rng.choice([1, 7, 10, 11, 74]), rng.randrange(128), time, channel)
+        else:
+            add_pitch_bend(track, rng.randrange(-8192, 8192), time, channel)
+    return get_bytes(finalize_midi_file(midi_file))
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_random_events_identical_across_strategies(seed):
+    files = {strategy: write_random_events(strategy, seed) for strategy in STRATEGIES}
+    assert len(set(files.values())) == 1
+
+def write_chords(strategy):
+    """Write chords with out-of-range velocities through midi_utils2."""
+    midi_file, tracks_by_channel = create_midi_file(tempo=110, strategy=strategy)
+    add_chord(tracks_by_channel[0], [60, 64, 67], 200, 0, 480, 0)
+    add_chord(tracks_by_channel[1], [48, 55], 0, 240, 480, 1)
+    return finalize_midi_file(midi_file)
+
+@pytest.mark.parametrize('strategy', STRATEGIES)
+def test_add_chord_clamps_velocity(strategy):
+    midi_file = write_chords(strategy)
+    velocities = {
+        msg.channel: msg.velocity
+        for track in midi_file.tracks for msg in track if msg.type == 'note_on' and msg.velocity > 0
+    }
+    assert velocities == {0: 127, 1: 1}
+
+def test_chords_identical_across_strategies():
+    files = {strategy: get_bytes(write_chords(strategy)) for strategy in STRATEGIES}
+    assert len(set(files.values())) == 1
+
+def test_unknown_strategy_rejected():
+    with pytest.raises(ValueError):
+        create_midi_file(strategy='unknown')